@@ -0,0 +1,413 @@
+import contextvars
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import config
+import metrics
+import result_cache
+import scheduler
+from chunking import TokenBudgetError, check_budget, chunk_text, count_tokens
+from llm_client import call_perplexity_api, get_client
+from prompts import (
+    PROMPT_VERSION,
+    build_category_prompt,
+    build_chunk_prompt,
+    build_combined_chunk_prompt,
+    build_combined_prompt,
+    build_reduce_prompt,
+    split_combined_response,
+)
+
+logger = logging.getLogger(__name__)
+
+# How often the engine wakes up to check for timed-out work (seconds)
+POLL_INTERVAL = 0.25
+
+# Ways to send a multi-category run (see config.ANALYSIS_MODE)
+AUTO = "auto"
+COMBINED = "combined"
+PER_CATEGORY = "per_category"
+
+
+class CategoryTimeoutError(TimeoutError):
+    """Raised (as a yielded error) when a single item exceeds its timeout."""
+
+
+# Function to run fn(item) for every item in a bounded thread pool and yield results as they finish
+def run_concurrently(fn, items, max_workers=None, timeout=None, on_poll=None):
+    """Yields (item, result, error) tuples in completion order.
+
+    Exactly one of result/error is set. The timeout applies to each item
+    individually, measured from the moment a worker starts on it, so one slow
+    item never delays the others from being reported. Time the item's LLM calls
+    spend queued in the scheduler does not count; the scheduler bounds that
+    wait itself with config.LLM_QUEUE_MAX_WAIT. `on_poll`, if given, is
+    called from the consuming thread on every wake-up, which lets callers
+    render progress that workers hand over through a queue.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    max_workers = max_workers or config.MAX_CONCURRENCY
+    timeout = config.CATEGORY_TIMEOUT if timeout is None else timeout
+
+    clocks = {}
+    lock = threading.Lock()
+
+    def run(item):
+        with scheduler.queue_clock() as clock:
+            with lock:
+                clocks[item] = clock
+            return fn(item)
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(items))),
+        thread_name_prefix="realm-analysis",
+    )
+    # Each item runs in a copy of the caller's context, so metrics spans reach the caller's run
+    futures = {executor.submit(contextvars.copy_context().run, run, item): item for item in items}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            if on_poll is not None:
+                on_poll()
+            for future in done:
+                item = futures[future]
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    logger.error(f"Analysis of {item} failed: {str(e)}")
+                    yield item, None, e
+
+            if not timeout:
+                continue
+            now = time.monotonic()
+            for future in list(pending):
+                item = futures[future]
+                with lock:
+                    clock = clocks.get(item)
+                if clock is not None and clock.elapsed(now) > timeout:
+                    # The worker thread cannot be interrupted; we stop waiting for it
+                    # and let the HTTP timeouts reclaim it.
+                    pending.discard(future)
+                    future.cancel()
+                    logger.warning(f"Analysis of {item} timed out after {timeout:.0f}s")
+                    yield item, None, CategoryTimeoutError(f"{item} timed out after {timeout:.0f} seconds")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Function to work out how many partial findings one merge prompt can take
+def reduce_fan_in(category):
+    overhead = count_tokens(build_reduce_prompt(category, []))
+    fan_in = (config.MODEL_CONTEXT_TOKENS - config.RESPONSE_TOKENS - overhead) // config.MAP_RESPONSE_TOKENS
+    if fan_in < 2:
+        raise TokenBudgetError("MAP_RESPONSE_TOKENS is too large for the model context; findings cannot be merged")
+    return fan_in
+
+
+# Function to build and budget-check the chunk prompts for one category before any call is made.
+# Returns (prompts, total prompt tokens).
+def plan_chunk_prompts(category, chunks):
+    prompts = [build_chunk_prompt(category, chunk, i, len(chunks)) for i, chunk in enumerate(chunks, start=1)]
+    tokens = sum(check_budget(prompt, config.MAP_RESPONSE_TOKENS) for prompt in prompts)
+    reduce_fan_in(category)
+    return prompts, tokens
+
+
+# Function to estimate how many sequential call rounds a map-reduce run needs, for scaling timeouts
+def map_reduce_rounds(chunk_count, fan_in):
+    rounds = math.ceil(chunk_count / max(1, config.CHUNK_CONCURRENCY))
+    while chunk_count > fan_in:
+        chunk_count = math.ceil(chunk_count / fan_in)
+        rounds += 1
+    return rounds + 1
+
+
+# Function to merge per-chunk findings for one category, hierarchically while they exceed one prompt
+def reduce_findings(category, partials, call, final_call=None):
+    """`call(prompt, max_tokens)` returns a completion; `final_call(prompt)` produces the
+    final merged analysis and defaults to `call` (it is where callers stream)."""
+    final_call = final_call or (lambda prompt: call(prompt, None))
+
+    # Merge in groups until the remaining findings fit one final prompt
+    fan_in = reduce_fan_in(category)
+    while len(partials) > fan_in:
+        groups = [partials[i:i + fan_in] for i in range(0, len(partials), fan_in)]
+        merged = [None] * len(groups)
+        reduced = run_concurrently(
+            lambda i: call(build_reduce_prompt(category, groups[i], final=False), config.MAP_RESPONSE_TOKENS),
+            range(len(groups)),
+            config.CHUNK_CONCURRENCY,
+        )
+        for index, result, error in reduced:
+            if error is not None:
+                raise error
+            merged[index] = result
+        partials = merged
+
+    prompt = build_reduce_prompt(category, partials)
+    check_budget(prompt)
+    return final_call(prompt)
+
+
+# Function to call every chunk prompt in parallel and return the completions in chunk order
+def map_chunks(chunk_prompts, call, max_tokens):
+    partials = [None] * len(chunk_prompts)
+    mapped = run_concurrently(
+        lambda i: call(chunk_prompts[i], max_tokens),
+        range(len(chunk_prompts)),
+        config.CHUNK_CONCURRENCY,
+    )
+    for index, result, error in mapped:
+        if error is not None:
+            raise error
+        partials[index] = result
+    return partials
+
+
+# Function to analyse one category of a large document: map over its chunks in parallel, then merge
+def map_reduce(category, chunk_prompts, call, final_call=None):
+    partials = map_chunks(chunk_prompts, call, config.MAP_RESPONSE_TOKENS)
+    logger.info(f"Mapped {len(partials)} chunks for {category}")
+    return reduce_findings(category, partials, call, final_call)
+
+
+# Function to build and budget-check combined prompts covering several categories at once.
+# Single-pass documents get one prompt, chunked ones one per chunk. Returns (prompts, total prompt tokens).
+def plan_combined_prompts(categories, content, chunks=None):
+    if chunks is None:
+        prompts = [build_combined_prompt(categories, content)]
+        response_tokens = config.RESPONSE_TOKENS * len(categories)
+    else:
+        prompts = [build_combined_chunk_prompt(categories, chunk, i, len(chunks)) for i, chunk in enumerate(chunks, start=1)]
+        response_tokens = config.MAP_RESPONSE_TOKENS * len(categories)
+        for category in categories:
+            reduce_fan_in(category)
+    tokens = sum(check_budget(prompt, response_tokens) for prompt in prompts)
+    return prompts, tokens
+
+
+# Function to map every chunk once for several categories and split the findings by category
+def map_combined(categories, chunk_prompts, call):
+    partials = map_chunks(chunk_prompts, call, config.MAP_RESPONSE_TOKENS * len(categories))
+    findings = {category: [] for category in categories}
+    for index, text in enumerate(partials, start=1):
+        sections = split_combined_response(text, categories)
+        for category in categories:
+            if category in sections:
+                findings[category].append(sections[category])
+            elif not sections:
+                # The reply ignored the section headings; every category gets all of it
+                findings[category].append(text)
+            else:
+                findings[category].append(f"Part {index} reported no {category} findings.")
+    logger.info(f"Mapped {len(partials)} chunks for {', '.join(categories)} in combined calls")
+    return findings
+
+
+# Function to decide between one combined request and parallel per-category requests
+def choose_mode(mode, categories, per_category_tokens, combined_tokens):
+    if len(categories) < 2 or combined_tokens is None or mode == PER_CATEGORY:
+        return PER_CATEGORY
+    if mode == COMBINED:
+        return COMBINED
+    # "auto": parallel calls finish sooner, so only give them up when it saves enough input tokens
+    return COMBINED if per_category_tokens - combined_tokens >= config.COMBINED_MIN_SAVED_TOKENS else PER_CATEGORY
+
+
+# Function to map content to selected 5C categories with concurrent API calls, yielding
+# (category, result, error) as each one finishes
+def map_to_5c(content, selected_categories, max_workers=None, timeout=None, on_delta=None, stats=None, mode=None):
+    # Streamed deltas are handed from the worker threads to on_delta(category, text_so_far),
+    # which runs in the thread consuming this generator (e.g. the Streamlit script thread).
+    # If a `stats` dict is passed, it receives token counts and latency for each category sent to the API.
+    # `mode` overrides config.ANALYSIS_MODE for this run.
+    mode = mode or config.ANALYSIS_MODE
+    deltas = queue.Queue()
+    partial = {}
+    finished = set()
+
+    def respond(category, prompt):
+        if on_delta is None:
+            return call_perplexity_api(prompt)
+        parts = []
+        for delta in call_perplexity_api(prompt, stream=True):
+            parts.append(delta)
+            deltas.put((category, delta))
+        return "".join(parts)
+
+    def respond_combined(categories):
+        if on_delta is None:
+            return call_perplexity_api(combined_prompts[0])
+        # Route the single stream to the category whose section is being written
+        text = ""
+        shown = {}
+        for delta in call_perplexity_api(combined_prompts[0], stream=True):
+            text += delta
+            # Hold back the unfinished last line, which may be the start of the next heading
+            complete = text[:text.rfind("\n") + 1]
+            for category, section in split_combined_response(complete, categories).items():
+                previous = shown.get(category, "")
+                if len(section) > len(previous) and section.startswith(previous):
+                    deltas.put((category, section[len(previous):]))
+                    shown[category] = section
+        return text
+
+    def call(prompt, max_tokens):
+        return call_perplexity_api(prompt, max_tokens=max_tokens)
+
+    def record(category, result, started):
+        if stats is not None:
+            stats[category] = {
+                # A combined prompt is shared, so each category is charged an equal part of it
+                "prompt_tokens": shared_tokens if category in combined_categories else plan_tokens[category],
+                "completion_tokens": count_tokens(result),
+                "latency_ms": int((time.perf_counter() - started) * 1000),
+            }
+
+    def analyze(category):
+        started = time.perf_counter()
+        if chunks is None:
+            result = respond(category, plans[category])
+        elif findings is not None:
+            # Chunks were already mapped once for all categories; only the merge is per category
+            result = reduce_findings(category, findings[category], call, lambda prompt: respond(category, prompt))
+        else:
+            # Large documents: per-chunk findings first, then a streamed merge into one analysis
+            result = map_reduce(category, plans[category], call, lambda prompt: respond(category, prompt))
+        record(category, result, started)
+        return result
+
+    def flush_deltas():
+        updated = set()
+        while True:
+            try:
+                category, delta = deltas.get_nowait()
+            except queue.Empty:
+                break
+            if category not in finished:
+                partial[category] = partial.get(category, "") + delta
+                updated.add(category)
+        for category in updated:
+            on_delta(category, partial[category])
+
+    def finish(category, result, error):
+        finished.add(category)
+        if error is None:
+            results[category] = result
+            if cache is not None:
+                cache.put(keys[category], category, model, result)
+        return category, result, error
+
+    results = {}
+    misses = list(selected_categories)
+    cache = result_cache.get_cache() if config.CACHE_ENABLED else None
+    if cache is not None:
+        # Cached categories are returned straight away; only the misses go to the API
+        model = get_client().model
+        document_hash = result_cache.hash_document(content)
+        keys = {category: result_cache.make_key(document_hash, category, PROMPT_VERSION, model) for category in selected_categories}
+        misses = []
+        for category in selected_categories:
+            cached = cache.get(keys[category])
+            if cached is None:
+                misses.append(category)
+                continue
+            results[category] = cached
+            yield category, cached, None
+        logger.info(f"Analysis cache: {len(selected_categories) - len(misses)} hits, {len(misses)} misses")
+
+    # Plan every prompt and enforce token budgets before any call is made
+    planning_started = time.perf_counter()
+    chunks = None
+    if misses:
+        document_tokens = count_tokens(content)
+        if document_tokens > config.SINGLE_PASS_MAX_TOKENS:
+            chunks = chunk_text(content, config.CHUNK_TOKENS, config.CHUNK_OVERLAP_TOKENS)
+            logger.info(f"Document has {document_tokens} tokens; analysing it as {len(chunks)} chunks")
+
+    plans = {}
+    plan_tokens = {}
+    plan_errors = []
+    for category in list(misses):
+        try:
+            if chunks is None:
+                prompt = build_category_prompt(category, content)
+                plan_tokens[category] = check_budget(prompt)
+                plans[category] = prompt
+            else:
+                plans[category], plan_tokens[category] = plan_chunk_prompts(category, chunks)
+        except ValueError as e:
+            misses.remove(category)
+            plan_errors.append((category, e))
+
+    # Price the same run as one combined request, then pick the mode; both counts are logged either way
+    combined_prompts, combined_tokens = None, None
+    if len(misses) > 1:
+        try:
+            combined_prompts, combined_tokens = plan_combined_prompts(misses, content, chunks)
+        except ValueError as e:
+            logger.warning(f"Combined prompt does not fit the token budget ({str(e)}); using per-category calls")
+    per_category_tokens = sum(plan_tokens[category] for category in misses)
+    chosen = choose_mode(mode, misses, per_category_tokens, combined_tokens)
+    metrics.observe_span("prompt_build", time.perf_counter() - planning_started)
+    for category, error in plan_errors:
+        yield category, None, error
+    if misses:
+        logger.info(
+            f"Prompt tokens for {len(misses)} categories: per-category {per_category_tokens}, "
+            f"combined {combined_tokens if combined_tokens is not None else 'n/a'}; using {chosen} ({mode} mode)"
+        )
+
+    # Map-reduce runs several call rounds per category, so its timeout scales with them
+    timeout = config.CATEGORY_TIMEOUT if timeout is None else timeout
+    if chunks is not None and timeout and misses:
+        timeout *= map_reduce_rounds(len(chunks), reduce_fan_in(misses[0]))
+
+    on_poll = flush_deltas if on_delta is not None else None
+    findings = None
+    combined_categories = set()
+    if chosen == COMBINED:
+        combined_categories = set(misses)
+        shared_tokens = combined_tokens // len(misses)
+        if chunks is not None:
+            try:
+                findings = map_combined(misses, combined_prompts, call)
+            except Exception as e:
+                logger.error(f"Combined chunk analysis failed: {str(e)}")
+                for category in misses:
+                    yield finish(category, None, e)
+                misses = []
+        else:
+            # One request writes every category, so it gets every category's share of the timeout
+            started = time.perf_counter()
+            combined_timeout = timeout * len(misses) if timeout else timeout
+            for _, text, error in run_concurrently(respond_combined, [tuple(misses)], 1, combined_timeout, on_poll):
+                if error is not None:
+                    for category in misses:
+                        yield finish(category, None, error)
+                    misses = []
+                    break
+                sections = split_combined_response(text, misses)
+                for category, section in sections.items():
+                    record(category, section, started)
+                    yield finish(category, section, None)
+                # Categories the reply left out are retried with their own calls
+                misses = [category for category in misses if category not in sections]
+                if misses:
+                    logger.warning(f"Combined response had no section for {', '.join(misses)}; retrying them separately")
+                    for category in misses:
+                        partial.pop(category, None)
+                        combined_categories.discard(category)
+
+    for category, result, error in run_concurrently(analyze, misses, max_workers, timeout, on_poll):
+        yield finish(category, result, error)
+
+    logger.info(f"Completed 5C analysis of {len(results)}/{len(selected_categories)} categories")
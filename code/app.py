@@ -1,327 +1,310 @@
 import streamlit as st
-import requests
 import json
 import os
 import logging
-from sqlalchemy.orm import Session
-from database import get_db, init_db
-from models import Conversation, Messages
-import PyPDF2
-import docx
+import time
+import uuid
+import pandas as pd
+import config
+import analysis
+import archive
+import bootstrap
+import database
+from database import add_messages
+from chunking import count_tokens
+from llm_client import LLMError, call_perplexity_api
+from prompts import CATEGORIES, SUB_ELEMENTS, build_chat_prompt
+import jobs
+import memory
+import metrics
+import portfolio
+import reports
+import result_cache
+import retrieval
+import scheduler
+import stress
+import uploads
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Check for PPLX_KEY environment variable
-if 'PPLX_KEY' not in os.environ:
-    logger.warning("PPLX_KEY environment variable not found. Please set it before making API calls.")
-    st.warning("⚠️ PPLX_KEY environment variable not found. Please set it before making API calls.")
-
-# Initialize the database (run this once when starting your app)
-init_db()
-
-os.makedirs("uploads", exist_ok=True)  # Create 'uploads' directory if it doesn't exist
-os.makedirs("contents", exist_ok=True)  # Create 'contents' directory if it doesn't exist
-
-# Function to create a new conversation
-def create_initial_conversation():
-    db = next(get_db())
-    if not db.query(Conversation).first():
-        new_conversation = Conversation(name="Initial Conversation")
-        db.add(new_conversation)
-        db.commit()
-        db.refresh(new_conversation)
-        logger.info(f"Created initial conversation: {new_conversation.id}")
-        return new_conversation
-    return None
+# Check the environment, create the directories and database tables and the initial conversation
+# once per process, not on every rerun
+@st.cache_resource
+def get_startup():
+    return bootstrap.bootstrap()
+
+try:
+    startup = get_startup()
+except bootstrap.SchemaError as e:
+    logger.error(f"Database schema error: {str(e)}")
+    st.error(f"The database could not be upgraded. {str(e)}")
+    st.stop()
+for warning in startup["warnings"]:
+    st.warning(f"⚠️ {warning}")
+
+# Start the background job workers once per process; they outlive reruns and browser refreshes
+@st.cache_resource
+def get_job_runner():
+    runner = jobs.JobRunner()
+    runner.start()
+    return runner
+
+get_job_runner()
+
+# Serve Prometheus metrics once per process
+@st.cache_resource
+def get_metrics_server():
+    return metrics.start_http_server() if config.METRICS_ENABLED else None
+
+get_metrics_server()
+
+# Function to get the latest `limit` messages of a conversation, cached until the conversation is written to
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_messages(conversation_id, version, limit):
+    return database.get_messages(conversation_id, limit=limit)
+
+# Function to count the messages of a conversation, cached the same way as load_messages
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_message_count(conversation_id, version):
+    return database.count_messages(conversation_id)
+
+# Function to get the latest analysis of each 5C category in a conversation, cached like load_messages
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_latest_analyses(conversation_id, version):
+    return database.get_latest_analyses(conversation_id)
+
+# Function to get all conversations, cached until one is added or deleted
+@st.cache_data(show_spinner=False)
+def load_conversations():
+    return database.get_conversations()
+
+# Function to load all stored 5C scores, cached until a score is added or removed
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_portfolio_scores(version):
+    return portfolio.load_scores()
 
 # Function to add a new conversation
 def add_conversation(name):
-    db = next(get_db())
-    new_conversation = Conversation(name=name)
-    db.add(new_conversation)
-    db.commit()
-    db.refresh(new_conversation)
-    logger.info(f"Added new conversation: {new_conversation.id}")
+    new_conversation = database.add_conversation(name)
+    load_conversations.clear()
     return new_conversation
 
-# Function to add a new message
-def add_message(conversation_id, role, content):
-    db = next(get_db())
-    message_data = {"role": role, "content": content}
-    new_message = Messages(conversation_id=conversation_id, data=json.dumps(message_data))
-    db.add(new_message)
-    db.commit()
-    db.refresh(new_message)
-    logger.info(f"Added new message to conversation {conversation_id}")
-    return new_message
-
-# Function to get all conversations
-def get_conversations():
-    db = next(get_db())
-    conversations = db.query(Conversation).all()
-    logger.info(f"Retrieved {len(conversations)} conversations")
-    return conversations
-
-# Function to get messages for a specific conversation
-def get_messages(conversation_id):
-    db = next(get_db())
-    messages = db.query(Messages).filter(Messages.conversation_id == conversation_id).all()
-    result = []
-    for msg in messages:
-        try:
-            message_data = json.loads(msg.data)
-            result.append(message_data)
-        except json.JSONDecodeError:
-            logger.error(f"Error decoding JSON for message ID {msg.id}: {msg.data}")
-    logger.info(f"Retrieved {len(result)} messages for conversation {conversation_id}")
-    return result
-
 # Function to delete a conversation
 def delete_conversation(conversation_id):
-    db = next(get_db())
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-    if conversation:
-        db.query(Messages).filter(Messages.conversation_id == conversation_id).delete()
-        db.delete(conversation)
-        db.commit()
-        logger.info(f"Deleted conversation: {conversation_id}")
-        return True
-    logger.warning(f"Conversation not found: {conversation_id}")
-    return False
-
-# Function to save the uploaded file
+    deleted = database.delete_conversation(conversation_id)
+    load_conversations.clear()
+    return deleted
+
+# Fragment that polls a background job and shows its progress and streamed partial results
+@st.fragment(run_every=config.JOB_POLL_SECONDS)
+def show_job_progress(job_id):
+    job = jobs.get_job(job_id)
+    if job is None or job["status"] not in jobs.ACTIVE_STATUSES:
+        # Finished (or deleted): rerun the whole page so the stored results are shown
+        st.rerun()
+        return
+
+    total = len(job["categories"])
+    done = len(job["completed"]) + len(job["errors"])
+    if job["status"] == jobs.QUEUED:
+        st.info(f"Analysis queued ({jobs.queue_position(job_id)} jobs ahead)...")
+    else:
+        st.write(f"Analyzing document... {done}/{total} categories finished")
+        # Back-pressure: analysis calls wait behind chat replies and other users' calls when the API is saturated
+        load = scheduler.get_scheduler().status()
+        if sum(load["queued"].values()):
+            st.caption(
+                f"The model is busy: {load['in_flight']}/{load['max_in_flight']} calls running, "
+                f"{sum(load['queued'].values())} waiting. Results may take longer than usual."
+            )
+    st.progress(done / total if total else 0.0)
+
+    for category, error in job["errors"].items():
+        st.error(f"The {category} analysis failed: {error}")
+    for category, text in get_job_runner().partial_results(job_id).items():
+        st.chat_message("assistant").markdown(f"Here's the {category} analysis:\n\n{text}▌")
+
+# Function to show in the sidebar where the time of a conversation's recent runs went
+def show_run_breakdown(conversation_id):
+    runs = metrics.recent_runs(conversation_id=conversation_id)
+    with st.sidebar.expander("Run timings"):
+        if not runs:
+            st.caption("No analysis or chat runs for this conversation since the app started.")
+            return
+        run = st.selectbox(
+            "Run",
+            runs,
+            format_func=lambda r: f"{r.label} at {r.started_at:%H:%M:%S} ({r.seconds:.1f}s, {r.outcome})",
+            key="run_breakdown",
+        )
+        table = pd.DataFrame(run.breakdown(), columns=["span", "calls", "seconds"])
+        table["share"] = 100 * table["seconds"] / run.seconds if run.seconds else 0.0
+        st.dataframe(
+            table,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "seconds": st.column_config.NumberColumn(format="%.3f"),
+                "share": st.column_config.ProgressColumn(min_value=0.0, max_value=100.0, format="%.0f%%"),
+            },
+        )
+        values = run.values
+        ttft = values.get("time_to_first_token")
+        st.caption(
+            f"Tokens in/out: {values.get('prompt_tokens', 0)}/{values.get('completion_tokens', 0)} · "
+            f"LLM calls: {values.get('llm_calls', 0)} ({values.get('llm_retries', 0)} retries) · "
+            f"First token: {f'{ttft:.2f}s' if ttft is not None else 'n/a'} · "
+            f"Cache hits/misses: {values.get('cache_hits', 0)}/{values.get('cache_misses', 0)}"
+        )
+        st.caption("Parallel calls overlap, so shares can add up to more than 100%.")
+
+# Function to show what changed in a revised document and which scores moved
+def show_revision(job):
+    revision = job["revision"]
+    with st.expander("Changes since the previous version", expanded=job["status"] == jobs.DONE):
+        st.caption(
+            f"{len(revision['changed'])} sections changed, {len(revision['added'])} added, "
+            f"{len(revision['removed'])} removed, {revision['unchanged']} unchanged"
+        )
+        for label, titles in (("Changed", revision["changed"]), ("Added", revision["added"]), ("Removed", revision["removed"])):
+            if titles:
+                shown = ", ".join(titles[:20]) + (f" and {len(titles) - 20} more" if len(titles) > 20 else "")
+                st.write(f"**{label}:** {shown}")
+        st.write(f"**Re-analysed:** {', '.join(revision['rerun']) or 'none'}")
+        st.write(f"**Kept from the previous version:** {', '.join(revision['reused']) or 'none'}")
+        if revision["score_changes"]:
+            table = pd.DataFrame(
+                [(category, change["before"], change["after"]) for category, change in revision["score_changes"].items()],
+                columns=["category", "before", "after"],
+            )
+            table["change"] = pd.to_numeric(table["after"]) - pd.to_numeric(table["before"])
+            st.dataframe(table, hide_index=True, use_container_width=True)
+
+# Function to save the uploaded file to the upload store, where identical files are kept once whatever their name.
+# Raises uploads.UploadError if the file is too large.
 def save_uploaded_file(uploaded_file):
-    file_path = os.path.join("uploads", uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    logger.info(f"Saved uploaded file: {file_path}")
-    return file_path
+    upload = uploads.store_upload(uploaded_file, uploaded_file.name)
+    logger.info(f"Saved uploaded file {uploaded_file.name} as {upload['path']}")
+    return upload["path"]
 
-# Function to download a text file with user-provided content
+# Function to save text to the report library, where the Download Sample page offers it; returns its path
 def create_downloadable_text_file(content, filename="download.txt"):
-    with open(filename, "w") as f:
-        f.write(content)
-    logger.info(f"Created downloadable file: {filename}")
-    return filename
-
-def list_files_in_directory(directory):
-    """Returns a list of filenames in the given directory."""
-    try:
-        files = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
-        logger.info(f"Listed {len(files)} files in {directory}")
-        return files
-    except FileNotFoundError:
-        logger.error(f"Directory not found: {directory}")
-        return []
-
-# Function to call Perplexity API
-def call_perplexity_api(prompt):
-    api_key = os.environ.get('PPLX_KEY')
-    if not api_key:
-        return "PPLX_KEY environment variable not found. Please set it before making API calls."
-
-    api_url = "https://api.perplexity.ai/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    payload = {
-        "model": "llama-3.1-sonar-huge-128k-online",
-        "messages": [{"role": "user", "content": prompt}]
-    }
-    try:
-        response = requests.post(api_url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-    except requests.RequestException as e:
-        logger.error(f"Error calling Perplexity API: {str(e)}")
-        return f"Sorry, I couldn't generate a response. Error: {str(e)}"
-
-# New function to read and process the uploaded document
-def process_document(file_path):
-    _, file_extension = os.path.splitext(file_path)
-    content = ""
-
-    try:
-        if file_extension.lower() == '.pdf':
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    content += page.extract_text()
-        elif file_extension.lower() in ['.docx', '.doc']:
-            doc = docx.Document(file_path)
-            for para in doc.paragraphs:
-                content += para.text + "\n"
-        else:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-        logger.info(f"Processed document: {file_path}")
-        return content
-    except Exception as e:
-        logger.error(f"Error processing document {file_path}: {str(e)}")
-        return f"Error processing document: {str(e)}"
-
-# Modified function to map content to selected 5C categories with separate API calls and yield results one by one
-def map_to_5c(content, selected_categories):
-    categories = {
-        "Character": ("""
-        Analyze the provided project document, focusing on the Character aspect for credit scoring. Evaluate the following elements:
-        1. Years in operation
-        2. Industry reputation
-        3. Management experience
-        4. Regulatory compliance history
-        
-        Scoring (0-5 scale):
-        0 - Poor reputation, multiple regulatory issues
-        1 - Some concerns, minor regulatory issues
-        2 - Average reputation, no major issues
-        3 - Good reputation, strong compliance
-        4 - Excellent reputation, industry leader
-        5 - Outstanding reputation, exemplary track record
-        
-        Provide a concise analysis addressing each element above. If any information is missing, note its absence. Conclude with:
-        1. An overall Character assessment summary
-        2. A Character score on a scale of 0-100
-        3. Brief recommendations for improvement or areas needing clarification
-        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
-        """),
-        "Capacity": ("""
-        Analyze the provided project document, focusing on the Capacity aspect for credit scoring. Evaluate the following elements:
-        1. Debt-to-equity ratio
-        2. Operating cash flow
-        3. Profit margins
-        4. Revenue growth rate
-        
-        Scoring (0-5 scale):
-        0 - Severe financial distress
-        1 - Struggling financially
-        2 - Average financial performance
-        3 - Strong financial position
-        4 - Very strong financials
-        5 - Exceptional financial health
-        
-        Provide a brief analysis for each element above. If any information is missing, note its absence. Conclude with:
-        1. An overall Capacity assessment summary
-        2. A Capacity score on a scale of 0-100
-        3. Key recommendations for enhancing project capacity
-        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
-        """),
-        "Capital": ("""
-        Analyze the provided project document, focusing on the Capital aspect for credit scoring. Evaluate the following elements:
-        1. Total assets
-        2. Net worth
-        3. Liquidity ratio
-        4. Capital adequacy ratio (for financial institutions)
-        
-        Scoring (0-5 scale):
-        0 - Severely undercapitalized
-        1 - Undercapitalized
-        2 - Adequately capitalized
-        3 - Well-capitalized
-        4 - Very well-capitalized
-        5 - Exceptionally strong capital position
-        
-        Provide a brief analysis for each element above. If any information is missing, note its absence. Conclude with:
-        1. An overall Capital assessment summary
-        2. A Capital score on a scale of 0-100
-        3. Recommendations for improving capital position or structure
-        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
-        """),
-        "Collateral": ("""
-        Analyze the provided project document, focusing on the Collateral aspect for credit scoring. Evaluate the following elements:
-        1. Quality of assets
-        2. Diversification of asset portfolio
-        3. Valuation of assets
-        4. Ease of liquidation
-        
-        Scoring (0-5 scale):
-        0 - No viable collateral
-        1 - Limited, low-quality collateral
-        2 - Adequate collateral
-        3 - Good quality, diversified collateral
-        4 - High-quality, easily liquidated collateral
-        5 - Premium collateral or strong guarantees
-        
-        Provide a brief analysis for each element above. If any information is missing, note its absence. Conclude with:
-        1. An overall Collateral assessment summary
-        2. A Collateral score on a scale of 0-100
-        3. Recommendations for improving collateral quality or coverage
-        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
-        """),
-        "Conditions": ("""
-        Analyze the provided project document, focusing on the Conditions aspect for credit scoring. Evaluate the following elements:
-        1. Economic conditions in customer's primary markets
-        2. Industry trends
-        3. Geopolitical risks
-        4. Natural disaster exposure
-        
-        Scoring (0-5 scale):
-        0 - Extremely unfavorable conditions
-        1 - Challenging conditions
-        2 - Neutral conditions
-        3 - Favorable conditions
-        4 - Very favorable conditions
-        5 - Optimal conditions for growth and stability
-        
-        Provide a brief analysis for each element above. If any information is missing, note its absence. Conclude with:
-        1. An overall Conditions assessment summary
-        2. A Conditions score on a scale of 0-100
-        3. Recommendations for addressing unfavorable conditions or leveraging positive ones
-        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
-        """)
-    }
-    
-    results = {}
-    for category in selected_categories:
-        description = categories[category]
-        prompt = f"""
-        Analyze the following content focusing on the {category} aspect of the 5C method:
-
-        {content}
+    path = reports.save_report(content, filename)
+    logger.info(f"Created downloadable file: {path}")
+    return path
 
-        {category}: {description}
-
-        Provide key points and insights based on the given content.
-        """
-        result = call_perplexity_api(prompt)
-        results[category] = result
-        yield category, result
-    
-    # Store the complete 5C analysis results in the session state
-    st.session_state['5c_analysis'] = results
-    
-    logger.info("Completed selected 5C analysis and stored in session state")
-
-# Create an initial conversation if none exists
-create_initial_conversation()
+# Function to read one report for a download, cached until the file changes
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_report(path, mtime_ns):
+    return reports.read_report(path)
 
 # Streamlit app
 st.title("REALM: Reinsurance Eval Analysis for Megaprojects")
 
 # Sidebar for page selection
 st.sidebar.header("Navigation")
-page = st.sidebar.radio("Page", ["Risk Assessment", "Download Sample"])
+page = st.sidebar.radio("Page", ["Risk Assessment", "Portfolio", "Download Sample"])
+
+if page == "Portfolio":
+    st.header("Portfolio")
 
-if page == "Download Sample":
+    scores = load_portfolio_scores(portfolio.get_scores_version())
+    if scores.empty:
+        st.info("No scored projects yet. Run an analysis or a batch scoring job first.")
+    else:
+        # Category weights for the composite score; a weight of 0 leaves the category out
+        st.sidebar.header("Composite Weights")
+        weights = {category: st.sidebar.slider(category, 0.0, 3.0, portfolio.DEFAULT_WEIGHTS[category], 0.25) for category in CATEGORIES}
+        result = portfolio.build_portfolio(scores, weights)
+
+        st.subheader(f"Ranked Projects ({len(result['ranked'])})")
+        st.dataframe(result["ranked"].reset_index(drop=True), hide_index=True, use_container_width=True)
+
+        st.subheader("Score Percentiles")
+        st.dataframe(result["summary"].round(1), use_container_width=True)
+
+        st.subheader("Score Distribution")
+        column = st.selectbox("Score", list(result["distributions"].columns), index=len(CATEGORIES))
+        st.bar_chart(result["distributions"][column])
+
+        # Monte Carlo stress test of one project under the chosen shock scenarios
+        st.subheader("Stress Test")
+        ranked = result["ranked"]
+        project = st.selectbox("Project", list(ranked.index), format_func=lambda key: ranked.loc[key, "name"])
+        scenario_names = st.multiselect("Scenarios", list(stress.SCENARIOS), default=["Natural disaster"])
+        severity = st.slider("Severity", 0.0, 3.0, 1.0, 0.25)
+        correlation = st.slider("Shock correlation", 0.0, 1.0, config.STRESS_CORRELATION, 0.05)
+        st.caption("Shocks are in sub-element rating points (0-5 scale); add rows for custom shocks.")
+        shocks = st.data_editor(
+            pd.DataFrame(stress.build_scenario(scenario_names, severity), columns=["category", "element", "mean", "sd"]),
+            num_rows="dynamic",
+            use_container_width=True,
+            column_config={
+                "category": st.column_config.SelectboxColumn("Category", options=list(CATEGORIES), required=True),
+                "element": st.column_config.SelectboxColumn(
+                    "Element", options=sorted({e for elements in SUB_ELEMENTS.values() for e in elements}), required=True
+                ),
+                "mean": st.column_config.NumberColumn("Mean shift", min_value=-5.0, max_value=5.0, step=0.1),
+                "sd": st.column_config.NumberColumn("Std. dev.", min_value=0.0, max_value=5.0, step=0.1),
+            },
+            key=f"shocks-{'-'.join(scenario_names)}-{severity}",
+        )
+        # Skip incomplete rows and elements that don't belong to the chosen category
+        shocks = [
+            shock for shock in shocks.dropna().to_dict("records")
+            if shock["element"] in SUB_ELEMENTS.get(shock["category"], [])
+        ]
+
+        if st.button("Run Stress Test"):
+            project_scores, ratings = stress.project_profile(scores, project)
+            outcome = stress.simulate(project_scores, ratings, shocks, weights=weights, correlation=correlation)
+            cols = st.columns(4)
+            cols[0].metric("Baseline composite", f"{outcome['baseline']:.1f}")
+            cols[1].metric("Median stressed", f"{outcome['percentiles'][50]:.1f}", f"{outcome['percentiles'][50] - outcome['baseline']:.1f}")
+            cols[2].metric("5% tail (ES)", f"{outcome['expected_shortfall']:.1f}")
+            cols[3].metric(f"P(composite < {config.STRESS_FAIL_SCORE:.0f})", f"{outcome['probability_fail']:.1%}")
+            counts, edges = outcome["histogram"]
+            st.bar_chart(pd.DataFrame({"draws": counts}, index=[f"{edge:.0f}" for edge in edges[:-1]]))
+            st.dataframe(pd.DataFrame(outcome["categories"]).T.round(1), use_container_width=True)
+            st.caption(
+                "Percentiles: " + ", ".join(f"p{p} {value:.1f}" for p, value in outcome["percentiles"].items())
+                + f" | {outcome['draws']:,} draws in {outcome['seconds'] * 1000:.0f} ms"
+            )
+
+elif page == "Download Sample":
     st.header("Download Sample Report")
 
-    # List and provide downloadable files from 'contents' folder
+    # The index only stats the files; a report is read when it is selected, not on every rerun
     st.subheader("Available Files for Download")
-    
-    files = list_files_in_directory("contents")
-    
+    files = reports.list_reports()
+
     if files:
-        for file in files:
-            file_path = os.path.join("contents", file)
-            with open(file_path, "rb") as f:
-                st.download_button(
-                    label=f"Download {file}",
-                    data=f,
-                    file_name=file,
-                    mime="text/plain"
-                )
+        st.dataframe(
+            pd.DataFrame(
+                [(f["name"], f["mime"], f["size"] / 1024, pd.Timestamp(f["mtime_ns"], unit="ns")) for f in files],
+                columns=["file", "type", "size (KB)", "updated"],
+            ),
+            hide_index=True,
+            use_container_width=True,
+            column_config={"size (KB)": st.column_config.NumberColumn(format="%.1f")},
+        )
+        selected = st.selectbox("Report", files, format_func=lambda f: f["name"])
+        cols = st.columns(2)
+        cols[0].download_button(
+            label=f"Download {selected['name']}",
+            data=load_report(selected["path"], selected["mtime_ns"]),
+            file_name=selected["name"],
+            mime=selected["mime"],
+        )
+        if selected["gzip_path"]:
+            cols[1].download_button(
+                label=f"Download compressed ({selected['gzip_size'] / 1024:.0f} KB instead of {selected['size'] / 1024:.0f} KB)",
+                data=load_report(selected["gzip_path"], selected["mtime_ns"]),
+                file_name=f"{selected['name']}.gz",
+                mime="application/gzip",
+            )
     else:
         st.info("No files available for download.")
 
@@ -330,9 +313,49 @@ elif page == "Risk Assessment":
     
     # Sidebar for managing conversations
     st.sidebar.header("Conversations")
+
+    # Show how much the analysis cache is saving
+    if config.CACHE_ENABLED:
+        cache_stats = result_cache.get_cache().stats()
+        st.sidebar.caption(
+            f"Analysis cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses since startup, "
+            f"{cache_stats['entries']} entries ({cache_stats['bytes'] / 1024:.0f} KB), "
+            f"{cache_stats['lifetime_hits']} calls saved overall"
+        )
     
+    load = scheduler.get_scheduler().status()
+    st.sidebar.caption(
+        f"LLM API: {load['in_flight']}/{load['max_in_flight']} calls running, {sum(load['queued'].values())} waiting"
+        + (f", {load['token_budget']:,} of {load['tokens_per_minute']:,} tokens/min left" if load["tokens_per_minute"] else "")
+    )
+    upload_usage = uploads.usage()
+    st.sidebar.caption(
+        f"Upload store: {upload_usage['files']} files, {upload_usage['bytes'] / (1024 * 1024):.1f} MB "
+        f"of {upload_usage['max_bytes'] / (1024 * 1024):.0f} MB"
+    )
+
+    # Conversations idle for a long time are compressed out of the messages table; opening one restores it
+    with st.sidebar.expander("Storage"):
+        if st.button("Show space report"):
+            space = archive.space_report()
+            st.caption(
+                f"realm.db: {space['file_bytes'] / (1024 * 1024):.1f} MB ({space['free_bytes'] / (1024 * 1024):.1f} MB free, "
+                f"auto_vacuum {space['auto_vacuum']}). Live messages: {space['live_messages']:,} "
+                f"({space['live_message_bytes'] / (1024 * 1024):.1f} MB). Archived: {space['archived_conversations']:,} conversations, "
+                f"{space['archived_messages']:,} messages in {space['archived_bytes'] / (1024 * 1024):.1f} MB, "
+                f"{space['saved_bytes'] / (1024 * 1024):.1f} MB saved."
+            )
+        if st.button(f"Archive conversations idle for {config.ARCHIVE_IDLE_DAYS:g}+ days"):
+            with st.spinner("Archiving idle conversations..."):
+                report = archive.archive_idle()
+            st.caption(
+                f"Archived {report['conversations']} conversations ({report['messages']:,} messages, "
+                f"{report['raw_bytes'] / (1024 * 1024):.1f} MB -> {report['compressed_bytes'] / (1024 * 1024):.1f} MB); "
+                f"realm.db {report['file_bytes_before'] / (1024 * 1024):.1f} MB -> {report['file_bytes_after'] / (1024 * 1024):.1f} MB."
+            )
+
     # Display the list of conversations
-    conversations = get_conversations()
+    conversations = load_conversations()
     
     # Create a new conversation
     def create_new_conversation():
@@ -342,6 +365,7 @@ elif page == "Risk Assessment":
             st.session_state['messages'] = []
             st.session_state['file_processed'] = False
             st.session_state['5c_analysis'] = None
+            st.session_state['document_id'] = None
             st.rerun()
 
     new_conversation_name = st.sidebar.text_input("New Conversation Name", key="new_conv_name", on_change=create_new_conversation)
@@ -354,9 +378,22 @@ elif page == "Risk Assessment":
         key="conversation_selector"
     )
 
+    hidden_messages = 0
+    latest_job = None
     if selected_conversation:
         st.session_state['selected_conversation'] = selected_conversation
-        st.session_state['messages'] = get_messages(selected_conversation.id)
+
+        # Only the latest page of history is loaded; "Load earlier messages" widens the window
+        history_limits = st.session_state.setdefault('history_limits', {})
+        history_limit = history_limits.get(selected_conversation.id, config.MESSAGE_PAGE_SIZE)
+        version = database.get_message_version(selected_conversation.id)
+        st.session_state['messages'] = load_messages(selected_conversation.id, version, history_limit)
+        hidden_messages = load_message_count(selected_conversation.id, version) - len(st.session_state['messages'])
+
+        # Analyses and the document index come from the database, since background jobs produce them
+        st.session_state['5c_analysis'] = load_latest_analyses(selected_conversation.id, version)
+        latest_job = jobs.get_latest_job(selected_conversation.id)
+        st.session_state['document_id'] = latest_job["document_id"] if latest_job else None
 
         # Add delete button for the selected conversation
         if st.sidebar.button(f"Delete '{selected_conversation.name}'"):
@@ -366,10 +403,20 @@ elif page == "Risk Assessment":
                 del st.session_state['messages']
                 st.session_state['file_processed'] = False
                 st.session_state['5c_analysis'] = None
+                st.session_state['document_id'] = None
                 st.rerun()
             else:
                 st.sidebar.error("Failed to delete the conversation.")
 
+        show_run_breakdown(selected_conversation.id)
+
+        # Older chat turns reach the model only through this summary
+        summary = database.get_summary(selected_conversation.id)
+        if summary:
+            with st.sidebar.expander("Conversation memory"):
+                st.caption(f"{summary['message_count']} earlier messages summarised, last updated {summary['updated_at']:%Y-%m-%d %H:%M}")
+                st.write(summary["content"])
+
     # File upload at the start of each conversation
     if not st.session_state.get('file_processed', False):
         st.write("Please upload a file to start the conversation.")
@@ -380,42 +427,67 @@ elif page == "Risk Assessment":
             st.write("Select which aspects to analyze:")
             selected_categories = []
             cols = st.columns(5)
-            categories = ["Character", "Capacity", "Capital", "Collateral", "Conditions"]
-            
-            for i, category in enumerate(categories):
+            for i, category in enumerate(CATEGORIES):
                 if cols[i].checkbox(category, value=True):
                     selected_categories.append(category)
             
+            # One combined request sends the document once; per-category requests run in parallel
+            modes = {"Auto": analysis.AUTO, "One combined call": analysis.COMBINED, "Parallel per-category calls": analysis.PER_CATEGORY}
+            mode = st.radio("Request mode", list(modes), horizontal=True, help="Auto picks combined when it saves enough prompt tokens.")
+            incremental = st.checkbox(
+                "Only re-analyse what changed since the previous version",
+                value=True,
+                help="For a revised document in this conversation, categories whose sections are unchanged keep their earlier analysis.",
+            )
+
             if st.button("Start Analysis", disabled=len(selected_categories) == 0):
                 if len(selected_categories) == 0:
                     st.warning("Please select at least one category to analyze.")
                 else:
-                    file_path = save_uploaded_file(uploaded_file)
-                    content = process_document(file_path)
-                    st.write("Analyzing document...")
-                    
-                    # Create a progress bar
-                    progress_bar = st.progress(0)
-                    
-                    # Add the analysis to the conversation as bot messages one by one
-                    if st.session_state.get('selected_conversation'):
-                        for i, (category, result) in enumerate(map_to_5c(content, selected_categories)):
-                            message = f"Here's the {category} analysis:\n\n{result}"
-                            add_message(st.session_state['selected_conversation'].id, "assistant", message)
-                            st.session_state['messages'].append({"role": "assistant", "content": message})
-                            
-                            # Update the progress bar based on selected categories
-                            progress = (i + 1) / len(selected_categories)
-                            progress_bar.progress(progress)
-                            
-                            # Display the message
-                            st.chat_message("assistant").write(message)
-                    
-                    st.session_state['file_processed'] = True
-                    st.rerun()
+                    try:
+                        file_path = save_uploaded_file(uploaded_file)
+                    except uploads.UploadError as e:
+                        st.error(str(e))
+                    else:
+                        # Extraction and the 5C calls run on the background workers; results are
+                        # written to the conversation as each category finishes
+                        if st.session_state.get('selected_conversation'):
+                            owner = st.session_state.setdefault('owner_id', str(uuid.uuid4()))
+                            jobs.enqueue_analysis(
+                                st.session_state['selected_conversation'].id, owner, file_path, selected_categories, modes[mode], incremental
+                            )
+                            get_job_runner().notify()
+
+                        st.session_state['file_processed'] = True
+                        st.rerun()
 
     # Display messages from the conversation
     if st.session_state.get('selected_conversation'):
+        for job in jobs.get_active_jobs(st.session_state['selected_conversation'].id):
+            show_job_progress(job["id"])
+
+        if latest_job and latest_job["revision"]:
+            show_revision(latest_job)
+        if st.session_state.get('file_processed') and latest_job and st.button("Upload a revised version"):
+            st.session_state['file_processed'] = False
+            st.rerun()
+
+        # Export the latest analyses as a Markdown report, offered on the Download Sample page
+        analyses = st.session_state.get('5c_analysis')
+        if analyses and st.button("Save analysis to the report library"):
+            conversation = st.session_state['selected_conversation']
+            sections = [f"## {category}\n\n{analyses[category]}" for category in CATEGORIES if category in analyses]
+            path = create_downloadable_text_file(
+                f"# {conversation.name}: 5C analysis\n\n" + "\n\n".join(sections) + "\n",
+                f"{conversation.name} 5C analysis.md",
+            )
+            st.success(f"Saved {os.path.basename(path)} to the report library.")
+
+        if hidden_messages > 0 and st.button(f"Load earlier messages ({hidden_messages} more)"):
+            conversation_id = st.session_state['selected_conversation'].id
+            history_limits[conversation_id] = history_limit + config.MESSAGE_PAGE_SIZE
+            st.rerun()
+
         for msg in st.session_state["messages"]:
             if isinstance(msg, dict) and "role" in msg and "content" in msg:
                 if msg["role"] == "user":
@@ -431,30 +503,71 @@ elif page == "Risk Assessment":
         st.session_state["messages"].append({"role": "user", "content": prompt})
         st.chat_message("user").write(prompt)
 
-        # Generate a response using the Perplexity API with 5C analysis context
-        response_prompt = f"""
-        Based on the 5C analysis provided earlier:
-
-        {json.dumps(st.session_state.get('5c_analysis', {}), indent=2)}
-
-        And the user's question:
-
-        User: {prompt}
-
-        Provide a detailed and informative answer, incorporating relevant aspects from the 5C analysis where applicable.
-        """
-        with st.spinner("Generating response..."):
-            msg = call_perplexity_api(response_prompt)
-
-        # Append the assistant's message to the session state
-        st.session_state["messages"].append({"role": "assistant", "content": msg})
-        st.chat_message("assistant").write(msg)
-
-        # Save the new messages to the database
-        if st.session_state.get('selected_conversation'):
-            add_message(st.session_state['selected_conversation'].id, "user", prompt)
-            add_message(st.session_state['selected_conversation'].id, "assistant", msg)
-
-        st.rerun()
+        # The whole reply is timed into one per-run breakdown for the sidebar
+        conversation = st.session_state.get('selected_conversation')
+        replied = False
+        with metrics.run("chat", "Chat reply", conversation_id=conversation.id if conversation else None) as chat_run:
+            # Retrieve only the passages of the source document relevant to this question
+            passages = []
+            try:
+                with metrics.span("retrieval"):
+                    index = retrieval.load_index(st.session_state.get('document_id'))
+                    if index is not None:
+                        passages = [passage for _, passage in index.search(prompt)]
+            except Exception as e:
+                logger.error(f"Error retrieving passages: {str(e)}")
+
+            # Generate a response using the Perplexity API with 5C analysis and document context, plus a
+            # bounded memory of the conversation: its summary and the latest turns that fit the budget
+            with metrics.span("prompt_build"):
+                context = memory.build_context(conversation.id) if conversation else {"summary": None, "history": []}
+                analyses = memory.compact_analyses(st.session_state.get('5c_analysis') or {})
+                response_prompt = build_chat_prompt(
+                    prompt, json.dumps(analyses), passages, summary=context["summary"], history=context["history"]
+                )
+            try:
+                # Render the reply token by token; write_stream returns the full text once done.
+                # Chat goes ahead of analysis jobs in the API queue; while it waits, say how many calls are ahead.
+                started = time.perf_counter()
+                owner = st.session_state.setdefault('owner_id', str(uuid.uuid4()))
+                with st.chat_message("assistant"):
+                    waiting = st.empty()
+                    with scheduler.caller(
+                        owner, scheduler.INTERACTIVE,
+                        on_wait=lambda position: waiting.caption(f"The model is busy; {position} requests ahead of yours..."),
+                    ):
+                        msg = st.write_stream(call_perplexity_api(response_prompt, stream=True))
+                    waiting.empty()
+                latency_ms = int((time.perf_counter() - started) * 1000)
+            except LLMError as e:
+                # Keep the error on screen and out of the conversation history
+                logger.error(f"Error calling Perplexity API: {str(e)}")
+                st.error(f"Sorry, I couldn't generate a response. Error: {str(e)}")
+                chat_run.outcome = "error"
+            else:
+                # Append the assistant's message to the session state
+                st.session_state["messages"].append({"role": "assistant", "content": msg})
+
+                # Save the new messages to the database
+                if st.session_state.get('selected_conversation'):
+                    add_messages(st.session_state['selected_conversation'].id, [
+                        {"role": "user", "content": prompt},
+                        {
+                            "role": "assistant",
+                            "content": msg,
+                            "prompt_tokens": count_tokens(response_prompt),
+                            "completion_tokens": count_tokens(msg),
+                            "latency_ms": latency_ms,
+                        },
+                    ])
+                    # Fold older turns into the summary off the script thread, if they outgrew the budget
+                    memory.schedule_summary(st.session_state['selected_conversation'].id)
+                replied = True
+
+        if replied:
+            # Back to the latest page, so a long scroll-back is not re-rendered on every turn
+            if conversation:
+                st.session_state.get('history_limits', {}).pop(conversation.id, None)
+            st.rerun()
 
 logger.info("App finished running")
@@ -0,0 +1,294 @@
+"""Compressed archive tier for conversations idle longer than config.ARCHIVE_IDLE_DAYS.
+
+An archived conversation's message rows are written as JSON lines, compressed with zstd (or zlib
+when the zstandard package is not installed) into one row of the archives table, and deleted
+from messages; its scores, jobs and summary stay as they are. The first per-conversation read
+through database.py (get_messages and friends) restores the rows under their original ids, so
+scores and summaries still point at the right messages.
+
+After a run, free pages are handed back to the file system with PRAGMA incremental_vacuum, which
+needs auto_vacuum=INCREMENTAL; `--enable-incremental-vacuum` switches an existing database over
+with one full VACUUM.
+
+Run directly, e.g. from cron:
+
+    python archive.py --archive                      # archive conversations idle past ARCHIVE_IDLE_DAYS
+    python archive.py --report                       # space used by live messages and archives
+    python archive.py --enable-incremental-vacuum    # once, to let runs shrink realm.db
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert
+
+import config
+import database
+from models import CategoryScore, ConversationArchive, ConversationSummary, Job, Messages
+
+logger = logging.getLogger(__name__)
+
+# Message columns kept in an archive, in the order they are read
+COLUMNS = ("id", "role", "content", "category", "data", "created_at", "prompt_tokens", "completion_tokens", "latency_ms")
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+# Ids checked per query when restoring, below SQLite's bound-parameter limit
+ID_BATCH = 500
+
+
+# Function to pick the codec for new archives
+def default_codec():
+    if config.ARCHIVE_CODEC == "auto":
+        return "zstd" if importlib.util.find_spec("zstandard") is not None else "zlib"
+    return config.ARCHIVE_CODEC
+
+
+def compress(data, codec):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=config.ARCHIVE_ZSTD_LEVEL).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, config.ARCHIVE_ZLIB_LEVEL)
+    raise ValueError(f"Unknown archive codec '{codec}'; expected zstd or zlib")
+
+
+def decompress(blob, codec):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(blob)
+    if codec == "zlib":
+        return zlib.decompress(blob)
+    raise ValueError(f"Unknown archive codec '{codec}'; expected zstd or zlib")
+
+
+def _serialize(rows):
+    lines = []
+    for row in rows:
+        values = dict(zip(COLUMNS, row))
+        values["created_at"] = values["created_at"].isoformat() if values["created_at"] else None
+        lines.append(json.dumps(values, ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines).encode("utf-8")
+
+
+def _deserialize(data):
+    rows = []
+    for line in data.decode("utf-8").splitlines():
+        values = json.loads(line)
+        values["created_at"] = datetime.fromisoformat(values["created_at"]) if values["created_at"] else None
+        rows.append(values)
+    return rows
+
+
+# Function to archive one conversation's messages; returns {"conversation_id", "messages", "raw_bytes",
+# "compressed_bytes"}, or None if it has no messages or is archived already
+def archive_conversation(conversation_id, codec=None):
+    codec = codec or default_codec()
+    with database.session_scope() as db:
+        if db.query(ConversationArchive.id).filter(ConversationArchive.conversation_id == conversation_id).first():
+            return None
+        rows = (
+            db.query(*[getattr(Messages, column) for column in COLUMNS])
+            .filter(Messages.conversation_id == conversation_id)
+            .order_by(Messages.id)
+            .all()
+        )
+        if not rows:
+            return None
+        raw = _serialize(rows)
+        blob = compress(raw, codec)
+        db.add(ConversationArchive(
+            conversation_id=conversation_id,
+            codec=codec,
+            blob=blob,
+            message_count=len(rows),
+            raw_bytes=len(raw),
+            compressed_bytes=len(blob),
+            last_message_at=max((row.created_at for row in rows if row.created_at), default=None),
+        ))
+        # Only the rows just read; a message written meanwhile has a higher id and stays live
+        db.query(Messages).filter(
+            Messages.conversation_id == conversation_id, Messages.id <= rows[-1].id
+        ).delete(synchronize_session=False)
+    database.bump_message_version(conversation_id)
+    logger.info(f"Archived {len(rows)} messages of conversation {conversation_id}: {len(raw)} -> {len(blob)} bytes ({codec})")
+    return {"conversation_id": conversation_id, "messages": len(rows), "raw_bytes": len(raw), "compressed_bytes": len(blob)}
+
+
+# Function to restore an archived conversation's messages; returns the number restored (0 if not archived)
+def rehydrate(conversation_id):
+    started = time.perf_counter()
+    with database.session_scope() as db:
+        archive = db.query(ConversationArchive).filter(ConversationArchive.conversation_id == conversation_id).first()
+        if archive is None:
+            return 0
+        rows = _deserialize(decompress(archive.blob, archive.codec))
+        ids = [row["id"] for row in rows]
+        taken = set()
+        for i in range(0, len(ids), ID_BATCH):
+            taken.update(message_id for (message_id,) in db.query(Messages.id).filter(Messages.id.in_(ids[i:i + ID_BATCH])))
+
+        if not taken:
+            db.execute(insert(Messages), [{**row, "conversation_id": conversation_id} for row in rows])
+        else:
+            # SQLite handed some of the ids out again after the newest messages were deleted; restore under
+            # new ids and repoint this conversation's scores and summary
+            messages = []
+            for row in rows:
+                values = {column: value for column, value in row.items() if column != "id"}
+                messages.append(Messages(conversation_id=conversation_id, **values))
+            db.add_all(messages)
+            db.flush()
+            remap = {row["id"]: message.id for row, message in zip(rows, messages)}
+            for old_id, new_id in remap.items():
+                db.query(CategoryScore).filter(
+                    CategoryScore.conversation_id == conversation_id, CategoryScore.message_id == old_id
+                ).update({"message_id": new_id}, synchronize_session=False)
+            summary = db.query(ConversationSummary).filter(ConversationSummary.conversation_id == conversation_id).first()
+            if summary is not None and summary.through_message_id in remap:
+                summary.through_message_id = remap[summary.through_message_id]
+            logger.warning(f"Restored conversation {conversation_id} under new message ids ({len(taken)} were reused)")
+        db.delete(archive)
+    database.bump_message_version(conversation_id)
+    logger.info(f"Restored {len(rows)} archived messages of conversation {conversation_id} in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return len(rows)
+
+
+# Function to find conversations whose newest message is older than idle_days, oldest first; conversations
+# with queued or running jobs are left alone. Legacy messages get their created_at from backfill_messages.py
+# (the time of the upgrade); until then they have none and don't make a conversation idle.
+def idle_conversations(idle_days=None, limit=None):
+    idle_days = config.ARCHIVE_IDLE_DAYS if idle_days is None else idle_days
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    with database.session_scope() as db:
+        last = (
+            db.query(Messages.conversation_id.label("conversation_id"), func.max(Messages.created_at).label("last_at"))
+            .group_by(Messages.conversation_id)
+            .subquery()
+        )
+        active = db.query(Job.conversation_id).filter(Job.status.in_(("queued", "running")))
+        archived = db.query(ConversationArchive.conversation_id)
+        query = (
+            db.query(last.c.conversation_id)
+            .filter(last.c.last_at < cutoff, last.c.conversation_id.notin_(active), last.c.conversation_id.notin_(archived))
+            .order_by(last.c.last_at)
+        )
+        if limit:
+            query = query.limit(limit)
+        return [conversation_id for (conversation_id,) in query]
+
+
+# Function to run an SQLite PRAGMA outside a transaction; returns all result rows
+def _pragma(statement):
+    with database.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        result = conn.exec_driver_sql(f"PRAGMA {statement}")
+        return result.fetchall() if result.returns_rows else []
+
+
+# Function to return free pages to the file system; returns the number of pages freed
+# (always 0 unless auto_vacuum is INCREMENTAL)
+def incremental_vacuum(pages=None):
+    pages = config.ARCHIVE_VACUUM_PAGES if pages is None else pages
+    if _pragma("auto_vacuum")[0][0] != 2:
+        logger.info("auto_vacuum is not INCREMENTAL; freed pages are reused but realm.db does not shrink")
+        return 0
+    before = _pragma("freelist_count")[0][0]
+    statement = f"PRAGMA incremental_vacuum({int(pages)});" if pages else "PRAGMA incremental_vacuum;"
+    # The pragma frees one page per step, and the driver's execute() steps it only once;
+    # executescript() runs it to completion
+    raw = database.engine.raw_connection()
+    try:
+        raw.driver_connection.executescript(statement)
+    finally:
+        raw.close()
+    # Under WAL the file only shrinks once the freed pages are checkpointed; skipped while readers need them
+    _pragma("wal_checkpoint(TRUNCATE)")
+    freed = before - _pragma("freelist_count")[0][0]
+    logger.info(f"Incremental vacuum freed {freed} pages")
+    return freed
+
+
+# Function to switch the database to auto_vacuum=INCREMENTAL; rewrites the whole file once with VACUUM
+def enable_incremental_vacuum():
+    _pragma("auto_vacuum=INCREMENTAL")
+    with database.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+    logger.info("Enabled incremental vacuum")
+
+
+# Function to describe the space used by realm.db, its live messages and the archives
+def space_report():
+    page_size = _pragma("page_size")[0][0]
+    page_count = _pragma("page_count")[0][0]
+    free_pages = _pragma("freelist_count")[0][0]
+    auto_vacuum = _pragma("auto_vacuum")[0][0]
+    with database.session_scope() as db:
+        live_messages, live_bytes = db.query(
+            func.count(Messages.id),
+            func.coalesce(func.sum(func.length(Messages.content) + func.coalesce(func.length(Messages.data), 0)), 0),
+        ).one()
+        conversations, messages, raw_bytes, compressed_bytes = db.query(
+            func.count(ConversationArchive.id),
+            func.coalesce(func.sum(ConversationArchive.message_count), 0),
+            func.coalesce(func.sum(ConversationArchive.raw_bytes), 0),
+            func.coalesce(func.sum(ConversationArchive.compressed_bytes), 0),
+        ).one()
+    return {
+        "file_bytes": page_size * page_count,
+        "free_bytes": page_size * free_pages,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+        "live_messages": live_messages,
+        "live_message_bytes": live_bytes,
+        "archived_conversations": conversations,
+        "archived_messages": messages,
+        "archived_raw_bytes": raw_bytes,
+        "archived_bytes": compressed_bytes,
+        "saved_bytes": raw_bytes - compressed_bytes,
+    }
+
+
+# Function to archive up to `limit` idle conversations and vacuum; returns a report of the run
+def archive_idle(idle_days=None, limit=None, vacuum=True):
+    started = time.perf_counter()
+    limit = config.ARCHIVE_BATCH_SIZE if limit is None else limit
+    file_bytes_before = space_report()["file_bytes"]
+    archived = [result for result in map(archive_conversation, idle_conversations(idle_days, limit)) if result]
+    freed_pages = incremental_vacuum() if vacuum and archived else 0
+    report = {
+        "conversations": len(archived),
+        "messages": sum(result["messages"] for result in archived),
+        "raw_bytes": sum(result["raw_bytes"] for result in archived),
+        "compressed_bytes": sum(result["compressed_bytes"] for result in archived),
+        "freed_pages": freed_pages,
+        "file_bytes_before": file_bytes_before,
+        "file_bytes_after": space_report()["file_bytes"],
+        "seconds": time.perf_counter() - started,
+    }
+    logger.info(
+        f"Archived {report['conversations']} conversations ({report['messages']} messages, "
+        f"{report['raw_bytes']} -> {report['compressed_bytes']} bytes); "
+        f"realm.db {report['file_bytes_before']} -> {report['file_bytes_after']} bytes"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Archive idle conversations into compressed storage.")
+    parser.add_argument("--archive", action="store_true", help="Archive conversations idle past --idle-days, then vacuum")
+    parser.add_argument("--idle-days", type=float, help=f"Idle age in days (default {config.ARCHIVE_IDLE_DAYS:g})")
+    parser.add_argument("--limit", type=int, help=f"Most conversations to archive (default {config.ARCHIVE_BATCH_SIZE})")
+    parser.add_argument("--rehydrate", type=int, metavar="CONVERSATION_ID", help="Restore one archived conversation now")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="Switch realm.db to auto_vacuum=INCREMENTAL (one full VACUUM)")
+    parser.add_argument("--report", action="store_true", help="Print the space report")
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+    if args.rehydrate is not None:
+        print(f"Restored {rehydrate(args.rehydrate)} messages")
+    if args.archive:
+        print(json.dumps(archive_idle(args.idle_days, args.limit), indent=2))
+    if args.report or not (args.archive or args.rehydrate is not None or args.enable_incremental_vacuum):
+        print(json.dumps(space_report(), indent=2))
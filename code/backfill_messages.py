@@ -0,0 +1,88 @@
+"""Convert legacy JSON-in-a-string messages into the typed message columns, and date them.
+
+The app runs this itself when it upgrades a database that predates Alembic. To run it by hand
+(from the code/ directory, after `alembic upgrade head`):
+
+    python backfill_messages.py [--batch-size 5000] [--clear-json]
+"""
+import argparse
+import json
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import update
+
+from database import session_scope
+from models import Messages
+
+logger = logging.getLogger(__name__)
+
+# Analysis messages are stored as "Here's the <category> analysis:\n\n<result>"
+ANALYSIS_PATTERN = re.compile(r"^Here's the (\w+) analysis:")
+
+
+# Function to work out the typed column values for one legacy row
+def convert(message_id, data):
+    try:
+        message_data = json.loads(data)
+    except (TypeError, json.JSONDecodeError):
+        logger.error(f"Skipping message ID {message_id}: undecodable data")
+        return None
+    content = message_data.get("content") or ""
+    match = ANALYSIS_PATTERN.match(content) if message_data.get("role") == "assistant" else None
+    return {
+        "id": message_id,
+        "role": message_data.get("role"),
+        "content": content,
+        "category": match.group(1) if match else None,
+    }
+
+
+# Function to backfill all unconverted rows, one keyset-paginated batch per transaction
+def backfill(batch_size=5000, clear_json=False):
+    last_id = 0
+    converted = 0
+    while True:
+        with session_scope() as db:
+            rows = (
+                db.query(Messages.id, Messages.data)
+                .filter(Messages.id > last_id, Messages.role.is_(None), Messages.data.isnot(None))
+                .order_by(Messages.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+            values = [value for value in (convert(*row) for row in rows) if value is not None]
+            if clear_json:
+                for value in values:
+                    value["data"] = None
+            if values:
+                # Bulk UPDATE by primary key: one executemany per batch
+                db.execute(update(Messages), values)
+            converted += len(values)
+        logger.info(f"Backfilled {converted} messages (up to ID {last_id})")
+
+    # Legacy rows never recorded when they were written; they are dated by the backfill instead, so the
+    # archive's idle clock (archive.idle_conversations) starts at the upgrade
+    with session_scope() as db:
+        dated = (
+            db.query(Messages)
+            .filter(Messages.created_at.is_(None))
+            .update({Messages.created_at: datetime.utcnow()}, synchronize_session=False)
+        )
+    if dated:
+        logger.info(f"Dated {dated} messages without a created_at")
+    return converted
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Backfill typed message columns from the legacy JSON data column.")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--clear-json", action="store_true", help="Null out the legacy data column once a row is converted")
+    args = parser.parse_args()
+    total = backfill(args.batch_size, args.clear_json)
+    logger.info(f"Done: {total} messages converted")
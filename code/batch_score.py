@@ -0,0 +1,191 @@
+"""Score a whole directory of proposals headlessly.
+
+Usage (from the code/ directory):
+
+    python batch_score.py ../contents --output scores.parquet --workers 4 --rpm 50
+
+Progress is checkpointed to <output>.checkpoint.jsonl after every document, so an
+interrupted run picks up where it stopped when started again with the same output.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import analysis
+import config
+import metrics
+import scoring
+from bootstrap import upgrade_schema
+from extraction import extract_document
+from llm_client import get_client
+from prompts import CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_EXTENSIONS = (".pdf", ".docx", ".doc", ".txt")
+
+
+# Function to list the documents under a directory, recursively and in a stable order
+def find_documents(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(DOCUMENT_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+# Function to read the checkpoint; later records for the same file win
+def load_checkpoint(path):
+    records = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                records[record["path"]] = record
+    return records
+
+
+class Checkpoint:
+    """Append-only JSONL log of finished documents, flushed after every write."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# Function to score one document across the selected categories
+def score_document(path, categories, mode=None):
+    started = time.perf_counter()
+    record = {"path": path, "status": "ok", "error": None, "results": {}, "scores": {}, "errors": {}}
+    with metrics.run("batch", path) as run:
+        try:
+            content, report = extract_document(path)
+            record["file_hash"] = report["file_hash"]
+            stats = {}
+            for category, result, error in analysis.map_to_5c(content, categories, stats=stats, mode=mode):
+                if error is not None:
+                    record["errors"][category] = str(error)
+                else:
+                    prose, _ = scoring.split_structured(result)
+                    record["results"][category] = prose
+                    score = scoring.parse_result(category, result)
+                    if score is not None:
+                        record["scores"][category] = score
+                        scoring.save_score(score, document_id=report["file_hash"], source=path, model=get_client().model)
+            record["prompt_tokens"] = sum(stat["prompt_tokens"] for stat in stats.values())
+            record["completion_tokens"] = sum(stat["completion_tokens"] for stat in stats.values())
+            if record["errors"]:
+                record["status"] = "partial" if record["results"] else "failed"
+        except Exception as e:
+            record.update(status="failed", error=str(e), prompt_tokens=0, completion_tokens=0)
+    record["seconds"] = time.perf_counter() - started
+    # Where this document's time went (extraction, llm_request, db_query, ...)
+    record["spans"] = {row["span"]: round(row["seconds"], 3) for row in run.breakdown()}
+    return record
+
+
+# Function to flatten checkpoint records into one row per document
+def to_frame(records, categories):
+    rows = []
+    for record in records:
+        row = {
+            "path": record["path"],
+            "file_hash": record.get("file_hash"),
+            "status": record["status"],
+            "error": record.get("error") or "; ".join(f"{c}: {e}" for c, e in record.get("errors", {}).items()) or None,
+            "seconds": record.get("seconds"),
+            "prompt_tokens": record.get("prompt_tokens", 0),
+            "completion_tokens": record.get("completion_tokens", 0),
+        }
+        for category in categories:
+            row[category] = record.get("results", {}).get(category)
+            score = record.get("scores", {}).get(category)
+            row[f"{category} score"] = score["score"] if score else None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# Function to write results as Parquet or CSV, chosen by the output file extension
+def write_results(frame, output):
+    if output.lower().endswith(".csv"):
+        frame.to_csv(output, index=False)
+    else:
+        frame.to_parquet(output, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch 5C scoring of every proposal in a directory.")
+    parser.add_argument("directory", help="Directory to scan for PDF, DOCX and TXT proposals")
+    parser.add_argument("--output", default="scores.parquet", help="Results file (.parquet or .csv)")
+    parser.add_argument("--workers", type=int, default=4, help="Documents processed at the same time")
+    parser.add_argument("--rpm", type=float, default=None, help="API requests per minute across all workers")
+    parser.add_argument("--categories", nargs="+", choices=CATEGORIES, default=list(CATEGORIES))
+    parser.add_argument(
+        "--mode",
+        choices=[analysis.AUTO, analysis.COMBINED, analysis.PER_CATEGORY],
+        default=None,
+        help="Send all categories in one request per document, one request per category, or pick by token savings",
+    )
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port while running")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <output>.checkpoint.jsonl)")
+    args = parser.parse_args(argv)
+
+    if args.rpm is not None:
+        # Read when the shared client is first created, so it must be set before any call
+        config.LLM_REQUESTS_PER_MINUTE = args.rpm
+    upgrade_schema()
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint.jsonl"
+    done = load_checkpoint(checkpoint_path)
+    documents = find_documents(args.directory)
+    pending = [path for path in documents if done.get(path, {}).get("status") != "ok"]
+    logger.info(f"Found {len(documents)} documents; {len(documents) - len(pending)} already scored, {len(pending)} to go")
+
+    checkpoint = Checkpoint(checkpoint_path)
+    started = time.perf_counter()
+    processed = []
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="realm-batch") as executor:
+        futures = {executor.submit(score_document, path, args.categories, args.mode): path for path in pending}
+        for future in as_completed(futures):
+            record = future.result()
+            checkpoint.write(record)
+            done[record["path"]] = record
+            processed.append(record)
+            logger.info(f"[{len(processed)}/{len(pending)}] {record['status']}: {record['path']} ({record['seconds']:.1f}s)")
+    elapsed = time.perf_counter() - started
+
+    frame = to_frame([done[path] for path in documents if path in done], args.categories)
+    write_results(frame, args.output)
+
+    tokens = [record.get("prompt_tokens", 0) + record.get("completion_tokens", 0) for record in processed]
+    per_minute = len(processed) / (elapsed / 60) if elapsed > 0 else 0.0
+    per_document = sum(tokens) / len(tokens) if tokens else 0.0
+    failed = sum(1 for record in processed if record["status"] != "ok")
+    print(f"Scored {len(processed)} documents in {elapsed:.1f}s ({failed} with failures)")
+    print(f"Throughput: {per_minute:.2f} documents/minute")
+    print(f"Tokens per document: {per_document:.0f}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
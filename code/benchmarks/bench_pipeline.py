@@ -0,0 +1,380 @@
+"""Reproducible benchmarks of document extraction, message storage and 5C analysis.
+
+Usage (from the code/ directory):
+
+    python -m benchmarks.bench_pipeline --output bench.json
+    python -m benchmarks.bench_pipeline --quick --baseline bench.json --tolerance 0.25
+
+Suites:
+- extraction: process_document on synthetic PDFs and DOCX files of 10 to 1000 pages, cold
+  (text cache cleared before every call) and warm (served from the text cache)
+- database: get_messages / add_message / add_messages against a database seeded with 10k
+  conversations and 1M messages
+- analysis: map_to_5c against the local mock LLM server, for each latency, concurrency and
+  request mode
+- concurrency: many underwriters chatting while others run full 5C analyses, all through the
+  shared LLM scheduler, with chat prioritised and (for comparison) without priorities
+
+Each suite runs in its own subprocess and working directory, so its peak RSS is its own and
+realm.db, the text cache and the analysis cache of the app are never touched. The report
+(throughput, p50/p95/p99 latency and peak RSS per case) is written as JSON; with --baseline the
+run exits non-zero if any case is slower than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import harness, synthetic
+
+SUITES = ("extraction", "database", "analysis", "concurrency")
+
+FULL_SETTINGS = {
+    "pages": [10, 100, 1000],
+    "formats": ["pdf", "docx"],
+    "extraction_repeats": 3,
+    "conversations": 10000,
+    "messages": 1000000,
+    "db_samples": 1000,
+    "latencies": [0.05, 0.25, 1.0],
+    "concurrency": [1, 5],
+    "modes": ["per_category", "combined"],
+    "document_words": 3000,
+    "analysis_repeats": 5,
+    "error_rate": 0.05,
+    "chat_users": 50,
+    "bulk_users": 10,
+    "chat_turns": 3,
+    "concurrency_latency": 0.25,
+    "seed": 0,
+}
+QUICK_SETTINGS = {
+    **FULL_SETTINGS,
+    "pages": [10, 100],
+    "extraction_repeats": 2,
+    "conversations": 1000,
+    "messages": 50000,
+    "db_samples": 200,
+    "latencies": [0.02, 0.1],
+    "analysis_repeats": 3,
+    "error_rate": 0.0,
+    "chat_users": 20,
+    "bulk_users": 4,
+    "chat_turns": 2,
+    "concurrency_latency": 0.05,
+}
+
+
+def run_extraction(settings):
+    import config
+    from extraction import process_document
+
+    results = []
+    os.makedirs("inputs", exist_ok=True)
+    makers = {"pdf": synthetic.make_pdf, "docx": synthetic.make_docx}
+    for file_format in settings["formats"]:
+        for pages in settings["pages"]:
+            path = makers[file_format](os.path.join("inputs", f"document-{pages}.{file_format}"), pages, settings["seed"])
+            params = {"format": file_format, "pages": pages, "bytes": os.path.getsize(path)}
+
+            def extract():
+                content = process_document(path)
+                if content.startswith("Error processing document"):
+                    raise RuntimeError(content)
+
+            def clear_cache():
+                shutil.rmtree(config.TEXT_CACHE_DIR, ignore_errors=True)
+
+            repeats = settings["extraction_repeats"]
+            cold = harness.measure(extract, repeats, setup=clear_cache)
+            results.append(harness.summarize(
+                "extraction", f"process_document/{file_format}/{pages}p/cold", cold, pages * repeats, "pages", params
+            ))
+            # The last cold call left the text in the cache
+            warm = harness.measure(extract, repeats)
+            results.append(harness.summarize(
+                "extraction", f"process_document/{file_format}/{pages}p/warm", warm, pages * repeats, "pages", params
+            ))
+    return results
+
+
+def run_database(settings):
+    from sqlalchemy import func
+
+    import config
+    import database
+    from models import Base, Conversation, Messages
+    from prompts import CATEGORIES
+
+    results = []
+    conversations, messages = settings["conversations"], settings["messages"]
+    database.init_db()
+    with database.session_scope() as db:
+        # A database seeded by an earlier run in the same --workdir is reused, minus the messages that run added
+        db.query(Messages).filter(Messages.id > messages).delete(synchronize_session=False)
+        seeded = (db.query(func.count(Conversation.id)).scalar(), db.query(func.count(Messages.id)).scalar())
+    if seeded != (conversations, messages):
+        Base.metadata.drop_all(bind=database.engine)
+        database.init_db()
+        started = time.perf_counter()
+        with database.engine.begin() as connection:
+            synthetic.seed_database(connection, conversations, messages, seed=settings["seed"])
+        seconds = time.perf_counter() - started
+        results.append(harness.summarize(
+            "database", "seed", [seconds], messages, "messages", {"conversations": conversations, "messages": messages}
+        ))
+
+    rng = random.Random(settings["seed"])
+    samples = settings["db_samples"]
+    page_size = config.MESSAGE_PAGE_SIZE
+    params = {"conversations": conversations, "messages": messages, "page_size": page_size}
+
+    def sample_ids(n):
+        return [rng.randint(1, conversations) for _ in range(n)]
+
+    def time_calls(case, calls, items_per_call=1, unit="queries"):
+        latencies = harness.measure_each(calls)
+        results.append(harness.summarize("database", case, latencies, len(latencies) * items_per_call, unit, params))
+
+    ids = sample_ids(samples)
+    time_calls("get_messages/latest_page", [lambda cid=cid: database.get_messages(cid, limit=page_size) for cid in ids])
+    # Scrolling back: the page before the oldest message of the latest page
+    ids = sample_ids(samples)
+    oldest = {cid: database.get_messages(cid, limit=page_size)[0]["id"] for cid in set(ids)}
+    time_calls("get_messages/older_page", [
+        lambda cid=cid: database.get_messages(cid, limit=page_size, before_id=oldest[cid]) for cid in ids
+    ])
+    ids = sample_ids(max(1, samples // 10))
+    time_calls("get_messages/full_history", [lambda cid=cid: database.get_messages(cid) for cid in ids])
+
+    content = synthetic.make_text(60, settings["seed"])
+    ids = sample_ids(samples)
+    time_calls("add_message", [
+        lambda cid=cid: database.add_message(cid, "assistant", content, category="Capacity") for cid in ids
+    ], unit="messages")
+    # One message per category, as a full 5C run stores them
+    run_messages = [("assistant", content, category) for category in CATEGORIES]
+    ids = sample_ids(max(1, samples // 5))
+    time_calls("add_messages/5C_run", [
+        lambda cid=cid: database.add_messages(cid, run_messages) for cid in ids
+    ], items_per_call=len(run_messages), unit="messages")
+    return results
+
+
+def run_analysis(settings):
+    import config
+    import llm_client
+    from analysis import map_to_5c
+    from mock_llm_server import start_mock_server
+    from prompts import CATEGORIES
+
+    # The client's retry backoff is jittered; seed it so retries are reproducible too
+    random.seed(settings["seed"])
+    content = synthetic.make_text(settings["document_words"], settings["seed"])
+    cases = [(latency, 0.0) for latency in settings["latencies"]]
+    if settings["error_rate"] > 0:
+        cases.append((settings["latencies"][0], settings["error_rate"]))
+
+    results = []
+    for latency, error_rate in cases:
+        server, url = start_mock_server(latency=latency, error_rate=error_rate, seed=settings["seed"])
+        config.MOCK_LLM_URL = url
+        llm_client.reset_client()
+        options = server.RequestHandlerClass.options
+        try:
+            for workers in settings["concurrency"]:
+                for mode in settings["modes"]:
+                    requests_before = options.requests
+
+                    def analyze():
+                        for category, _, error in map_to_5c(content, CATEGORIES, max_workers=workers, mode=mode):
+                            if error is not None:
+                                raise RuntimeError(f"{category}: {error}")
+
+                    repeats = settings["analysis_repeats"]
+                    latencies = harness.measure(analyze, repeats)
+                    case = f"map_to_5c/{mode}/latency={latency}s/workers={workers}"
+                    if error_rate:
+                        case += f"/errors={error_rate}"
+                    params = {
+                        "latency": latency,
+                        "error_rate": error_rate,
+                        "workers": workers,
+                        "mode": mode,
+                        "document_words": settings["document_words"],
+                        "requests_per_run": (options.requests - requests_before) / repeats,
+                    }
+                    results.append(harness.summarize(
+                        "analysis", case, latencies, len(CATEGORIES) * repeats, "categories", params
+                    ))
+        finally:
+            llm_client.reset_client()
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def run_concurrency(settings):
+    import threading
+
+    import config
+    import llm_client
+    import scheduler
+    from analysis import map_to_5c
+    from mock_llm_server import start_mock_server
+    from prompts import CATEGORIES
+
+    content = synthetic.make_text(settings["document_words"], settings["seed"])
+    latency = settings["concurrency_latency"]
+    server, url = start_mock_server(latency=latency, seed=settings["seed"])
+    config.MOCK_LLM_URL = url
+    results = []
+    try:
+        for prioritized in (True, False):
+            llm_client.reset_client()
+            scheduler.reset_scheduler()
+            chat_latencies, bulk_latencies, failures = [], [], []
+            lock = threading.Lock()
+            # Without priorities, chat queues like any other call
+            chat_priority = scheduler.INTERACTIVE if prioritized else scheduler.BULK
+
+            def bulk(user):
+                with scheduler.caller(f"bulk-{user}", scheduler.BULK):
+                    started = time.perf_counter()
+                    for category, _, error in map_to_5c(content, CATEGORIES, mode="per_category"):
+                        if error is not None:
+                            failures.append(f"{category}: {error}")
+                    with lock:
+                        bulk_latencies.append(time.perf_counter() - started)
+
+            def chat(user):
+                with scheduler.caller(f"user-{user}", chat_priority):
+                    for turn in range(settings["chat_turns"]):
+                        started = time.perf_counter()
+                        try:
+                            llm_client.call_perplexity_api(f"Question {turn} from user {user}: {content[:2000]}")
+                        except llm_client.LLMError as e:
+                            failures.append(str(e))
+                            continue
+                        with lock:
+                            chat_latencies.append(time.perf_counter() - started)
+
+            threads = [threading.Thread(target=bulk, args=(user,)) for user in range(settings["bulk_users"])]
+            threads += [threading.Thread(target=chat, args=(user,)) for user in range(settings["chat_users"])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - started
+            if failures:
+                raise RuntimeError(f"{len(failures)} calls failed, e.g. {failures[0]}")
+
+            label = "prioritized" if prioritized else "fifo"
+            params = {
+                "latency": latency,
+                "chat_users": settings["chat_users"],
+                "bulk_users": settings["bulk_users"],
+                "max_in_flight": config.LLM_MAX_IN_FLIGHT,
+            }
+            results.append(harness.summarize(
+                "concurrency", f"chat_reply/{label}/users={settings['chat_users']}/bulk={settings['bulk_users']}",
+                chat_latencies, unit="replies", params=params, wall_seconds=wall,
+            ))
+            results.append(harness.summarize(
+                "concurrency", f"5C_run/{label}/users={settings['chat_users']}/bulk={settings['bulk_users']}",
+                bulk_latencies, len(bulk_latencies) * len(CATEGORIES), "categories", params, wall_seconds=wall,
+            ))
+    finally:
+        llm_client.reset_client()
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+RUNNERS = {"extraction": run_extraction, "database": run_database, "analysis": run_analysis, "concurrency": run_concurrency}
+
+
+# Function to run one suite in a fresh interpreter, inside its own directory under workdir
+def run_suite_subprocess(suite, settings, workdir):
+    suite_dir = os.path.join(workdir, suite)
+    os.makedirs(suite_dir, exist_ok=True)
+    result_file = os.path.join(suite_dir, "results.json")
+    code_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [code_dir, os.environ.get("PYTHONPATH")])),
+        "REALM_DATA_DIR": "data",
+        "REALM_LLM_BACKEND": "mock",
+        "REALM_LLM_REQUESTS_PER_MINUTE": "0",
+        "REALM_CACHE_ENABLED": "0",
+    }
+    command = [
+        sys.executable, "-m", "benchmarks.bench_pipeline",
+        "--run-suite", suite, "--settings", json.dumps(settings), "--result-file", result_file,
+    ]
+    subprocess.run(command, cwd=suite_dir, env=env, check=True)
+    with open(result_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction, message storage and 5C analysis.")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs, for a fast check before deploying")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument("--workdir", help="Keep inputs and the seeded database here and reuse them on the next run")
+    parser.add_argument("--seed", type=int, default=0)
+    # Internal: run one suite in this process and write its results to --result-file
+    parser.add_argument("--run-suite", choices=SUITES, help=argparse.SUPPRESS)
+    parser.add_argument("--settings", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_suite:
+        results = RUNNERS[args.run_suite](json.loads(args.settings))
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        return 0
+
+    settings = {**(QUICK_SETTINGS if args.quick else FULL_SETTINGS), "seed": args.seed}
+    workdir = args.workdir or tempfile.mkdtemp(prefix="realm-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    try:
+        for suite in args.suites:
+            print(f"Running the {suite} suite...", flush=True)
+            results.extend(run_suite_subprocess(suite, settings, workdir))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": harness.environment(), "settings": settings, "results": results}
+    harness.print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = harness.compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"OK: no case regressed by more than {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""Start-up benchmark: cold start and the fixed cost of every Streamlit rerun.
+
+Usage (from the code/ directory):
+
+    python -m benchmarks.bench_startup --output startup.json
+
+Cases:
+- imports: importing the modules app.py needs, in a fresh interpreter, and which heavy
+  libraries that pulls in (document parsers should not be among them)
+- bootstrap: the one-time start-up work (environment check, directories, tables, initial
+  conversation) against a new database
+- rerun_startup_work/uncached: the start-up work every rerun used to repeat (environment
+  check, directories, initial conversation query); rerun_startup_work/cached: the cached
+  lookup that replaces it
+- prompts: building the 5C prompts for one document, first call and steady state
+- app (only when Streamlit is installed): a cold run of app.py and its reruns, via AppTest
+
+Every case runs in a fresh subprocess and scratch directory, so realm.db is never touched.
+"""
+import argparse
+import functools
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import harness
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Backend modules app.py imports, besides Streamlit itself
+APP_MODULES = (
+    "config", "analysis", "archive", "bootstrap", "database", "chunking", "llm_client", "prompts", "jobs", "memory",
+    "metrics", "portfolio", "reports", "result_cache", "retrieval", "scheduler", "stress", "uploads",
+)
+HEAVY_MODULES = ("PyPDF2", "docx", "pandas", "numpy", "jsonschema", "torch", "transformers")
+
+
+# Run with `python -c` so nothing but the standard library is loaded before the timed imports
+IMPORTS_SCRIPT = """
+import json, resource, sys, time
+modules, heavy, result_file = json.loads(sys.argv[1]), json.loads(sys.argv[2]), sys.argv[3]
+started = time.perf_counter()
+for name in modules:
+    __import__(name)
+seconds = time.perf_counter() - started
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+with open(result_file, "w") as f:
+    json.dump({
+        "seconds": seconds,
+        "loaded": [name for name in heavy if name in sys.modules],
+        "_peak_rss_mb": peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024,
+    }, f)
+"""
+
+
+def case_bootstrap(settings):
+    import bootstrap
+
+    started = time.perf_counter()
+    bootstrap.bootstrap()
+    return {"seconds": time.perf_counter() - started}
+
+
+def case_reruns(settings):
+    import bootstrap
+    import database
+    from prompts import CATEGORIES, build_category_prompt
+
+    from benchmarks import synthetic
+
+    bootstrap.bootstrap()
+
+    # What app.py used to do on every rerun (init_db was already cached)
+    def rerun_work():
+        bootstrap.check_environment()
+        bootstrap.prepare_directories()
+        database.create_initial_conversation()
+
+    # functools.cache stands in for st.cache_resource, whose hit costs about the same
+    cached = functools.cache(bootstrap.bootstrap)
+    cached()
+    reruns = settings["reruns"]
+    uncached = harness.measure(rerun_work, reruns)
+    hits = harness.measure(cached, reruns)
+
+    content = synthetic.make_text(3000, settings["seed"])
+
+    def build_prompts():
+        for category in CATEGORIES:
+            build_category_prompt(category, content)
+
+    first = harness.measure(build_prompts, 1)
+    steady = harness.measure(build_prompts, reruns)
+    return {"uncached": uncached, "cached": hits, "prompts_first": first, "prompts_steady": steady}
+
+
+def case_app(settings):
+    from streamlit.testing.v1 import AppTest
+
+    started = time.perf_counter()
+    app = AppTest.from_file(os.path.join(CODE_DIR, "app.py"), default_timeout=120)
+    app.run()
+    cold = time.perf_counter() - started
+    reruns = harness.measure(app.run, settings["reruns"])
+    return {"cold": [cold], "reruns": reruns}
+
+
+CASES = {"bootstrap": case_bootstrap, "reruns": case_reruns, "app": case_app}
+
+
+# Function to run one case in a fresh interpreter, inside a new directory under workdir
+def run_case_subprocess(case, settings, workdir):
+    case_dir = tempfile.mkdtemp(prefix=f"{case}-", dir=workdir)
+    result_file = os.path.join(case_dir, "result.json")
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [CODE_DIR, os.environ.get("PYTHONPATH")])),
+        "REALM_DATA_DIR": "data",
+        # A benchmark run must not grab the metrics port of a running app
+        "REALM_METRICS_ENABLED": "0",
+    }
+    if case == "imports":
+        command = [sys.executable, "-c", IMPORTS_SCRIPT, json.dumps(APP_MODULES), json.dumps(HEAVY_MODULES), result_file]
+    else:
+        command = [
+            sys.executable, "-m", "benchmarks.bench_startup",
+            "--run-case", case, "--settings", json.dumps(settings), "--result-file", result_file,
+        ]
+    subprocess.run(command, cwd=case_dir, env=env, check=True)
+    with open(result_file, encoding="utf-8") as f:
+        result = json.load(f)
+    # Peak RSS of the child, which the parent cannot see directly
+    result["peak_rss_mb"] = result.pop("_peak_rss_mb")
+    return result
+
+
+# Function to build a result record with the child's peak RSS instead of this process's
+def _record(case, latencies, peak_rss_mb, params=None):
+    record = harness.summarize("startup", case, latencies, params=params)
+    record["peak_rss_mb"] = round(peak_rss_mb, 1)
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cold start and per-rerun start-up overhead.")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh processes for the imports and bootstrap cases")
+    parser.add_argument("--reruns", type=int, default=50, help="Reruns timed within one process")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    # Internal: run one case in this process and write its result to --result-file
+    parser.add_argument("--run-case", choices=list(CASES), help=argparse.SUPPRESS)
+    parser.add_argument("--settings", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        # Start-up warnings (e.g. a missing API key) would be printed once per timed call
+        logging.basicConfig(level=logging.ERROR)
+        result = CASES[args.run_case](json.loads(args.settings))
+        result["_peak_rss_mb"] = harness.peak_rss_mb()
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    settings = {"reruns": args.reruns, "seed": args.seed}
+    workdir = tempfile.mkdtemp(prefix="realm-startup-")
+    results = []
+    try:
+        imports = [run_case_subprocess("imports", settings, workdir) for _ in range(args.repeats)]
+        results.append(_record(
+            "imports", [run["seconds"] for run in imports], max(run["peak_rss_mb"] for run in imports),
+            {"modules": list(APP_MODULES), "heavy_modules_loaded": imports[-1]["loaded"]},
+        ))
+        cold = [run_case_subprocess("bootstrap", settings, workdir) for _ in range(args.repeats)]
+        results.append(_record("bootstrap/cold", [run["seconds"] for run in cold], max(run["peak_rss_mb"] for run in cold)))
+
+        reruns = run_case_subprocess("reruns", settings, workdir)
+        for name, case in (
+            ("uncached", "rerun_startup_work/uncached"),
+            ("cached", "rerun_startup_work/cached"),
+            ("prompts_first", "prompts/first"),
+            ("prompts_steady", "prompts/steady"),
+        ):
+            results.append(_record(case, reruns[name], reruns["peak_rss_mb"]))
+
+        if importlib.util.find_spec("streamlit") is not None:
+            app = run_case_subprocess("app", settings, workdir)
+            results.append(_record("app/cold", app["cold"], app["peak_rss_mb"]))
+            results.append(_record("app/rerun", app["reruns"], app["peak_rss_mb"]))
+        else:
+            print("Streamlit is not installed; skipping the app cases")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": harness.environment(), "settings": settings, "results": results}
+    harness.print_results(results)
+    print(f"Heavy modules loaded by the app's imports: {', '.join(imports[-1]['loaded']) or 'none'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
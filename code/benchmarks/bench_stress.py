@@ -0,0 +1,62 @@
+"""Throughput benchmark for the Monte Carlo stress engine.
+
+Usage (from the code/ directory):
+
+    python -m benchmarks.bench_stress --projects 20 --draws 100000
+
+Runs every preset scenario together against synthetic projects and exits non-zero if any
+project takes longer than --budget seconds.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import stress
+from prompts import CATEGORIES, SUB_ELEMENTS
+
+
+# Function to make a random but plausible project: every category scored, about 80% of elements rated
+def synthetic_project(rng):
+    scores = {category: float(rng.uniform(30, 95)) for category in CATEGORIES}
+    ratings = {
+        category: {element: float(rng.integers(0, 6)) if rng.random() < 0.8 else None for element in SUB_ELEMENTS[category]}
+        for category in CATEGORIES
+    }
+    return scores, ratings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Monte Carlo stress testing throughput.")
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--draws", type=int, default=100000)
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum seconds allowed per project")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    shocks = stress.build_scenario(list(stress.SCENARIOS))
+    # Warm-up so one-off import and allocation costs don't count against the first project
+    stress.simulate(*synthetic_project(rng), shocks, draws=1000)
+
+    timings = []
+    started = time.perf_counter()
+    for _ in range(args.projects):
+        result = stress.simulate(*synthetic_project(rng), shocks, draws=args.draws, seed=int(rng.integers(1 << 31)))
+        timings.append(result["seconds"])
+    elapsed = time.perf_counter() - started
+
+    timings = np.array(timings)
+    print(f"Projects: {args.projects}, draws per project: {args.draws}")
+    print(f"Seconds per project: mean {timings.mean():.3f}, p50 {np.percentile(timings, 50):.3f}, max {timings.max():.3f}")
+    print(f"Throughput: {args.projects * args.draws / elapsed:,.0f} draws/second")
+    if timings.max() > args.budget:
+        print(f"FAIL: slowest project took {timings.max():.3f}s (budget {args.budget:.1f}s)")
+        return 1
+    print(f"OK: every project finished within {args.budget:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Measurement helpers shared by the benchmark suites.
+
+A case is a list of per-operation latencies plus the number of items (pages, messages,
+categories...) processed; `summarize` turns it into one JSON-ready record. Peak RSS is the
+high-water mark of the current process, which is why bench_pipeline runs each suite in a
+fresh subprocess.
+"""
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+# Function to get the peak resident set size of this process in MiB
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Function to call fn() `repeats` times; returns the latency of each call in seconds
+def measure(fn, repeats, setup=None):
+    latencies = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+# Function to call each of a list of zero-argument callables once; returns the latency of each call in seconds
+def measure_each(calls):
+    latencies = []
+    for call in calls:
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+# Function to turn the latencies of one case into a result record.
+# `items` is how many units all the calls processed together, for the throughput figure.
+def summarize(suite, case, latencies, items=None, unit="ops", params=None, wall_seconds=None):
+    values = np.array(latencies, dtype=float)
+    total = float(values.sum()) if wall_seconds is None else wall_seconds
+    items = len(values) if items is None else items
+    p50, p95, p99 = np.percentile(values, LATENCY_PERCENTILES)
+    return {
+        "suite": suite,
+        "case": case,
+        "params": params or {},
+        "samples": len(values),
+        "throughput": items / total if total > 0 else None,
+        "throughput_unit": f"{unit}/s",
+        "latency_seconds": {
+            "mean": float(values.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(values.max()),
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+# Function to print results as a table
+def print_results(results):
+    print(f"{'case':<72} {'throughput':>20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RSS MiB':>8}")
+    for record in results:
+        latency = record["latency_seconds"]
+        throughput = f"{record['throughput']:,.1f} {record['throughput_unit']}" if record["throughput"] else "-"
+        print(
+            f"{record['suite'] + '/' + record['case']:<72} {throughput:>20} "
+            f"{latency['p50'] * 1000:>9.1f} {latency['p95'] * 1000:>9.1f} {latency['p99'] * 1000:>9.1f} {record['peak_rss_mb']:>8.1f}"
+        )
+
+
+# Function to describe the machine and code a report was produced on
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+# Function to compare results with a baseline report; returns a list of regression messages.
+# A case regresses when its p95 latency grows, or its throughput drops, by more than `tolerance`.
+def compare(results, baseline, tolerance):
+    previous = {(record["suite"], record["case"]): record for record in baseline["results"]}
+    regressions = []
+    for record in results:
+        before = previous.get((record["suite"], record["case"]))
+        if before is None:
+            continue
+        name = f"{record['suite']}/{record['case']}"
+        p95, p95_before = record["latency_seconds"]["p95"], before["latency_seconds"]["p95"]
+        if p95_before > 0 and p95 > p95_before * (1 + tolerance):
+            regressions.append(f"{name}: p95 {p95_before * 1000:.1f} ms -> {p95 * 1000:.1f} ms")
+        throughput, throughput_before = record["throughput"], before["throughput"]
+        if throughput and throughput_before and throughput < throughput_before * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {throughput_before:,.1f} -> {throughput:,.1f} {record['throughput_unit']}"
+            )
+    return regressions
@@ -0,0 +1,112 @@
+"""Deterministic synthetic inputs for the benchmarks: documents and a seeded database.
+
+Everything is generated from a seed, so two runs of the harness measure the same bytes.
+PDFs are written directly (one Helvetica text stream per page), which keeps the generator
+free of extra dependencies and fast enough for 1000-page files.
+"""
+import random
+from datetime import datetime, timedelta
+
+import docx
+from docx.enum.text import WD_BREAK
+
+from models import Conversation, Messages
+from prompts import CATEGORIES
+
+WORDS = (
+    "revenue margin liquidity collateral covenant borrower lender equity debt cash flow capital "
+    "capacity conditions character project financing facility tranche maturity interest rate "
+    "guarantee security valuation asset risk exposure sponsor construction operation tariff "
+    "offtake reserve account audit report forecast sensitivity scenario market demand supply"
+).split()
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+
+
+# Function to make one line of filler text; PDF string delimiters never occur in WORDS
+def _line(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(WORDS_PER_LINE))
+
+
+# Function to make the lines of every page
+def _pages(pages, seed):
+    rng = random.Random(seed)
+    return [[_line(rng) for _ in range(LINES_PER_PAGE)] for _ in range(pages)]
+
+
+# Function to write a PDF with `pages` pages of text
+def make_pdf(path, pages, seed=0):
+    # Objects 1-3 are the catalog, the page tree and the font; each page adds a page and a content object
+    objects = {3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for i, lines in enumerate(_pages(pages, seed)):
+        page_id, content_id = 4 + 2 * i, 5 + 2 * i
+        text = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 790 Td {text} ET".encode("latin-1")
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(b"%d 0 R" % page_id)
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+
+    body = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(body)
+        body += b"%d 0 obj\n%s\nendobj\n" % (number, objects[number])
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    body += b"".join(b"%010d 00000 n \n" % offsets[number] for number in sorted(objects))
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(body)
+    return path
+
+
+# Function to write a DOCX with `pages` pages of paragraphs, separated by page breaks
+def make_docx(path, pages, seed=0):
+    document = docx.Document()
+    # add_paragraph() searches the body on every call; inserting before a fixed anchor does not
+    anchor = document.add_paragraph()
+    for i, lines in enumerate(_pages(pages, seed)):
+        if i:
+            anchor.insert_paragraph_before().add_run().add_break(WD_BREAK.PAGE)
+        for line in lines:
+            anchor.insert_paragraph_before(line)
+    anchor._p.getparent().remove(anchor._p)
+    document.save(path)
+    return path
+
+
+# Function to make plain text of roughly `words` words, e.g. a document to analyse
+def make_text(words, seed=0):
+    rng = random.Random(seed)
+    lines = [_line(rng) for _ in range(max(1, words // WORDS_PER_LINE))]
+    return "\n".join(lines)
+
+
+# Function to fill an empty database with conversations and messages using bulk inserts.
+# `connection` is a SQLAlchemy connection in a transaction.
+def seed_database(connection, conversations, messages, batch_size=50000, seed=0):
+    rng = random.Random(seed)
+    connection.execute(Conversation.__table__.insert(), [{"id": i, "name": f"Project {i}"} for i in range(1, conversations + 1)])
+    started_at = datetime(2024, 1, 1)
+    rows = []
+    for i in range(messages):
+        # Round-robin over conversations, so each conversation's turns alternate and its rows are spread out
+        assistant = (i // conversations) % 2 == 1
+        rows.append({
+            "conversation_id": i % conversations + 1,
+            "role": "assistant" if assistant else "user",
+            "content": " ".join(rng.choice(WORDS) for _ in range(60 if assistant else 15)),
+            "category": rng.choice(CATEGORIES) if assistant else None,
+            "created_at": started_at + timedelta(seconds=i),
+        })
+        if len(rows) == batch_size:
+            connection.execute(Messages.__table__.insert(), rows)
+            rows = []
+    if rows:
+        connection.execute(Messages.__table__.insert(), rows)
@@ -0,0 +1,138 @@
+"""One-time start-up work for the app.
+
+Streamlit re-runs app.py on every interaction, so app.py calls `bootstrap()` through
+st.cache_resource and everything here runs once per process: the environment check, the
+working directories, the database schema and the initial conversation.
+
+The schema is brought up to the latest Alembic revision here, so a realm.db from an older
+version gains its new columns and tables before the app reads them. A database that predates
+Alembic (an empty alembic_version) is stamped at the baseline revision first, and its legacy
+JSON messages are converted into the typed columns.
+"""
+import logging
+import os
+import time
+
+from sqlalchemy import inspect
+
+import config
+import database
+from llm_client import backend_settings
+from models import Base
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALEMBIC_DIR = os.path.join(ROOT_DIR, "alembic")
+# Revision that created the original conversations and messages tables
+BASELINE_REVISION = "ff1526aac52a"
+BASELINE_TABLES = {"conversations", "messages"}
+UPGRADE_STEPS = (
+    "To upgrade it by hand, from the project root: `alembic stamp ff1526aac52a` (only if the database "
+    "predates Alembic), then `alembic upgrade head`, then `cd code && python backfill_messages.py`."
+)
+
+
+class SchemaError(Exception):
+    """Raised when the database schema can't be brought up to date automatically."""
+
+# Directories the app writes to; the upload store and text cache add their own subdirectories
+DIRECTORIES = (config.UPLOAD_DIR, config.REPORTS_DIR, config.DATA_DIR)
+
+
+# Function to list problems with the environment that the UI should warn about
+def check_environment():
+    warnings = []
+    # API key of the configured LLM backend (PPLX_KEY for Perplexity); the mock backend needs none
+    key_env = backend_settings()["key_env"]
+    if key_env and key_env not in os.environ:
+        warnings.append(f"{key_env} environment variable not found. Please set it before making API calls.")
+    for warning in warnings:
+        logger.warning(warning)
+    return warnings
+
+
+# Function to create the working directories if they don't exist
+def prepare_directories():
+    for directory in DIRECTORIES:
+        os.makedirs(directory, exist_ok=True)
+
+
+# Function to build an Alembic config for the app's database. No ini file is read, so Alembic
+# leaves the app's logging configuration alone.
+def _alembic_config():
+    from alembic.config import Config
+
+    alembic_config = Config()
+    alembic_config.set_main_option("script_location", ALEMBIC_DIR)
+    alembic_config.set_main_option("sqlalchemy.url", database.DATABASE_URL)
+    return alembic_config
+
+
+# Function to bring the database schema up to the latest revision; returns the revision it started from
+# ("new" for an empty database). Raises SchemaError when the schema is not one it can upgrade.
+def upgrade_schema():
+    from alembic import command
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    alembic_config = _alembic_config()
+    script = ScriptDirectory.from_config(alembic_config)
+    head = script.get_current_head()
+    with database.engine.connect() as conn:
+        context = MigrationContext.configure(conn)
+        current = context.get_current_revision()
+        tables = set(inspect(conn).get_table_names()) - {"alembic_version"}
+        legacy = current is None and tables == BASELINE_TABLES and "role" not in {
+            column["name"] for column in inspect(conn).get_columns("messages")
+        }
+        # An unversioned database that isn't the legacy schema may have been built by create_all
+        matches_models = current is None and tables and not legacy and not compare_metadata(context, Base.metadata)
+
+    if current == head:
+        return current
+    if current is None:
+        if not tables:
+            database.init_db()
+            command.stamp(alembic_config, "head")
+            logger.info(f"Created the database schema at revision {head}")
+            return "new"
+        if matches_models:
+            # Built by create_all from the current models, but never stamped
+            command.stamp(alembic_config, "head")
+            logger.info(f"Stamped the unversioned database at revision {head}")
+            return None
+        if not legacy:
+            raise SchemaError(f"The database has no Alembic revision and its tables ({', '.join(sorted(tables))}) "
+                              f"match neither the original schema nor the current one. {UPGRADE_STEPS}")
+        logger.info(f"Stamping the unversioned database at the baseline revision {BASELINE_REVISION}")
+        command.stamp(alembic_config, BASELINE_REVISION)
+    elif current not in {revision.revision for revision in script.walk_revisions()}:
+        raise SchemaError(f"The database is at revision {current}, which this version of the app does not know "
+                          f"(it may have been upgraded by a newer version). {UPGRADE_STEPS}")
+
+    logger.info(f"Upgrading the database schema from {current or BASELINE_REVISION} to {head}")
+    try:
+        command.upgrade(alembic_config, "head")
+    except Exception as e:
+        raise SchemaError(f"Upgrading the database schema failed: {str(e)}. {UPGRADE_STEPS}") from e
+
+    from backfill_messages import backfill
+
+    converted = backfill()
+    if converted:
+        logger.info(f"Converted {converted} legacy messages into the typed columns")
+    return current
+
+
+# Function to run all start-up work; returns {"warnings", "created_conversation", "seconds"}
+def bootstrap():
+    started = time.perf_counter()
+    warnings = check_environment()
+    prepare_directories()
+    upgrade_schema()
+    created = database.create_initial_conversation() is not None
+    seconds = time.perf_counter() - started
+    logger.info(f"Bootstrapped the app in {seconds * 1000:.0f} ms")
+    return {"warnings": warnings, "created_conversation": created, "seconds": seconds}
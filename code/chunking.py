@@ -0,0 +1,98 @@
+import logging
+import math
+import threading
+from bisect import bisect_left
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio used when no tokenizer can be loaded
+CHARS_PER_TOKEN = 4
+
+
+class TokenBudgetError(ValueError):
+    """Raised when a prompt cannot fit in the model's context budget."""
+
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+# Function to load the tokenizer once; returns None if it is unavailable (e.g. offline)
+def get_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            _tokenizer_loaded = True
+            try:
+                from tokenizers import Tokenizer
+                _tokenizer = Tokenizer.from_pretrained(config.TOKENIZER_NAME)
+            except Exception as e:
+                logger.warning(f"Could not load tokenizer {config.TOKENIZER_NAME}, estimating tokens from length: {str(e)}")
+        return _tokenizer
+
+
+# Function to count the tokens in a piece of text
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+# Function to get the character offset at which each token starts
+def _token_starts(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return list(range(0, len(text), CHARS_PER_TOKEN))
+    return [start for start, _ in tokenizer.encode(text, add_special_tokens=False).offsets]
+
+
+# Function to cut text down to at most max_tokens tokens, marking the cut
+def truncate_tokens(text, max_tokens):
+    starts = _token_starts(text)
+    if len(starts) <= max_tokens:
+        return text
+    return text[:starts[max(max_tokens, 0)]].rstrip() + " [...]"
+
+
+# Function to check that a prompt leaves room for the reply in the model context
+def check_budget(prompt, response_tokens=None):
+    response_tokens = config.RESPONSE_TOKENS if response_tokens is None else response_tokens
+    tokens = count_tokens(prompt)
+    limit = config.MODEL_CONTEXT_TOKENS - response_tokens
+    if tokens > limit:
+        raise TokenBudgetError(f"Prompt has {tokens} tokens, above the {limit} token budget")
+    return tokens
+
+
+# Function to split text into token-bounded chunks that overlap by overlap_tokens
+def chunk_text(text, max_tokens, overlap_tokens=0):
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+
+    starts = _token_starts(text)
+    total = len(starts)
+    if total <= max_tokens:
+        return [text] if text else []
+
+    chunks = []
+    first = 0
+    while first < total:
+        last = min(first + max_tokens, total)
+        start_char = starts[first]
+        end_char = starts[last] if last < total else len(text)
+        if last < total:
+            # Prefer to break at a line or sentence end within the last tenth of the chunk
+            window = start_char + (end_char - start_char) * 9 // 10
+            cut = max(text.rfind("\n", window, end_char), text.rfind(". ", window, end_char))
+            if cut > window:
+                end_char = cut + 1
+                last = max(bisect_left(starts, end_char), first + 1)
+        chunks.append(text[start_char:end_char])
+        if last >= total:
+            break
+        first = max(last - overlap_tokens, first + 1)
+    return chunks
@@ -0,0 +1,172 @@
+import os
+
+# Analysis engine settings
+# Maximum number of 5C categories analysed at the same time
+MAX_CONCURRENCY = int(os.environ.get("REALM_MAX_CONCURRENCY", "5"))
+# Seconds a single category may run before it is reported as timed out
+CATEGORY_TIMEOUT = float(os.environ.get("REALM_CATEGORY_TIMEOUT", "180"))
+
+# Perplexity API client settings
+PPLX_API_URL = "https://api.perplexity.ai/chat/completions"
+PPLX_MODEL = "llama-3.1-sonar-huge-128k-online"
+
+# LLM backend: "perplexity", "openai" (any OpenAI-compatible chat completions endpoint)
+# or "mock" (the local stand-in server in mock_llm_server.py)
+LLM_BACKEND = os.environ.get("REALM_LLM_BACKEND", "perplexity")
+# Override the chosen backend's endpoint URL and model
+LLM_API_URL = os.environ.get("REALM_LLM_API_URL")
+LLM_MODEL = os.environ.get("REALM_LLM_MODEL")
+OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_MODEL = "gpt-4o-mini"
+MOCK_LLM_URL = os.environ.get("REALM_MOCK_LLM_URL", "http://127.0.0.1:8765/v1/chat/completions")
+
+# Connect/read timeouts for a single HTTP attempt (seconds)
+LLM_CONNECT_TIMEOUT = float(os.environ.get("REALM_LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.environ.get("REALM_LLM_READ_TIMEOUT", "120"))
+# Retries on 429/5xx and network errors, with jittered exponential backoff
+LLM_MAX_RETRIES = int(os.environ.get("REALM_LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.environ.get("REALM_LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.environ.get("REALM_LLM_BACKOFF_MAX", "30"))
+# Keep-alive connections kept open to the API host
+LLM_POOL_SIZE = int(os.environ.get("REALM_LLM_POOL_SIZE", "10"))
+# Client-side rate limit shared by every session in this process
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get("REALM_LLM_REQUESTS_PER_MINUTE", "50"))
+LLM_RATE_LIMIT_BURST = int(os.environ.get("REALM_LLM_RATE_LIMIT_BURST", "5"))
+LLM_RATE_LIMIT_MAX_WAIT = float(os.environ.get("REALM_LLM_RATE_LIMIT_MAX_WAIT", "120"))
+
+# Process-wide LLM call scheduler, shared by every session, job and summary
+# Calls sent to the API at the same time; the rest wait in a queue
+LLM_MAX_IN_FLIGHT = int(os.environ.get("REALM_LLM_MAX_IN_FLIGHT", "8"))
+# Prompt plus completion tokens sent per minute (0 = no limit); set to the provider's limit
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("REALM_LLM_TOKENS_PER_MINUTE", "0"))
+# Completion tokens assumed for a call without max_tokens, until the real count is known
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.environ.get("REALM_LLM_EXPECTED_COMPLETION_TOKENS", "1000"))
+# Queued background and bulk calls beyond which new ones are rejected; chat is always queued
+LLM_MAX_QUEUED = int(os.environ.get("REALM_LLM_MAX_QUEUED", "200"))
+# Seconds a call may wait for a slot before it fails
+LLM_QUEUE_MAX_WAIT = float(os.environ.get("REALM_LLM_QUEUE_MAX_WAIT", "300"))
+# A waiting call moves up one priority level per this many seconds, so bulk runs are never starved
+LLM_PRIORITY_AGING_SECONDS = float(os.environ.get("REALM_LLM_PRIORITY_AGING_SECONDS", "60"))
+
+# 5C analysis result cache (stored in realm.db)
+CACHE_ENABLED = os.environ.get("REALM_CACHE_ENABLED", "1") != "0"
+CACHE_TTL_DAYS = float(os.environ.get("REALM_CACHE_TTL_DAYS", "30"))
+CACHE_MAX_ENTRIES = int(os.environ.get("REALM_CACHE_MAX_ENTRIES", "2000"))
+CACHE_MAX_BYTES = int(os.environ.get("REALM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Token budgets for large documents
+# Hugging Face tokenizer used to count tokens; falls back to a character estimate when unavailable
+TOKENIZER_NAME = os.environ.get("REALM_TOKENIZER", "gpt2")
+# Context window of the model, and the part of it reserved for the reply
+MODEL_CONTEXT_TOKENS = int(os.environ.get("REALM_MODEL_CONTEXT_TOKENS", "127000"))
+RESPONSE_TOKENS = int(os.environ.get("REALM_RESPONSE_TOKENS", "4000"))
+# Documents longer than this are analysed chunk by chunk and the findings merged
+SINGLE_PASS_MAX_TOKENS = int(os.environ.get("REALM_SINGLE_PASS_MAX_TOKENS", "30000"))
+CHUNK_TOKENS = int(os.environ.get("REALM_CHUNK_TOKENS", "12000"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("REALM_CHUNK_OVERLAP_TOKENS", "400"))
+# Reply cap for each chunk's partial findings, which bounds the size of the merge prompt
+MAP_RESPONSE_TOKENS = int(os.environ.get("REALM_MAP_RESPONSE_TOKENS", "1200"))
+# Chunks analysed at the same time within one category
+CHUNK_CONCURRENCY = int(os.environ.get("REALM_CHUNK_CONCURRENCY", "4"))
+
+# How a multi-category run is sent: "combined" (the document once, all categories in one request),
+# "per_category" (one parallel request per category) or "auto" (combined when it saves enough tokens)
+ANALYSIS_MODE = os.environ.get("REALM_ANALYSIS_MODE", "auto")
+# Prompt tokens "auto" must save before it gives up the parallelism of per-category calls
+COMBINED_MIN_SAVED_TOKENS = int(os.environ.get("REALM_COMBINED_MIN_SAVED_TOKENS", "4000"))
+
+# Per-document retrieval index used to ground chat answers
+DATA_DIR = os.environ.get("REALM_DATA_DIR", "data")
+INDEX_DIR = os.path.join(DATA_DIR, "indexes")
+EMBEDDING_MODEL = os.environ.get("REALM_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("REALM_EMBEDDING_BATCH_SIZE", "32"))
+RETRIEVAL_CHUNK_TOKENS = int(os.environ.get("REALM_RETRIEVAL_CHUNK_TOKENS", "200"))
+RETRIEVAL_OVERLAP_TOKENS = int(os.environ.get("REALM_RETRIEVAL_OVERLAP_TOKENS", "30"))
+RETRIEVAL_TOP_K = int(os.environ.get("REALM_RETRIEVAL_TOP_K", "5"))
+
+# Document text extraction
+TEXT_CACHE_DIR = os.path.join(DATA_DIR, "text_cache")
+# PDFs with at least this many pages are split across a process pool by page range
+PARALLEL_PDF_MIN_PAGES = int(os.environ.get("REALM_PARALLEL_PDF_MIN_PAGES", "64"))
+EXTRACTION_WORKERS = int(os.environ.get("REALM_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Pages slower than this are logged as a warning
+SLOW_PAGE_SECONDS = float(os.environ.get("REALM_SLOW_PAGE_SECONDS", "2"))
+
+# Upload store: files are kept once per SHA-256 under UPLOAD_DIR, with metadata in realm.db
+UPLOAD_DIR = os.environ.get("REALM_UPLOAD_DIR", "uploads")
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get("REALM_UPLOAD_MAX_FILE_BYTES", str(200 * 1024 * 1024)))
+# Least recently used files are evicted once all stored files together exceed this
+UPLOAD_MAX_TOTAL_BYTES = int(os.environ.get("REALM_UPLOAD_MAX_TOTAL_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Bytes read, hashed and written at a time
+UPLOAD_CHUNK_BYTES = int(os.environ.get("REALM_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+# Report library: sample reports and exported analyses offered on the Download Sample page
+REPORTS_DIR = os.environ.get("REALM_REPORTS_DIR", "contents")
+# Gzip copies of the reports, made when a report is first indexed
+REPORT_ARTIFACT_DIR = os.path.join(DATA_DIR, "reports")
+REPORT_GZIP_LEVEL = int(os.environ.get("REALM_REPORT_GZIP_LEVEL", "6"))
+# Smaller reports are not compressed; nor are reports gzip can't shrink below this fraction of their size
+REPORT_COMPRESS_MIN_BYTES = int(os.environ.get("REALM_REPORT_COMPRESS_MIN_BYTES", "4096"))
+REPORT_MIN_COMPRESSION = float(os.environ.get("REALM_REPORT_MIN_COMPRESSION", "0.9"))
+
+# Conversation history
+# Messages shown per page; older ones load on demand
+MESSAGE_PAGE_SIZE = int(os.environ.get("REALM_MESSAGE_PAGE_SIZE", "50"))
+
+# Chat memory: each chat prompt gets the stored summary plus the latest turns that fit CHAT_HISTORY_TOKENS.
+# Once the turns not yet summarised outgrow that budget, the oldest are folded into the summary
+# until the rest fit in half of it.
+CHAT_HISTORY_TOKENS = int(os.environ.get("REALM_CHAT_HISTORY_TOKENS", "3000"))
+# Reply cap for the summary, which bounds its size in every later prompt
+CHAT_SUMMARY_TOKENS = int(os.environ.get("REALM_CHAT_SUMMARY_TOKENS", "600"))
+# Most unsummarised messages read for one prompt or one summary update
+CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get("REALM_CHAT_HISTORY_MAX_MESSAGES", "200"))
+# Cap on the 5C analyses sent with each chat turn; longer analyses are shortened evenly
+CHAT_ANALYSIS_TOKENS = int(os.environ.get("REALM_CHAT_ANALYSIS_TOKENS", "6000"))
+
+# Archival of idle conversations: their messages are compressed into the archives table and
+# restored the first time the conversation is opened again
+ARCHIVE_IDLE_DAYS = float(os.environ.get("REALM_ARCHIVE_IDLE_DAYS", "90"))
+# "zstd" (needs the zstandard package), "zlib", or "auto" for zstd when it is installed
+ARCHIVE_CODEC = os.environ.get("REALM_ARCHIVE_CODEC", "auto")
+ARCHIVE_ZSTD_LEVEL = int(os.environ.get("REALM_ARCHIVE_ZSTD_LEVEL", "10"))
+ARCHIVE_ZLIB_LEVEL = int(os.environ.get("REALM_ARCHIVE_ZLIB_LEVEL", "9"))
+# Most conversations archived per run, so one run never holds the write lock for long
+ARCHIVE_BATCH_SIZE = int(os.environ.get("REALM_ARCHIVE_BATCH_SIZE", "100"))
+# Free pages returned to the file system after each run (0 = all); needs auto_vacuum=INCREMENTAL
+ARCHIVE_VACUUM_PAGES = int(os.environ.get("REALM_ARCHIVE_VACUUM_PAGES", "0"))
+
+# SQLite tuning for realm.db
+# Log every SQL statement (very noisy; for debugging only)
+SQL_ECHO = os.environ.get("REALM_SQL_ECHO", "0") == "1"
+# Milliseconds a connection waits on a locked database before failing
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("REALM_SQLITE_BUSY_TIMEOUT_MS", "10000"))
+
+# Background analysis jobs
+# Jobs run at the same time in this process
+JOB_WORKERS = int(os.environ.get("REALM_JOB_WORKERS", "2"))
+# Jobs one owner may have running at once, so one heavy user can't occupy every worker
+JOB_MAX_RUNNING_PER_OWNER = int(os.environ.get("REALM_JOB_MAX_RUNNING_PER_OWNER", "1"))
+# How often workers look for new jobs and the UI polls for progress (seconds)
+JOB_POLL_SECONDS = float(os.environ.get("REALM_JOB_POLL_SECONDS", "2"))
+# Running jobs without a heartbeat for this long are assumed orphaned and re-queued
+JOB_STALE_SECONDS = float(os.environ.get("REALM_JOB_STALE_SECONDS", "900"))
+
+# Monte Carlo stress testing
+STRESS_DRAWS = int(os.environ.get("REALM_STRESS_DRAWS", "100000"))
+# Draws generated per array operation; bounds memory at about draws x 20 sub-elements x 8 bytes per temporary
+STRESS_BATCH_DRAWS = int(os.environ.get("REALM_STRESS_BATCH_DRAWS", "25000"))
+# Standard deviation of each sub-element rating (0-5 scale) before any shock; doubled for unrated elements
+STRESS_RATING_VOLATILITY = float(os.environ.get("REALM_STRESS_RATING_VOLATILITY", "0.25"))
+# Correlation of scenario shocks through a common systemic factor (0 = independent, 1 = fully correlated)
+STRESS_CORRELATION = float(os.environ.get("REALM_STRESS_CORRELATION", "0.5"))
+# Composite score below which a draw counts as a failure
+STRESS_FAIL_SCORE = float(os.environ.get("REALM_STRESS_FAIL_SCORE", "50"))
+
+# Metrics
+# Serve Prometheus metrics from the app process at http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = os.environ.get("REALM_METRICS_ENABLED", "1") == "1"
+METRICS_HOST = os.environ.get("REALM_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("REALM_METRICS_PORT", "9464"))
+# Finished runs kept in memory for the sidebar breakdown
+METRICS_RECENT_RUNS = int(os.environ.get("REALM_METRICS_RECENT_RUNS", "50"))
@@ -1,15 +1,67 @@
-from sqlalchemy import create_engine
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
-from models import Base
+import config
+import metrics
+from models import Base, CategoryScore, Conversation, ConversationArchive, ConversationSummary, Job, Messages
+
+logger = logging.getLogger(__name__)
 
 # Define the database URL
 DATABASE_URL = "sqlite:///realm.db"
 
 # Create an engine
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(
+    DATABASE_URL,
+    echo=config.SQL_ECHO,
+    connect_args={"timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000},
+)
+
+# WAL lets readers run alongside a writer, and NORMAL sync is safe under WAL while avoiding
+# an fsync per commit; the busy timeout makes writers wait instead of raising "database is locked"
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+# Time every SQL statement for the metrics endpoint and the per-run breakdown
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    metrics.DB_QUERY_SECONDS.observe(seconds, statement=(statement.split(None, 1) or ["OTHER"])[0].upper())
+    metrics.observe_span("db_query", seconds)
 
-# Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Create a configured "Session" class. Objects stay usable after their session closes,
+# because the app keeps them in st.session_state across reruns.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Per-conversation write counters for this process. Readers use them as cache keys, so any
+# write (from the UI or a background job) invalidates cached reads of that conversation.
+_message_versions = {}
+_message_versions_lock = threading.Lock()
+
+# Function to get the current write counter of a conversation
+def get_message_version(conversation_id):
+    return _message_versions.get(conversation_id, 0)
+
+# Function to mark a conversation's messages as changed
+def bump_message_version(conversation_id):
+    with _message_versions_lock:
+        _message_versions[conversation_id] = _message_versions.get(conversation_id, 0) + 1
 
 # Create the database tables
 def init_db():
@@ -22,3 +74,236 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Context manager for a unit of work: commits on success, rolls back on error, always closes
+@contextmanager
+def session_scope():
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# Function to create a new conversation if none exists
+def create_initial_conversation():
+    with session_scope() as db:
+        if db.query(Conversation.id).first():
+            return None
+        new_conversation = Conversation(name="Initial Conversation")
+        db.add(new_conversation)
+        db.flush()
+        logger.info(f"Created initial conversation: {new_conversation.id}")
+        return new_conversation
+
+# Function to add a new conversation
+def add_conversation(name):
+    with session_scope() as db:
+        new_conversation = Conversation(name=name)
+        db.add(new_conversation)
+        db.flush()
+        logger.info(f"Added new conversation: {new_conversation.id}")
+        return new_conversation
+
+# Function to get all conversations
+def get_conversations():
+    with session_scope() as db:
+        conversations = db.query(Conversation).order_by(Conversation.id).all()
+    logger.info(f"Retrieved {len(conversations)} conversations")
+    return conversations
+
+# Function to build a Messages row from a (role, content[, category]) tuple or a dict of column values
+def _new_message(conversation_id, message):
+    if isinstance(message, (tuple, list)):
+        message = dict(zip(("role", "content", "category"), message))
+    return Messages(
+        conversation_id=conversation_id,
+        role=message["role"],
+        content=message["content"],
+        category=message.get("category"),
+        prompt_tokens=message.get("prompt_tokens"),
+        completion_tokens=message.get("completion_tokens"),
+        latency_ms=message.get("latency_ms"),
+    )
+
+# Function to add a new message
+def add_message(conversation_id, role, content, category=None, prompt_tokens=None, completion_tokens=None, latency_ms=None):
+    with session_scope() as db:
+        new_message = _new_message(conversation_id, {
+            "role": role,
+            "content": content,
+            "category": category,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_ms": latency_ms,
+        })
+        db.add(new_message)
+        db.flush()
+    bump_message_version(conversation_id)
+    logger.info(f"Added new message to conversation {conversation_id}")
+    return new_message
+
+# Function to add several messages in one transaction, e.g. a chat turn or a full 5C run.
+# Each message is a (role, content[, category]) tuple or a dict of column values.
+def add_messages(conversation_id, messages):
+    if not messages:
+        return []
+    with session_scope() as db:
+        new_messages = [_new_message(conversation_id, message) for message in messages]
+        db.add_all(new_messages)
+        db.flush()
+    bump_message_version(conversation_id)
+    logger.info(f"Added {len(new_messages)} messages to conversation {conversation_id}")
+    return new_messages
+
+# Function to restore an archived conversation's messages before they are read; one indexed lookup
+# when the conversation is not archived
+def _ensure_unarchived(conversation_id):
+    with session_scope() as db:
+        archived = db.query(ConversationArchive.id).filter(ConversationArchive.conversation_id == conversation_id).first()
+    if archived is None:
+        return
+    # archive.py builds on this module, so it is only imported when it is needed
+    import archive
+    try:
+        archive.rehydrate(conversation_id)
+    except IntegrityError:
+        # Another session restored it at the same moment
+        logger.info(f"Conversation {conversation_id} was already restored")
+
+# Function to count the messages in a conversation
+def count_messages(conversation_id):
+    _ensure_unarchived(conversation_id)
+    with session_scope() as db:
+        return db.query(func.count(Messages.id)).filter(Messages.conversation_id == conversation_id).scalar()
+
+# Function to turn a row into the message dict used by the app; rows not yet backfilled fall back to the legacy JSON
+def _message_dict(message_id, role, content, category, data):
+    if role is not None:
+        return {"id": message_id, "role": role, "content": content, "category": category}
+    try:
+        message_data = json.loads(data)
+    except (TypeError, json.JSONDecodeError):
+        logger.error(f"Error decoding JSON for message ID {message_id}: {data}")
+        return None
+    message_data["id"] = message_id
+    message_data.setdefault("category", None)
+    return message_data
+
+# Function to get messages for a specific conversation. With `limit`, returns only the latest
+# `limit` messages (older than `before_id` if given), still in chronological order
+def get_messages(conversation_id, limit=None, before_id=None):
+    _ensure_unarchived(conversation_id)
+    with session_scope() as db:
+        query = db.query(Messages.id, Messages.role, Messages.content, Messages.category, Messages.data)
+        query = query.filter(Messages.conversation_id == conversation_id)
+        if before_id is not None:
+            query = query.filter(Messages.id < before_id)
+        query = query.order_by(Messages.id.desc())
+        if limit:
+            query = query.limit(limit)
+        rows = query.all()
+
+    result = [message for message in (_message_dict(*row) for row in reversed(rows)) if message is not None]
+    logger.info(f"Retrieved {len(result)} messages for conversation {conversation_id}")
+    return result
+
+# Function to get the latest analyses of one 5C category across all conversations, using the category index
+def get_analyses(category, limit=None):
+    with session_scope() as db:
+        query = db.query(
+            Messages.id,
+            Messages.conversation_id,
+            Messages.content,
+            Messages.created_at,
+            Messages.prompt_tokens,
+            Messages.completion_tokens,
+            Messages.latency_ms,
+        ).filter(Messages.category == category, Messages.role == "assistant")
+        query = query.order_by(Messages.id.desc())
+        if limit:
+            query = query.limit(limit)
+        return [row._asdict() for row in query.all()]
+
+# Function to get the most recent analysis of each 5C category in a conversation, as {category: content}
+def get_latest_analyses(conversation_id):
+    _ensure_unarchived(conversation_id)
+    with session_scope() as db:
+        rows = (
+            db.query(Messages.category, Messages.content)
+            .filter(Messages.conversation_id == conversation_id, Messages.category.isnot(None))
+            .order_by(Messages.id)
+            .all()
+        )
+    # Later rows overwrite earlier ones, so re-analyses win
+    return {category: content for category, content in rows}
+
+# Function to get the latest chat turns of a conversation (not 5C analyses) newer than after_id, oldest first.
+# With oldest_first, the limit keeps the earliest turns after after_id instead of the latest.
+def get_chat_turns(conversation_id, after_id=None, limit=None, oldest_first=False):
+    _ensure_unarchived(conversation_id)
+    with session_scope() as db:
+        query = db.query(Messages.id, Messages.role, Messages.content).filter(
+            Messages.conversation_id == conversation_id,
+            Messages.category.is_(None),
+            Messages.role.in_(("user", "assistant")),
+        )
+        if after_id is not None:
+            query = query.filter(Messages.id > after_id)
+        query = query.order_by(Messages.id if oldest_first else Messages.id.desc())
+        if limit:
+            query = query.limit(limit)
+        rows = query.all()
+    if not oldest_first:
+        rows.reverse()
+    return [row._asdict() for row in rows]
+
+# Function to get the stored summary of a conversation's older chat turns, or None
+def get_summary(conversation_id):
+    with session_scope() as db:
+        summary = db.query(ConversationSummary).filter(ConversationSummary.conversation_id == conversation_id).first()
+        if summary is None:
+            return None
+        return {
+            "content": summary.content,
+            "through_message_id": summary.through_message_id,
+            "message_count": summary.message_count,
+            "updated_at": summary.updated_at,
+        }
+
+# Function to create or replace the summary of a conversation
+def save_summary(conversation_id, content, through_message_id, message_count, model=None):
+    with session_scope() as db:
+        summary = db.query(ConversationSummary).filter(ConversationSummary.conversation_id == conversation_id).first()
+        if summary is None:
+            summary = ConversationSummary(conversation_id=conversation_id)
+            db.add(summary)
+        summary.content = content
+        summary.through_message_id = through_message_id
+        summary.message_count = message_count
+        summary.model = model
+        summary.updated_at = datetime.utcnow()
+    logger.info(f"Saved the summary of conversation {conversation_id} through message {through_message_id}")
+
+# Function to delete a conversation
+def delete_conversation(conversation_id):
+    with session_scope() as db:
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        if conversation:
+            db.query(CategoryScore).filter(CategoryScore.conversation_id == conversation_id).delete()
+            db.query(ConversationSummary).filter(ConversationSummary.conversation_id == conversation_id).delete()
+            db.query(ConversationArchive).filter(ConversationArchive.conversation_id == conversation_id).delete()
+            db.query(Messages).filter(Messages.conversation_id == conversation_id).delete()
+            db.query(Job).filter(Job.conversation_id == conversation_id).delete()
+            db.delete(conversation)
+        else:
+            conversation = None
+    if conversation:
+        bump_message_version(conversation_id)
+        logger.info(f"Deleted conversation: {conversation_id}")
+        return True
+    logger.warning(f"Conversation not found: {conversation_id}")
+    return False
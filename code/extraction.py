@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Read size used when hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# Function to hash a file's bytes without reading it into memory at once
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# PyPDF2 and python-docx are imported on first use, so pages and tools that never parse a
+# document (or only hit the text cache) don't pay for loading them
+
+# Function to stream (page_number, text, seconds) for a range of PDF pages
+def iter_pdf_pages(file_path, start=0, stop=None):
+    import PyPDF2
+
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        stop = len(pdf_reader.pages) if stop is None else min(stop, len(pdf_reader.pages))
+        for number in range(start, stop):
+            started = time.perf_counter()
+            text = pdf_reader.pages[number].extract_text() or ""
+            yield number + 1, text, time.perf_counter() - started
+
+
+# Function run in a worker process to extract one page range
+def _extract_pdf_range(file_path, start, stop):
+    return list(iter_pdf_pages(file_path, start, stop))
+
+
+# Function to count the pages of a PDF
+def count_pdf_pages(file_path):
+    import PyPDF2
+
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+# Function to stream PDF pages, fanning large files out across a process pool by page range
+def iter_pdf(file_path, workers=None):
+    workers = workers or config.EXTRACTION_WORKERS
+    page_count = count_pdf_pages(file_path)
+    if workers <= 1 or page_count < config.PARALLEL_PDF_MIN_PAGES:
+        yield from iter_pdf_pages(file_path)
+        return
+
+    step = -(-page_count // workers)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    starts, stops = zip(*ranges)
+    # Spawned, not forked: this runs on job threads of a multithreaded process, and a forked child could
+    # inherit a lock (logging, the connection pool) held by another thread and deadlock
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=multiprocessing.get_context("spawn")) as executor:
+        # map() keeps page order while the ranges are extracted in parallel
+        for pages in executor.map(_extract_pdf_range, [file_path] * len(ranges), starts, stops):
+            yield from pages
+
+
+# Function to stream the text pieces of any supported document, with per-page timings for PDFs
+def iter_document(file_path):
+    _, file_extension = os.path.splitext(file_path)
+    if file_extension.lower() == '.pdf':
+        yield from iter_pdf(file_path)
+    elif file_extension.lower() in ['.docx', '.doc']:
+        import docx
+
+        doc = docx.Document(file_path)
+        for number, para in enumerate(doc.paragraphs, start=1):
+            yield number, para.text + "\n", 0.0
+    else:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            yield 1, file.read(), 0.0
+
+
+def _cache_path(file_hash):
+    return os.path.join(config.TEXT_CACHE_DIR, f"{file_hash}.txt")
+
+
+# Function to extract a document's text, returning (text, report); repeated files are served from the text cache.
+# Pass file_hash when the SHA-256 is already known (e.g. from the upload store) to skip re-reading the file.
+def extract_document(file_path, file_hash=None):
+    started = time.perf_counter()
+    file_hash = file_hash or hash_file(file_path)
+    cache_path = _cache_path(file_hash)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        report = {"file_hash": file_hash, "cached": True, "pages": 0, "seconds": time.perf_counter() - started, "slow_pages": []}
+        metrics.observe_span("extraction", report["seconds"])
+        logger.info(f"Loaded cached text for {file_path} ({file_hash[:12]})")
+        return content, report
+
+    pieces = []
+    timings = []
+    for number, text, seconds in iter_document(file_path):
+        pieces.append(text)
+        timings.append((number, seconds))
+        if seconds > config.SLOW_PAGE_SECONDS:
+            logger.warning(f"Page {number} of {file_path} took {seconds:.2f}s to extract")
+    # Join once instead of growing a string page by page
+    content = "".join(pieces)
+
+    os.makedirs(config.TEXT_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, cache_path)
+
+    slowest = sorted(timings, key=lambda timing: timing[1], reverse=True)[:5]
+    report = {
+        "file_hash": file_hash,
+        "cached": False,
+        "pages": len(timings),
+        "seconds": time.perf_counter() - started,
+        "slow_pages": [timing for timing in slowest if timing[1] > config.SLOW_PAGE_SECONDS],
+        "page_seconds": timings,
+    }
+    metrics.observe_span("extraction", report["seconds"])
+    logger.info(f"Extracted {len(timings)} pages from {file_path} in {report['seconds']:.2f}s")
+    return content, report
+
+
+# Function to read and process the uploaded document
+def process_document(file_path):
+    try:
+        content, _ = extract_document(file_path)
+        logger.info(f"Processed document: {file_path}")
+        return content
+    except Exception as e:
+        logger.error(f"Error processing document {file_path}: {str(e)}")
+        return f"Error processing document: {str(e)}"
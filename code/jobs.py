@@ -0,0 +1,353 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+import analysis
+import config
+import database
+import metrics
+import retrieval
+import revisions
+import scheduler
+import scoring
+import uploads
+from database import session_scope
+from extraction import extract_document
+from llm_client import get_client
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+# Function to turn a job row into a plain dict the UI can keep across reruns
+def _job_dict(job):
+    return {
+        "id": job.id,
+        "conversation_id": job.conversation_id,
+        "owner": job.owner,
+        "status": job.status,
+        "file_path": job.file_path,
+        "categories": json.loads(job.categories),
+        "completed": json.loads(job.completed),
+        "errors": json.loads(job.errors),
+        "mode": job.mode,
+        "document_id": job.document_id,
+        "incremental": job.incremental is not False,
+        "revision": json.loads(job.revision) if job.revision else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+# Function to queue a 5C analysis of an uploaded file; returns the job id
+def enqueue_analysis(conversation_id, owner, file_path, categories, mode=None, incremental=True):
+    with session_scope() as db:
+        job = Job(
+            conversation_id=conversation_id,
+            owner=owner,
+            kind="analysis",
+            status=QUEUED,
+            file_path=file_path,
+            categories=json.dumps(list(categories)),
+            completed="[]",
+            errors="{}",
+            mode=mode,
+            incremental=incremental,
+        )
+        db.add(job)
+        db.flush()
+        logger.info(f"Queued analysis job {job.id} for conversation {conversation_id}")
+        return job.id
+
+
+# Function to get one job, or None if it no longer exists
+def get_job(job_id):
+    with session_scope() as db:
+        job = db.get(Job, job_id)
+        return _job_dict(job) if job else None
+
+
+# Function to get the queued and running jobs of a conversation
+def get_active_jobs(conversation_id):
+    with session_scope() as db:
+        jobs = (
+            db.query(Job)
+            .filter(Job.conversation_id == conversation_id, Job.status.in_(ACTIVE_STATUSES))
+            .order_by(Job.id)
+            .all()
+        )
+        return [_job_dict(job) for job in jobs]
+
+
+# Function to get the most recent job of a conversation
+def get_latest_job(conversation_id):
+    with session_scope() as db:
+        job = db.query(Job).filter(Job.conversation_id == conversation_id).order_by(Job.id.desc()).first()
+        return _job_dict(job) if job else None
+
+
+# Function to find the latest finished job of a conversation before job_id that recorded its sections;
+# returns {"id", "completed", "sections"} or None
+def _previous_version(conversation_id, job_id):
+    with session_scope() as db:
+        job = (
+            db.query(Job)
+            .filter(Job.conversation_id == conversation_id, Job.id < job_id, Job.status == DONE, Job.sections.isnot(None))
+            .order_by(Job.id.desc())
+            .first()
+        )
+        if job is None:
+            return None
+        return {"id": job.id, "completed": json.loads(job.completed), "sections": json.loads(job.sections)}
+
+
+# Function to count the queued jobs ahead of a job
+def queue_position(job_id):
+    with session_scope() as db:
+        return db.query(func.count(Job.id)).filter(Job.status == QUEUED, Job.id < job_id).scalar()
+
+
+# Function to update a job's columns; returns False if the job was deleted meanwhile
+def _update_job(job_id, **values):
+    with session_scope() as db:
+        result = db.execute(update(Job).where(Job.id == job_id).values(**values))
+        return result.rowcount > 0
+
+
+class JobRunner:
+    """Runs queued jobs on a bounded worker pool, outside the Streamlit script thread.
+
+    Jobs are claimed fairly: the next job always comes from the owner with the fewest
+    running jobs, so one underwriter queueing many large documents can't starve the others.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or config.JOB_WORKERS
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="realm-job")
+        self.running = {}
+        # Streamed text of categories still in progress, keyed by job id then category
+        self.partials = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.requeue_stale()
+        self.thread = threading.Thread(target=self._dispatch_loop, name="realm-job-dispatcher", daemon=True)
+        self.thread.start()
+        logger.info(f"Started job runner with {self.workers} workers")
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        self.executor.shutdown(wait=False)
+
+    # Function to wake the dispatcher after a job is queued
+    def notify(self):
+        self.wakeup.set()
+
+    # Function to get the streamed text of the categories a job is still working on
+    def partial_results(self, job_id):
+        with self.lock:
+            return dict(self.partials.get(job_id, {}))
+
+    # Function to put jobs orphaned by a crashed process back in the queue; finished categories are kept
+    def requeue_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=config.JOB_STALE_SECONDS)
+        with session_scope() as db:
+            result = db.execute(
+                update(Job)
+                .where(Job.status == RUNNING, func.coalesce(Job.heartbeat_at, Job.started_at) < cutoff)
+                .values(status=QUEUED)
+            )
+        if result.rowcount:
+            logger.warning(f"Re-queued {result.rowcount} stale jobs")
+
+    def _dispatch_loop(self):
+        while not self.stopped.is_set():
+            try:
+                self._heartbeat()
+                while len(self.running) < self.workers:
+                    job_id = self._claim_next()
+                    if job_id is None:
+                        break
+                    with self.lock:
+                        self.running[job_id] = self.executor.submit(self._run, job_id)
+            except Exception as e:
+                logger.error(f"Job dispatcher error: {str(e)}")
+            self.wakeup.wait(config.JOB_POLL_SECONDS)
+            self.wakeup.clear()
+
+    def _heartbeat(self):
+        with self.lock:
+            job_ids = list(self.running)
+        if job_ids:
+            with session_scope() as db:
+                db.execute(update(Job).where(Job.id.in_(job_ids)).values(heartbeat_at=datetime.utcnow()))
+
+    # Function to atomically claim the fairest next job; returns its id or None
+    def _claim_next(self):
+        with session_scope() as db:
+            running = dict(
+                db.query(Job.owner, func.count(Job.id)).filter(Job.status == RUNNING).group_by(Job.owner).all()
+            )
+            oldest_per_owner = (
+                db.query(Job.owner, func.min(Job.id))
+                .filter(Job.status == QUEUED)
+                .group_by(Job.owner)
+                .all()
+            )
+            candidates = sorted(
+                (running.get(owner, 0), job_id)
+                for owner, job_id in oldest_per_owner
+                if running.get(owner, 0) < config.JOB_MAX_RUNNING_PER_OWNER
+            )
+            for _, job_id in candidates:
+                now = datetime.utcnow()
+                # The status check makes the claim safe against other processes claiming the same job
+                claimed = db.execute(
+                    update(Job)
+                    .where(Job.id == job_id, Job.status == QUEUED)
+                    .values(status=RUNNING, started_at=now, heartbeat_at=now)
+                )
+                if claimed.rowcount:
+                    return job_id
+        return None
+
+    def _run(self, job_id):
+        try:
+            self._run_analysis(job_id)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            _update_job(job_id, status=FAILED, error=str(e), finished_at=datetime.utcnow())
+        finally:
+            with self.lock:
+                self.running.pop(job_id, None)
+                self.partials.pop(job_id, None)
+            self.wakeup.set()
+
+    def _run_analysis(self, job_id):
+        job = get_job(job_id)
+        if job is None:
+            return
+        # Everything the job does, including its worker threads, is timed into one per-run breakdown;
+        # its LLM calls queue behind chat replies and share the API fairly with other owners' jobs
+        with metrics.run("analysis", f"Job {job_id}", conversation_id=job["conversation_id"]), \
+                scheduler.caller(job["owner"], scheduler.BULK):
+            self._analyze(job)
+
+    def _analyze(self, job):
+        job_id = job["id"]
+        # Files from the upload store are already hashed, and keep the name they were uploaded under
+        upload = uploads.find_upload(job["file_path"])
+        content, report = extract_document(job["file_path"], file_hash=upload["sha256"] if upload else None)
+        document_id = report["file_hash"]
+        try:
+            with metrics.span("indexing"):
+                retrieval.build_index(document_id, content)
+        except Exception as e:
+            # Chat still works without retrieval, so indexing problems don't fail the job
+            logger.error(f"Error indexing document for job {job_id}: {str(e)}")
+            document_id = None
+        with metrics.span("section_diff"):
+            sections = revisions.split_sections(content)
+        _update_job(job_id, document_id=document_id, sections=json.dumps(sections))
+        source = upload["original_name"] if upload else os.path.basename(job["file_path"])
+
+        # A re-queued job only redoes the categories it had not finished
+        completed = list(job["completed"])
+        errors = dict(job["errors"])
+        remaining = [category for category in job["categories"] if category not in completed]
+
+        # A revised version only re-runs the categories whose sections changed since the previous one
+        revision = job["revision"]
+        previous = _previous_version(job["conversation_id"], job_id) if job["incremental"] and revision is None else None
+        if previous is not None:
+            revision = revisions.plan_revision(previous, sections, remaining, set(previous["completed"]))
+            before = scoring.latest_scores(job["conversation_id"])
+            for category in revision["reused"]:
+                score = before.get(category)
+                if score is not None:
+                    # The earlier analysis message still holds the prose; the score now also covers this version
+                    scoring.save_score(
+                        score,
+                        conversation_id=job["conversation_id"],
+                        message_id=score["message_id"],
+                        document_id=document_id or report["file_hash"],
+                        source=source,
+                        model=score["model"],
+                    )
+                completed.append(category)
+            revision["score_changes"] = {
+                category: {"before": before[category]["score"] if category in before else None, "after": None}
+                for category in revision["rerun"]
+            }
+            remaining = revision["rerun"]
+            _update_job(job_id, completed=json.dumps(completed), revision=json.dumps(revision))
+            logger.info(
+                f"Job {job_id} is a revision of job {previous['id']}: re-running {', '.join(remaining) or 'nothing'}, "
+                f"reusing {', '.join(revision['reused']) or 'nothing'}"
+            )
+
+        def on_delta(category, text):
+            with self.lock:
+                self.partials.setdefault(job_id, {})[category] = text
+
+        stats = {}
+        for category, result, error in analysis.map_to_5c(content, remaining, on_delta=on_delta, stats=stats, mode=job["mode"]):
+            with self.lock:
+                self.partials.get(job_id, {}).pop(category, None)
+            if not _update_job(job_id, heartbeat_at=datetime.utcnow()):
+                logger.info(f"Job {job_id} was deleted; stopping")
+                return
+            if error is not None:
+                errors[category] = str(error)
+            else:
+                # The JSON block goes to the scores table; the conversation keeps the readable analysis
+                prose, _ = scoring.split_structured(result)
+                message = database.add_message(
+                    job["conversation_id"],
+                    "assistant",
+                    f"Here's the {category} analysis:\n\n{prose}",
+                    category=category,
+                    **stats.get(category, {}),
+                )
+                score = scoring.parse_result(category, result)
+                if score is None:
+                    logger.warning(f"No score found in the {category} analysis of job {job_id}")
+                else:
+                    scoring.save_score(
+                        score,
+                        conversation_id=job["conversation_id"],
+                        message_id=message.id,
+                        document_id=document_id or report["file_hash"],
+                        source=source,
+                        model=get_client().model,
+                    )
+                    if revision is not None and category in revision["score_changes"]:
+                        revision["score_changes"][category]["after"] = score["score"]
+                completed.append(category)
+                errors.pop(category, None)
+            values = {"completed": json.dumps(completed), "errors": json.dumps(errors)}
+            if revision is not None:
+                values["revision"] = json.dumps(revision)
+            _update_job(job_id, **values)
+
+        status = DONE if completed else FAILED
+        error = None if completed else "; ".join(f"{category}: {message}" for category, message in errors.items())
+        _update_job(job_id, status=status, error=error, finished_at=datetime.utcnow())
+        logger.info(f"Job {job_id} finished: {len(completed)} categories done, {len(errors)} failed")
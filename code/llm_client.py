@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+import scheduler
+from chunking import CHARS_PER_TOKEN, count_tokens
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes worth retrying: rate limits and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when the LLM API could not produce a completion."""
+
+
+class LLMBusyError(LLMError):
+    """Raised when the scheduler turns a call away because the API is too busy; worth retrying later."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1, timeout=None):
+        """Blocks until `tokens` are available. Returns False if `timeout` expires first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait_for = (tokens - self.tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait_for = min(wait_for, remaining)
+            time.sleep(wait_for)
+
+
+# Function to get the endpoint, model and API key variable of an LLM backend; all of them
+# speak the OpenAI chat-completions protocol, so one client serves every backend
+def backend_settings(name=None):
+    name = name or config.LLM_BACKEND
+    backends = {
+        "perplexity": {"api_url": config.PPLX_API_URL, "model": config.PPLX_MODEL, "key_env": "PPLX_KEY"},
+        "openai": {"api_url": config.OPENAI_API_URL, "model": config.OPENAI_MODEL, "key_env": "OPENAI_API_KEY"},
+        "mock": {"api_url": config.MOCK_LLM_URL, "model": "mock", "key_env": None},
+    }
+    if name not in backends:
+        raise LLMError(f"Unknown LLM backend '{name}'; expected one of {', '.join(backends)}")
+    settings = dict(backends[name], name=name)
+    settings["api_url"] = config.LLM_API_URL or settings["api_url"]
+    settings["model"] = config.LLM_MODEL or settings["model"]
+    return settings
+
+
+class LLMClient:
+    """Chat-completions client with a pooled keep-alive session, timeouts and retries."""
+
+    def __init__(self, api_url=None, model=None, api_key=None, rate_limiter=None, key_env="PPLX_KEY"):
+        self.api_url = api_url or config.PPLX_API_URL
+        self.model = model or config.PPLX_MODEL
+        self.api_key = api_key
+        # Environment variable holding the API key; None for backends that need no key
+        self.key_env = key_env
+        self.rate_limiter = rate_limiter
+        self.timeout = (config.LLM_CONNECT_TIMEOUT, config.LLM_READ_TIMEOUT)
+
+        self.session = requests.Session()
+        # Retries are handled in _post so that they share the backoff and rate limiter
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.LLM_POOL_SIZE, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.key_env is None and not self.api_key:
+            return headers
+        api_key = self.api_key or os.environ.get(self.key_env)
+        if not api_key:
+            raise LLMError(f"{self.key_env} environment variable not found. Please set it before making API calls.")
+        headers["Authorization"] = f"Bearer {api_key}"
+        return headers
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(config.LLM_BACKOFF_MAX, config.LLM_BACKOFF_BASE * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def _post(self, payload, stream=False):
+        headers = self._headers()
+        last_error = None
+        for attempt in range(config.LLM_MAX_RETRIES + 1):
+            if self.rate_limiter and not self.rate_limiter.acquire(timeout=config.LLM_RATE_LIMIT_MAX_WAIT):
+                raise LLMError("Timed out waiting for the client-side rate limiter")
+
+            retry_after = None
+            try:
+                response = self.session.post(self.api_url, headers=headers, json=payload, timeout=self.timeout, stream=stream)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+                last_error = requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            except requests.RequestException as e:
+                raise LLMError(f"Error calling LLM API: {str(e)}") from e
+
+            if attempt < config.LLM_MAX_RETRIES:
+                metrics.LLM_RETRIES.inc(reason=getattr(getattr(last_error, "response", None), "status_code", None) or type(last_error).__name__)
+                metrics.record("llm_retries")
+                delay = self._backoff(attempt, retry_after)
+                logger.warning(f"LLM API attempt {attempt + 1} failed ({last_error}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        raise LLMError(f"Error calling LLM API after {config.LLM_MAX_RETRIES + 1} attempts: {str(last_error)}")
+
+    # Function to wait for a scheduler slot for a call; returns the ticket to release afterwards
+    def _acquire_slot(self, prompt, max_tokens):
+        # A length estimate is enough here; the real count is settled when the call finishes
+        tokens = len(prompt) // CHARS_PER_TOKEN + (max_tokens or config.LLM_EXPECTED_COMPLETION_TOKENS)
+        try:
+            return scheduler.get_scheduler().acquire(tokens)
+        except scheduler.Busy as e:
+            raise LLMBusyError(str(e)) from e
+
+    # Function to get a single completion for a prompt
+    def complete(self, prompt, max_tokens=None):
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        ticket = self._acquire_slot(prompt, max_tokens)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = self._post(payload)
+            try:
+                body = response.json()
+                content = body["choices"][0]["message"]["content"]
+            except (ValueError, KeyError, IndexError) as e:
+                raise LLMError(f"Unexpected response from LLM API: {str(e)}") from e
+            outcome = "ok"
+            ticket.used_tokens = self._record_tokens(prompt, content, body.get("usage"))
+            return content
+        finally:
+            scheduler.get_scheduler().release(ticket)
+            self._record_request(started, False, outcome)
+
+    # Function to record a call's token counts; returns the total
+    def _record_tokens(self, prompt, completion, usage=None):
+        # The API's own counts when it reports them, otherwise our tokenizer's
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens") or count_tokens(prompt)
+        completion_tokens = usage.get("completion_tokens") or count_tokens(completion)
+        metrics.LLM_TOKENS.inc(prompt_tokens, model=self.model, direction="prompt")
+        metrics.LLM_TOKENS.inc(completion_tokens, model=self.model, direction="completion")
+        metrics.record("prompt_tokens", prompt_tokens)
+        metrics.record("completion_tokens", completion_tokens)
+        return prompt_tokens + completion_tokens
+
+    def _record_request(self, started, stream, outcome):
+        seconds = time.perf_counter() - started
+        metrics.LLM_REQUEST_SECONDS.observe(seconds, model=self.model, stream=str(stream).lower(), outcome=outcome)
+        metrics.observe_span("llm_request", seconds)
+        metrics.record("llm_calls")
+
+    # Function to stream a completion as text deltas using the API's SSE mode
+    def stream(self, prompt, max_tokens=None):
+        """Generator yielding content deltas as they arrive.
+
+        Retries only apply until the response starts; an error part-way through
+        the stream raises LLMError.
+        """
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True
+        }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        # The slot is taken when the consumer starts reading and held until the stream ends
+        ticket = self._acquire_slot(prompt, max_tokens)
+        started = time.perf_counter()
+        outcome = "error"
+        parts = []
+        usage = None
+        try:
+            response = self._post(payload, stream=True)
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    choices = chunk.get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        if not parts:
+                            ttft = time.perf_counter() - started
+                            metrics.LLM_TTFT_SECONDS.observe(ttft, model=self.model)
+                            metrics.record_min("time_to_first_token", ttft)
+                        parts.append(delta)
+                        yield delta
+                    if choices[0].get("finish_reason"):
+                        break
+            except (requests.RequestException, ValueError) as e:
+                raise LLMError(f"LLM API stream interrupted: {str(e)}") from e
+            finally:
+                response.close()
+            outcome = "ok"
+            ticket.used_tokens = self._record_tokens(prompt, "".join(parts), usage)
+        except GeneratorExit:
+            # The consumer stopped reading, e.g. a timed-out category
+            outcome = "cancelled"
+            raise
+        finally:
+            scheduler.get_scheduler().release(ticket)
+            self._record_request(started, True, outcome)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# Function to get the process-wide client, so every Streamlit session shares one pool and rate limit
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            rate_limiter = None
+            if config.LLM_REQUESTS_PER_MINUTE > 0:
+                rate_limiter = TokenBucket(config.LLM_REQUESTS_PER_MINUTE / 60.0, config.LLM_RATE_LIMIT_BURST)
+            settings = backend_settings()
+            _client = LLMClient(settings["api_url"], settings["model"], rate_limiter=rate_limiter, key_env=settings["key_env"])
+            logger.info(f"Using the {settings['name']} LLM backend ({settings['model']} at {settings['api_url']})")
+        return _client
+
+
+# Function to drop the process-wide client so the next call picks up changed backend settings (used by benchmarks)
+def reset_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
+
+
+# Function to call the configured LLM backend (Perplexity by default); raises LLMError instead of returning an error string.
+# With stream=True it returns a generator of text deltas instead of the full reply.
+def call_perplexity_api(prompt, stream=False, max_tokens=None):
+    if stream:
+        return get_client().stream(prompt, max_tokens)
+    return get_client().complete(prompt, max_tokens)
@@ -0,0 +1,144 @@
+"""Bounded conversation memory for chat turns.
+
+A chat prompt gets the conversation's stored summary plus the latest turns that fit
+config.CHAT_HISTORY_TOKENS, and the 5C analyses cut to config.CHAT_ANALYSIS_TOKENS. Once the
+turns not yet in the summary outgrow their budget, the oldest are folded into the summary on a
+background thread, so neither the prompt nor the time to build it grows with the conversation.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import database
+import metrics
+import scheduler
+from chunking import count_tokens, truncate_tokens
+from llm_client import LLMError, call_perplexity_api, get_client
+from prompts import build_summary_prompt
+
+logger = logging.getLogger(__name__)
+
+# One worker: summaries are rare and must not compete with chat replies for the API
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="realm-memory")
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+# Function to cut each category's analysis to an even share of the budget; short analyses leave
+# their unused share to the longer ones
+def compact_analyses(analyses, budget=None):
+    budget = config.CHAT_ANALYSIS_TOKENS if budget is None else budget
+    tokens = {category: count_tokens(text) for category, text in analyses.items()}
+    if sum(tokens.values()) <= budget:
+        return dict(analyses)
+    compacted = {}
+    remaining = budget
+    # Shortest first, so each later category gets what the earlier ones did not need
+    ordered = sorted(analyses, key=lambda category: tokens[category])
+    for i, category in enumerate(ordered):
+        share = remaining // (len(ordered) - i)
+        compacted[category] = truncate_tokens(analyses[category], share)
+        remaining -= min(tokens[category], share)
+    return {category: compacted[category] for category in analyses}
+
+
+# Function to take the newest turns that fit the budget; returns (turns, tokens), oldest first.
+# A newest turn larger than the whole budget is kept cut to the budget, so the history stays bounded.
+def _latest_within(turns, budget):
+    kept = []
+    used = 0
+    for turn in reversed(turns):
+        tokens = count_tokens(turn["content"])
+        if kept and used + tokens > budget:
+            break
+        if tokens > budget:
+            turn = {**turn, "content": truncate_tokens(turn["content"], budget)}
+            tokens = count_tokens(turn["content"])
+        kept.append(turn)
+        used += tokens
+    kept.reverse()
+    return kept, used
+
+
+# Function to get what a chat prompt should remember of a conversation: {"summary", "history", "tokens"}
+def build_context(conversation_id):
+    summary = database.get_summary(conversation_id)
+    after_id = summary["through_message_id"] if summary else None
+    turns = database.get_chat_turns(conversation_id, after_id, config.CHAT_HISTORY_MAX_MESSAGES)
+    history, tokens = _latest_within(turns, config.CHAT_HISTORY_TOKENS)
+    content = summary["content"] if summary else None
+    return {"summary": content, "history": history, "tokens": tokens + (count_tokens(content) if content else 0)}
+
+
+# Function to fold turns into a summary, in batches of at most one history budget so each summary
+# prompt stays bounded too. Saves the summary after every batch; returns (content, message_count).
+def _fold(conversation_id, turns, content, count):
+    batch, batch_tokens = [], 0
+    for i, turn in enumerate(turns):
+        batch.append(turn)
+        batch_tokens += count_tokens(turn["content"])
+        if batch_tokens < config.CHAT_HISTORY_TOKENS and i < len(turns) - 1:
+            continue
+        with metrics.span("summarize"):
+            content = call_perplexity_api(build_summary_prompt(content, batch), max_tokens=config.CHAT_SUMMARY_TOKENS)
+        count += len(batch)
+        database.save_summary(conversation_id, content, batch[-1]["id"], count, get_client().model)
+        batch, batch_tokens = [], 0
+    return content, count
+
+
+# Function to fold the oldest unsummarised turns into the summary, if they outgrew the history budget.
+# Returns True if the summary was updated.
+def update_summary(conversation_id):
+    summary = database.get_summary(conversation_id)
+    after_id = summary["through_message_id"] if summary else None
+    content = summary["content"] if summary else None
+    count = summary["message_count"] if summary else 0
+    limit = config.CHAT_HISTORY_MAX_MESSAGES
+    folded = 0
+    while True:
+        # Oldest pending turns first: a backlog longer than the limit is folded page by page, in order
+        turns = database.get_chat_turns(conversation_id, after_id, limit, oldest_first=True)
+        if not limit or len(turns) < limit:
+            if sum(count_tokens(turn["content"]) for turn in turns) <= config.CHAT_HISTORY_TOKENS:
+                break
+            # Keep half the budget verbatim, so the next update is several turns away
+            kept, _ = _latest_within(turns, config.CHAT_HISTORY_TOKENS // 2)
+            turns = turns[:len(turns) - len(kept)]
+            if not turns:
+                # Only the newest turn is left, and it alone is over budget; it stays in the history, cut
+                break
+        # A full page has newer turns after it, so all of it is folded
+        with metrics.run("summary", f"Summary of conversation {conversation_id}", conversation_id=conversation_id):
+            content, count = _fold(conversation_id, turns, content, count)
+        after_id = turns[-1]["id"]
+        folded += len(turns)
+    if folded:
+        logger.info(f"Folded {folded} messages into the summary of conversation {conversation_id}")
+    return folded > 0
+
+
+def _update_in_background(conversation_id):
+    try:
+        # Summaries can wait for chat replies, but go ahead of bulk 5C runs
+        with scheduler.caller(f"summary-{conversation_id}", scheduler.BACKGROUND):
+            update_summary(conversation_id)
+    except LLMError as e:
+        # The turns stay unsummarised and are retried after the next reply
+        logger.error(f"Could not summarise conversation {conversation_id}: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error summarising conversation {conversation_id}: {str(e)}")
+    finally:
+        with _pending_lock:
+            _pending.discard(conversation_id)
+
+
+# Function to check and update a conversation's summary off the calling thread; at most one update
+# per conversation is queued at a time
+def schedule_summary(conversation_id):
+    with _pending_lock:
+        if conversation_id in _pending:
+            return
+        _pending.add(conversation_id)
+    _executor.submit(_update_in_background, conversation_id)
@@ -0,0 +1,308 @@
+"""Timing spans, per-run breakdowns and Prometheus metrics.
+
+Code wraps its stages in `span(name)`. Each span is observed in a process-wide histogram and, if a
+`run(...)` is active in the calling context, added to that run's breakdown. Runs follow the code
+into worker threads started by analysis.run_concurrently, so one job's breakdown covers every
+category analysed for it. `start_http_server` exports the registry in the Prometheus text format.
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names, key, extra=None):
+    pairs = list(zip(label_names, key)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value that goes up and down, with optional labels."""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        with self.lock:
+            state = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, state in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', repr(float(bound)))])} {count}")
+                count = state[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {state[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, *args, **kwargs):
+        metric = Gauge(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+SPAN_SECONDS = REGISTRY.histogram("realm_span_seconds", "Time spent in each instrumented stage.", ["span"])
+RUNS = REGISTRY.counter("realm_runs_total", "Finished runs (analysis jobs, chat turns, batch documents).", ["kind", "outcome"])
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "realm_llm_request_seconds", "LLM API request latency, including retries and streaming.", ["model", "stream", "outcome"]
+)
+LLM_TTFT_SECONDS = REGISTRY.histogram("realm_llm_time_to_first_token_seconds", "Time until the first streamed token.", ["model"])
+LLM_TOKENS = REGISTRY.counter("realm_llm_tokens_total", "Tokens sent to and received from the LLM API.", ["model", "direction"])
+LLM_RETRIES = REGISTRY.counter("realm_llm_retries_total", "Retried LLM API attempts.", ["reason"])
+LLM_IN_FLIGHT = REGISTRY.gauge("realm_llm_in_flight", "LLM API calls holding a scheduler slot.")
+LLM_QUEUED = REGISTRY.gauge("realm_llm_queued", "LLM API calls waiting for a scheduler slot.", ["priority"])
+LLM_QUEUE_SECONDS = REGISTRY.histogram("realm_llm_queue_seconds", "Time LLM API calls waited for a scheduler slot.", ["priority"])
+LLM_REJECTED = REGISTRY.counter("realm_llm_rejected_total", "LLM API calls the scheduler turned away.", ["priority", "reason"])
+DB_QUERY_SECONDS = REGISTRY.histogram("realm_db_query_seconds", "SQL statement execution time.", ["statement"])
+CACHE_REQUESTS = REGISTRY.counter("realm_cache_requests_total", "5C result cache lookups.", ["result"])
+
+
+class Run:
+    """Timing and counter breakdown of one analysis job, chat turn or batch document."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, kind, label=None, **attributes):
+        self.id = next(self._ids)
+        self.kind = kind
+        self.label = label or kind
+        self.attributes = attributes
+        self.started_at = datetime.utcnow()
+        self.seconds = None
+        self.outcome = None
+        # span name -> [calls, total seconds]
+        self.spans = {}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def add_span(self, name, seconds):
+        with self.lock:
+            state = self.spans.setdefault(name, [0, 0.0])
+            state[0] += 1
+            state[1] += seconds
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+    def set_min(self, name, value):
+        """Keeps the smallest value seen, e.g. the fastest time to first token."""
+        with self.lock:
+            self.values[name] = min(self.values.get(name, value), value)
+
+    def breakdown(self):
+        """Returns one dict per span, slowest total first."""
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda item: item[1][1], reverse=True)
+        return [{"span": name, "calls": calls, "seconds": seconds} for name, (calls, seconds) in spans]
+
+
+_current_run = contextvars.ContextVar("realm_metrics_run", default=None)
+_recent_runs = deque(maxlen=config.METRICS_RECENT_RUNS)
+_recent_runs_lock = threading.Lock()
+
+
+# Function to get the run active in the calling context, or None
+def current_run():
+    return _current_run.get()
+
+
+# Context manager that collects a per-run breakdown of the spans and values recorded inside it
+@contextmanager
+def run(kind, label=None, **attributes):
+    current = Run(kind, label, **attributes)
+    token = _current_run.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+        # The body may have set its own outcome, e.g. for an error it handled
+        current.outcome = current.outcome or "ok"
+    finally:
+        current.outcome = current.outcome or "error"
+        current.seconds = time.perf_counter() - started
+        _current_run.reset(token)
+        RUNS.inc(kind=kind, outcome=current.outcome)
+        with _recent_runs_lock:
+            _recent_runs.append(current)
+
+
+# Context manager that times a stage, both globally and for the active run
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_span(name, time.perf_counter() - started)
+
+
+# Function to record a stage timed elsewhere
+def observe_span(name, seconds):
+    SPAN_SECONDS.observe(seconds, span=name)
+    current = _current_run.get()
+    if current is not None:
+        current.add_span(name, seconds)
+
+
+# Function to add to a named value (tokens, cache hits...) of the active run
+def record(name, amount=1):
+    current = _current_run.get()
+    if current is not None:
+        current.add(name, amount)
+
+
+# Function to keep the smallest value seen for the active run, e.g. the fastest time to first token
+def record_min(name, value):
+    current = _current_run.get()
+    if current is not None:
+        current.set_min(name, value)
+
+
+# Function to get the latest finished runs, newest first, optionally only those with matching attributes
+def recent_runs(**attributes):
+    with _recent_runs_lock:
+        runs = list(_recent_runs)
+    return [
+        r for r in reversed(runs)
+        if all(r.attributes.get(name) == value for name, value in attributes.items())
+    ]
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Function to serve /metrics on a background thread; returns the server, or None if the port is taken
+def start_http_server(port=None, host=None):
+    port = config.METRICS_PORT if port is None else port
+    host = config.METRICS_HOST if host is None else host
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.error(f"Could not start the metrics endpoint on {host}:{port}: {str(e)}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="realm-metrics", daemon=True).start()
+    logger.info(f"Serving Prometheus metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,197 @@
+"""Local stand-in for the LLM API, for offline runs and load tests.
+
+It speaks the OpenAI chat-completions protocol (plain JSON and SSE streaming) and answers
+every 5C prompt with a canned analysis ending in a valid structured result, so the whole
+pipeline works end to end. Latency, streaming speed and injected errors are configurable,
+and all randomness comes from --seed. Replies depend only on the prompt.
+
+    python mock_llm_server.py --port 8765 --latency 0.5 --error-rate 0.05
+
+Then point the app at it (the client-side rate limit is usually not wanted here):
+
+    REALM_LLM_BACKEND=mock REALM_LLM_REQUESTS_PER_MINUTE=0 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prompts import CATEGORIES, SECTION_HEADING, SECTION_PATTERN, SUB_ELEMENTS
+
+logger = logging.getLogger(__name__)
+
+SINGLE_CATEGORY = re.compile(r"\b(" + "|".join(CATEGORIES) + r")\b (?:aspect|findings)")
+
+
+class MockOptions:
+    """Behaviour of the mock server; shared by all request threads."""
+
+    def __init__(self, latency=0.2, jitter=0.0, error_rate=0.0, error_codes=(429, 500, 503),
+                 tokens_per_second=0.0, response_words=250, seed=0):
+        # Seconds before the first byte, plus up to `jitter` more
+        self.latency = latency
+        self.jitter = jitter
+        # Share of requests answered with one of error_codes instead of a completion
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        # Streaming speed in words per second (0 = as fast as possible)
+        self.tokens_per_second = tokens_per_second
+        self.response_words = response_words
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def draw(self):
+        """Returns (delay, error status or None) for the next request."""
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            status = None
+            if self.random.random() < self.error_rate:
+                status = self.random.choice(self.error_codes)
+                self.errors += 1
+            return delay, status
+
+
+# Function to write a deterministic analysis for one category, seeded by the prompt
+def fake_analysis(category, prompt, words):
+    digest = hashlib.sha256(f"{category}\n{prompt}".encode("utf-8")).digest()
+    ratings = {element: digest[i] % 6 for i, element in enumerate(SUB_ELEMENTS[category])}
+    score = round(sum(ratings.values()) / (5 * len(ratings)) * 100)
+    filler = " ".join(f"The document provides evidence on {category.lower()} point {i + 1}." for i in range(max(1, words // 9)))
+    lines = [f"### {category} Assessment", filler]
+    lines += [f"- **{element}**: {rating}/5" for element, rating in ratings.items()]
+    lines.append(f"**{category} Score**: {score}/100")
+    result = {"category": category, "score": score, "sub_elements": ratings, "missing_data": []}
+    lines.append("```json\n" + json.dumps(result) + "\n```")
+    return "\n\n".join(lines)
+
+
+# Function to answer a prompt the way the real model is asked to: one section per category for combined prompts,
+# a plain answer for chat and summary prompts
+def fake_completion(prompt, words):
+    if prompt.startswith("Based on the 5C analysis"):
+        return "Based on the 5C analysis and the document excerpts, " + " ".join(["this is a mock answer."] * max(1, words // 5))
+    if prompt.startswith("Summarise the conversation"):
+        return "Summary: " + " ".join(["the user asked about the project and got an answer."] * max(1, words // 50))
+    combined = list(dict.fromkeys(match.group(1) for match in SECTION_PATTERN.finditer(prompt)))
+    if combined:
+        return "\n\n".join(
+            f"{SECTION_HEADING.format(category=category)}\n{fake_analysis(category, prompt, words)}" for category in combined
+        )
+    match = SINGLE_CATEGORY.search(prompt)
+    if match:
+        return fake_analysis(match.group(1), prompt, words)
+    return "Mock completion."
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length))
+            prompt = payload["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError):
+            self._send_json(400, {"error": {"message": "Invalid chat completions request"}})
+            return
+
+        delay, status = self.options.draw()
+        time.sleep(delay)
+        if status is not None:
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self._send_json(status, {"error": {"message": f"Injected error {status}"}}, headers)
+            return
+
+        text = fake_completion(prompt, self.options.response_words)
+        model = payload.get("model", "mock")
+        if not payload.get("stream"):
+            self._send_json(200, {
+                "id": "mock",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        pause = 1 / self.options.tokens_per_second if self.options.tokens_per_second > 0 else 0
+        for word in re.findall(r"\S+\s*", text):
+            chunk = {"choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            if pause:
+                self.wfile.flush()
+                time.sleep(pause)
+        done = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+        self.close_connection = True
+
+
+# Function to start the mock server on a background thread; returns (server, chat completions URL).
+# Port 0 picks a free port.
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"options": MockOptions(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="realm-mock-llm", daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+    logger.info(f"Mock LLM server listening on {url}")
+    return server, url
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the LLM chat completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that get an error status")
+    parser.add_argument("--error-codes", type=int, nargs="+", default=[429, 500, 503])
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Streaming speed in words/second (0 = unthrottled)")
+    parser.add_argument("--response-words", type=int, default=250, help="Approximate length of each analysis")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server, url = start_mock_server(
+        args.host, args.port,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_codes=args.error_codes,
+        tokens_per_second=args.tokens_per_second, response_words=args.response_words, seed=args.seed,
+    )
+    print(f"Serving mock chat completions on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
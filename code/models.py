@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from datetime import datetime
+from sqlalchemy import Boolean, Column, Integer, Float, String, Text, DateTime, ForeignKey, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -18,7 +19,112 @@ class Conversation(Base):
 class Messages(Base):
     __tablename__ = 'messages'
     id = Column(Integer, primary_key=True)
-    conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False)
+    conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False, index=True)
+    # Legacy JSON-encoded {"role", "content"}; only set on rows written before the typed columns
+    # and not yet converted by backfill_messages.py
     data = Column(String)
+    role = Column(String)
+    category = Column(String, index=True)
+    content = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    latency_ms = Column(Integer)
 
-    conversation = relationship("Conversation", back_populates="messages")
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="messages")
+
+# Define the 'analysis_cache' table: 5C results keyed by a hash of document, category, prompt version and model
+class AnalysisCache(Base):
+    __tablename__ = 'analysis_cache'
+    id = Column(Integer, primary_key=True)
+    key = Column(String(64), nullable=False, unique=True)
+    category = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    result = Column(Text, nullable=False)
+    size = Column(Integer, nullable=False)
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Define the 'jobs' table: background document analyses that outlive Streamlit reruns
+class Job(Base):
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False, index=True)
+    owner = Column(String, nullable=False)
+    kind = Column(String, nullable=False, default="analysis")
+    status = Column(String, nullable=False, default="queued", index=True)
+    file_path = Column(String, nullable=False)
+    # JSON list of requested categories, JSON list of finished ones and JSON {category: error}
+    categories = Column(Text, nullable=False)
+    completed = Column(Text, nullable=False, default="[]")
+    errors = Column(Text, nullable=False, default="{}")
+    # "combined", "per_category" or "auto"; None uses config.ANALYSIS_MODE
+    mode = Column(String)
+    document_id = Column(String)
+    # Re-run only the categories whose sections changed since the conversation's previous version
+    incremental = Column(Boolean, default=True)
+    # JSON section manifest of the analysed text and JSON summary of the diff against the previous version
+    sections = Column(Text)
+    revision = Column(Text)
+    error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+
+# Define the 'scores' table: the structured result of one category analysis
+class CategoryScore(Base):
+    __tablename__ = 'scores'
+    id = Column(Integer, primary_key=True)
+    # Set for analyses run in the app; batch runs only have the document
+    conversation_id = Column(Integer, ForeignKey('conversations.id'), index=True)
+    message_id = Column(Integer, ForeignKey('messages.id'))
+    document_id = Column(String, index=True)
+    source = Column(String)
+    category = Column(String, nullable=False, index=True)
+    score = Column(Float, nullable=False)
+    # JSON {element: 0-5 rating or null} and JSON list of missing information
+    sub_ratings = Column(Text, nullable=False, default="{}")
+    missing_data = Column(Text, nullable=False, default="[]")
+    model = Column(String)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+# Define the 'summaries' table: the rolling summary of a conversation's older chat turns
+class ConversationSummary(Base):
+    __tablename__ = 'summaries'
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False, unique=True)
+    content = Column(Text, nullable=False)
+    # Newest message folded into the summary; later turns are sent to the model as they are
+    through_message_id = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False, default=0)
+    model = Column(String)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+# Define the 'uploads' table: one stored file per distinct content, named by its SHA-256
+class Upload(Base):
+    __tablename__ = 'uploads'
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), nullable=False, unique=True)
+    path = Column(String, nullable=False)
+    # Name of the first upload with this content
+    original_name = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    upload_count = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Define the 'archives' table: the compressed messages of a conversation that was idle for a long time
+class ConversationArchive(Base):
+    __tablename__ = 'archives'
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False, unique=True)
+    # "zstd" or "zlib"; the blob is the conversation's message rows as compressed JSON lines
+    codec = Column(String, nullable=False)
+    blob = Column(LargeBinary, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)
+    compressed_bytes = Column(Integer, nullable=False)
+    last_message_at = Column(DateTime)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
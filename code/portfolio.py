@@ -0,0 +1,125 @@
+"""Portfolio view of the stored 5C scores.
+
+Everything below works on a projects x categories matrix, so composites, ranks, percentiles
+and distributions for the whole book are computed in a single vectorized pass rather than
+by re-parsing analysis text.
+"""
+import json
+import logging
+import warnings
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+import database
+from models import CategoryScore, Conversation
+from prompts import CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = {category: 1.0 for category in CATEGORIES}
+PERCENTILES = (5, 25, 50, 75, 95)
+HISTOGRAM_BINS = 10
+
+
+# Function to load the latest score of every (project, category) in one query.
+# A project is a document when its hash is known, otherwise the conversation it was scored in.
+def load_scores():
+    query = (
+        select(
+            CategoryScore.id,
+            CategoryScore.conversation_id,
+            CategoryScore.document_id,
+            CategoryScore.source,
+            CategoryScore.category,
+            CategoryScore.score,
+            CategoryScore.sub_ratings,
+            CategoryScore.missing_data,
+            Conversation.name.label("conversation"),
+        )
+        .outerjoin(Conversation, Conversation.id == CategoryScore.conversation_id)
+        .order_by(CategoryScore.id)
+    )
+    with database.engine.connect() as connection:
+        frame = pd.read_sql(query, connection)
+
+    conversation_key = "conversation-" + frame["conversation_id"].astype("Int64").astype(str)
+    frame["project"] = frame["document_id"].fillna(conversation_key)
+    frame["name"] = frame["source"].fillna(frame["conversation"]).fillna(frame["project"])
+    frame["missing_count"] = frame["missing_data"].map(lambda value: len(json.loads(value or "[]")))
+    frame = frame.drop_duplicates(["project", "category"], keep="last")
+    logger.info(f"Loaded {len(frame)} scores for {frame['project'].nunique()} projects")
+    return frame
+
+
+# Function to get (newest score id, score count), which changes whenever scores are added or deleted
+def get_scores_version():
+    with database.session_scope() as db:
+        return tuple(db.query(func.max(CategoryScore.id), func.count(CategoryScore.id)).one())
+
+
+# Function to pivot scores into a projects x categories matrix; unscored categories are NaN
+def score_matrix(frame):
+    matrix = frame.pivot(index="project", columns="category", values="score")
+    return matrix.reindex(columns=list(CATEGORIES)).astype(float)
+
+
+# Function to compute the weighted composite of each row; weights are renormalised over the categories present
+def composite_scores(matrix, weights=None):
+    weights = DEFAULT_WEIGHTS if weights is None else weights
+    w = np.array([float(weights.get(category, 0.0)) for category in matrix.columns])
+    values = matrix.to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    weighted_sum = np.where(present, values, 0.0) @ w
+    weight_total = present @ w
+    with np.errstate(invalid="ignore", divide="ignore"):
+        composite = np.where(weight_total > 0, weighted_sum / weight_total, np.nan)
+    return pd.Series(composite, index=matrix.index, name="Composite")
+
+
+# Function to get the percentile rank (0-100) of each value within its column, ignoring NaN
+def percentile_ranks(values):
+    return values.rank(pct=True, method="average") * 100
+
+
+# Function to get count, mean and percentiles of every column in one call
+def summarize(table):
+    values = table.to_numpy(dtype=float)
+    with warnings.catch_warnings():
+        # Columns without any score yield NaN, which is what the table should show
+        warnings.simplefilter("ignore", RuntimeWarning)
+        percentiles = np.nanpercentile(values, PERCENTILES, axis=0) if len(values) else np.full((len(PERCENTILES), values.shape[1]), np.nan)
+        means = np.nanmean(values, axis=0) if len(values) else np.full(values.shape[1], np.nan)
+    summary = pd.DataFrame(percentiles, index=[f"p{p}" for p in PERCENTILES], columns=table.columns)
+    summary.loc["mean"] = means
+    summary.loc["count"] = (~np.isnan(values)).sum(axis=0)
+    return summary.loc[["count", "mean", *summary.index[:len(PERCENTILES)]]]
+
+
+# Function to bucket each column into score bands of equal width over 0-100
+def distributions(table, bins=HISTOGRAM_BINS):
+    edges = np.linspace(0, 100, bins + 1)
+    labels = [f"{low:.0f}-{high:.0f}" for low, high in zip(edges[:-1], edges[1:])]
+    counts = {}
+    for column in table.columns:
+        values = table[column].to_numpy(dtype=float)
+        counts[column], _ = np.histogram(values[~np.isnan(values)], bins=edges)
+    return pd.DataFrame(counts, index=labels)
+
+
+# Function to build the ranked portfolio table plus its summary and distributions
+def build_portfolio(frame, weights=None):
+    matrix = score_matrix(frame)
+    composite = composite_scores(matrix, weights)
+    table = matrix.assign(Composite=composite)
+
+    projects = frame.groupby("project").agg(name=("name", "last"), missing_data=("missing_count", "sum"))
+    ranked = projects.join(table)
+    ranked["Percentile"] = percentile_ranks(ranked["Composite"])
+    ranked = ranked.sort_values("Composite", ascending=False, na_position="last")
+    return {
+        "ranked": ranked,
+        "summary": summarize(table),
+        "distributions": distributions(table),
+    }
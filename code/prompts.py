@@ -0,0 +1,361 @@
+import re
+from functools import lru_cache
+from types import MappingProxyType
+
+# Bump whenever a template below changes, so cached analyses built from the old text are not reused
+PROMPT_VERSION = 3
+
+# The five credit-scoring categories, in display order
+CATEGORIES = ("Character", "Capacity", "Capital", "Collateral", "Conditions")
+
+# Heading that opens each category's section in a combined (all categories in one call) response
+SECTION_HEADING = "=== {category} ==="
+SECTION_PATTERN = re.compile(r"^[ \t#*]*===\s*(" + "|".join(CATEGORIES) + r")\s*===[ \t*]*$", re.MULTILINE)
+
+# Per-category analysis instructions for the 5C method; read-only, like the other registries below
+CATEGORY_PROMPTS = MappingProxyType({
+    "Character": ("""
+        Analyze the provided project document, focusing on the Character aspect for credit scoring. Evaluate the following elements:
+        1. Years in operation
+        2. Industry reputation
+        3. Management experience
+        4. Regulatory compliance history
+        
+        Scoring (0-5 scale):
+        0 - Poor reputation, multiple regulatory issues
+        1 - Some concerns, minor regulatory issues
+        2 - Average reputation, no major issues
+        3 - Good reputation, strong compliance
+        4 - Excellent reputation, industry leader
+        5 - Outstanding reputation, exemplary track record
+        
+        Provide a concise analysis addressing each element above. If any information is missing, note its absence. Conclude with:
+        1. An overall Character assessment summary
+        2. A Character score on a scale of 0-100
+        3. Brief recommendations for improvement or areas needing clarification
+        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
+        """),
+    "Capacity": ("""
+        Analyze the provided project document, focusing on the Capacity aspect for credit scoring. Evaluate the following elements:
+        1. Debt-to-equity ratio
+        2. Operating cash flow
+        3. Profit margins
+        4. Revenue growth rate
+        
+        Scoring (0-5 scale):
+        0 - Severe financial distress
+        1 - Struggling financially
+        2 - Average financial performance
+        3 - Strong financial position
+        4 - Very strong financials
+        5 - Exceptional financial health
+        
+        Provide a brief analysis for each element above. If any information is missing, note its absence. Conclude with:
+        1. An overall Capacity assessment summary
+        2. A Capacity score on a scale of 0-100
+        3. Key recommendations for enhancing project capacity
+        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
+        """),
+    "Capital": ("""
+        Analyze the provided project document, focusing on the Capital aspect for credit scoring. Evaluate the following elements:
+        1. Total assets
+        2. Net worth
+        3. Liquidity ratio
+        4. Capital adequacy ratio (for financial institutions)
+        
+        Scoring (0-5 scale):
+        0 - Severely undercapitalized
+        1 - Undercapitalized
+        2 - Adequately capitalized
+        3 - Well-capitalized
+        4 - Very well-capitalized
+        5 - Exceptionally strong capital position
+        
+        Provide a brief analysis for each element above. If any information is missing, note its absence. Conclude with:
+        1. An overall Capital assessment summary
+        2. A Capital score on a scale of 0-100
+        3. Recommendations for improving capital position or structure
+        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
+        """),
+    "Collateral": ("""
+        Analyze the provided project document, focusing on the Collateral aspect for credit scoring. Evaluate the following elements:
+        1. Quality of assets
+        2. Diversification of asset portfolio
+        3. Valuation of assets
+        4. Ease of liquidation
+        
+        Scoring (0-5 scale):
+        0 - No viable collateral
+        1 - Limited, low-quality collateral
+        2 - Adequate collateral
+        3 - Good quality, diversified collateral
+        4 - High-quality, easily liquidated collateral
+        5 - Premium collateral or strong guarantees
+        
+        Provide a brief analysis for each element above. If any information is missing, note its absence. Conclude with:
+        1. An overall Collateral assessment summary
+        2. A Collateral score on a scale of 0-100
+        3. Recommendations for improving collateral quality or coverage
+        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
+        """),
+    "Conditions": ("""
+        Analyze the provided project document, focusing on the Conditions aspect for credit scoring. Evaluate the following elements:
+        1. Economic conditions in customer's primary markets
+        2. Industry trends
+        3. Geopolitical risks
+        4. Natural disaster exposure
+        
+        Scoring (0-5 scale):
+        0 - Extremely unfavorable conditions
+        1 - Challenging conditions
+        2 - Neutral conditions
+        3 - Favorable conditions
+        4 - Very favorable conditions
+        5 - Optimal conditions for growth and stability
+        
+        Provide a brief analysis for each element above. If any information is missing, note its absence. Conclude with:
+        1. An overall Conditions assessment summary
+        2. A Conditions score on a scale of 0-100
+        3. Recommendations for addressing unfavorable conditions or leveraging positive ones
+        Base your analysis solely on the document's content. Maintain objectivity and a professional tone throughout your response.
+        """)
+})
+
+
+# The elements each category prompt asks the model to rate, used as keys of the structured result
+SUB_ELEMENTS = MappingProxyType({
+    "Character": ("Years in operation", "Industry reputation", "Management experience", "Regulatory compliance history"),
+    "Capacity": ("Debt-to-equity ratio", "Operating cash flow", "Profit margins", "Revenue growth rate"),
+    "Capital": ("Total assets", "Net worth", "Liquidity ratio", "Capital adequacy ratio"),
+    "Collateral": ("Quality of assets", "Diversification of asset portfolio", "Valuation of assets", "Ease of liquidation"),
+    "Conditions": ("Economic conditions", "Industry trends", "Geopolitical risks", "Natural disaster exposure"),
+})
+
+
+# Function to strip template indentation and collapse blank-line runs; only applied to
+# our own templates, never to document text
+def normalize_whitespace(text):
+    lines = [line.strip() for line in text.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+# Function to normalise a template once; templates are string constants, so the cache stays small
+@lru_cache(maxsize=None)
+def _normalized_template(template):
+    return normalize_whitespace(template)
+
+
+# Function to fill a template after normalising its whitespace; values are inserted verbatim
+def _render(template, **values):
+    return _normalized_template(template).format(**values)
+
+
+# Category instructions without the template indentation, prepared once at import
+CATEGORY_DESCRIPTIONS = MappingProxyType({category: normalize_whitespace(prompt) for category, prompt in CATEGORY_PROMPTS.items()})
+
+
+# Function to get a category's instructions without the template indentation
+def category_description(category):
+    return CATEGORY_DESCRIPTIONS[category]
+
+
+# Function to build the instructions that make the model end its analysis with a machine-readable result
+@lru_cache(maxsize=None)
+def build_structured_output_instructions(category):
+    elements = ", ".join(f'"{element}"' for element in SUB_ELEMENTS[category])
+    return _render("""
+        Finish your response with a JSON object in a ```json code block, with nothing after it, in this form:
+        {{"category": "{category}", "score": <overall score 0-100>, "sub_elements": {{<element>: <rating 0-5, or null if the document does not cover it>}}, "missing_data": [<information the document lacks>]}}
+        Use exactly these sub_elements keys: {elements}.
+        """, category=category, elements=elements)
+
+
+# Function to build the full analysis prompt for one category
+def build_category_prompt(category, content):
+    return _render("""
+        Analyze the following content focusing on the {category} aspect of the 5C method:
+
+        {content}
+
+        {category}: {description}
+
+        Provide key points and insights based on the given content.
+
+        {structured}
+        """, category=category, content=content, description=category_description(category),
+        structured=build_structured_output_instructions(category))
+
+
+# Function to describe several categories in one prompt, each with the sub_elements keys its JSON must use
+def _combined_sections(categories):
+    return "\n\n".join(
+        f"{SECTION_HEADING.format(category=category)}\n{category_description(category)}\n"
+        f"sub_elements keys: " + ", ".join(f'"{element}"' for element in SUB_ELEMENTS[category])
+        for category in categories
+    )
+
+
+# Function to build one prompt that analyses the document for several categories at once
+def build_combined_prompt(categories, content):
+    return _render("""
+        Analyze the following content for each of these aspects of the 5C method: {names}.
+
+        {content}
+
+        The instructions for each aspect follow, each under its own heading:
+
+        {sections}
+
+        Write one section per aspect, in the order above, each starting with its heading line exactly as shown
+        (for example "{example}"). Provide key points and insights based on the given content.
+        End every section with a JSON object in a ```json code block, in this form:
+        {{"category": "<aspect>", "score": <overall score 0-100>, "sub_elements": {{<element>: <rating 0-5, or null if the document does not cover it>}}, "missing_data": [<information the document lacks>]}}
+        using that aspect's sub_elements keys.
+        """, names=", ".join(categories), content=content, sections=_combined_sections(categories),
+        example=SECTION_HEADING.format(category=categories[0]))
+
+
+# Function to split a combined response into {category: section text}; categories without a heading are left out
+def split_combined_response(text, categories=CATEGORIES):
+    matches = [match for match in SECTION_PATTERN.finditer(text) if match.group(1) in categories]
+    sections = {}
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following is not None else len(text)
+        sections[match.group(1)] = text[match.end():end].strip()
+    return sections
+
+
+# Function to build the prompt that extracts one category's findings from one chunk of a large document
+def build_chunk_prompt(category, chunk, index, total):
+    return _render("""
+        The following is part {index} of {total} of a larger project document.
+        Extract the findings relevant to the {category} aspect of the 5C method:
+
+        {chunk}
+
+        {category}: {description}
+
+        Report only what this part of the document supports and note which elements it does not cover.
+        Give a provisional {category} score on a scale of 0-100 only if this part contains enough evidence.
+        """, index=index, total=total, category=category, chunk=chunk, description=category_description(category))
+
+
+# Function to build the prompt that extracts the findings for several categories from one chunk at once
+def build_combined_chunk_prompt(categories, chunk, index, total):
+    return _render("""
+        The following is part {index} of {total} of a larger project document.
+        Extract the findings relevant to each of these aspects of the 5C method: {names}.
+
+        {chunk}
+
+        The instructions for each aspect follow, each under its own heading:
+
+        {sections}
+
+        Write one section per aspect, in the order above, each starting with its heading line exactly as shown.
+        Report only what this part of the document supports and note which elements it does not cover.
+        Give a provisional score on a scale of 0-100 for an aspect only if this part contains enough evidence.
+        """, index=index, total=total, names=", ".join(categories), chunk=chunk, sections=_combined_sections(categories))
+
+
+# Function to build the prompt that merges partial findings; the final merge produces the full analysis
+def build_reduce_prompt(category, findings, final=True):
+    sections = "\n\n".join(f"Findings {i}:\n{text}" for i, text in enumerate(findings, start=1))
+    if not final:
+        return _render("""
+            The following are partial {category} findings from consecutive parts of one project document:
+
+            {sections}
+
+            Merge them into one consolidated set of {category} findings. Remove repetition, keep every distinct fact and note which elements are still not covered.
+            """, category=category, sections=sections)
+    return _render("""
+        The following are partial {category} findings extracted from every part of one project document:
+
+        {sections}
+
+        {category}: {description}
+
+        Merge the findings into a single analysis that follows the instructions above. Resolve overlaps between parts,
+        treat an element as missing only if no part covers it, and give exactly one overall {category} score on a scale of 0-100.
+
+        {structured}
+        """, category=category, sections=sections, description=category_description(category),
+        structured=build_structured_output_instructions(category))
+
+
+# Function to lay out chat turns ({"role", "content"} dicts) as a transcript
+def format_turns(turns):
+    return "\n\n".join(f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in turns)
+
+
+# Function to build the conversation memory part of a chat prompt; empty when there is nothing to remember
+def _chat_memory(summary, history):
+    parts = []
+    if summary:
+        parts.append(_render("""
+            Summary of the earlier conversation:
+
+            {summary}
+            """, summary=summary))
+    if history:
+        parts.append(_render("""
+            The latest messages of the conversation:
+
+            {history}
+            """, history=format_turns(history)))
+    return "".join(part + "\n\n" for part in parts)
+
+
+# Function to build a chat prompt grounded in the 5C analysis, the passages retrieved for the question
+# and, when given, the conversation summary and latest turns
+def build_chat_prompt(question, analysis, passages, summary=None, history=None):
+    memory = _chat_memory(summary, history)
+    if not passages:
+        return _render("""
+            Based on the 5C analysis provided earlier:
+
+            {analysis}
+
+            {memory}And the user's question:
+
+            User: {question}
+
+            Provide a detailed and informative answer, incorporating relevant aspects from the 5C analysis where applicable.
+            """, analysis=analysis, memory=memory, question=question)
+    excerpts = "\n\n".join(f"[{i}] {passage}" for i, passage in enumerate(passages, start=1))
+    return _render("""
+        Based on the 5C analysis provided earlier:
+
+        {analysis}
+
+        These excerpts from the project document are the most relevant to the question:
+
+        {excerpts}
+
+        {memory}And the user's question:
+
+        User: {question}
+
+        Provide a detailed and informative answer, incorporating relevant aspects from the 5C analysis where applicable.
+        Cite the document excerpts you rely on by their number, e.g. [2].
+        """, analysis=analysis, excerpts=excerpts, memory=memory, question=question)
+
+
+# Function to build the prompt that folds older chat turns into the running summary of a conversation
+def build_summary_prompt(previous_summary, turns):
+    previous = previous_summary or "(none yet)"
+    return _render("""
+        Summarise the conversation below between a user and an assistant discussing a project's 5C credit analysis.
+
+        Summary of the conversation before these messages:
+
+        {previous}
+
+        Messages to add to the summary:
+
+        {transcript}
+
+        Write one updated summary that replaces the previous one. Keep the user's questions, the answers' key
+        figures and conclusions, and anything the user asked to remember; drop pleasantries and repetition.
+        """, previous=previous, transcript=format_turns(turns))
@@ -0,0 +1,196 @@
+"""Library of downloadable reports: the sample reports in config.REPORTS_DIR and exported analyses.
+
+The directory index is kept in memory and only rebuilt for files whose size or modification
+time changed, so listing the library does not read any file. Each file's MIME type is guessed
+from its name and, failing that, from its first bytes. Files that compress well get a gzip copy
+under config.REPORT_ARTIFACT_DIR when they are indexed, so a download of the compressed
+version is served from disk without compressing on request. File contents are only read when a
+download is asked for.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Magic numbers checked when the file name does not give a type
+SIGNATURES = (
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+# Types that are compressed already; gzip would only add work
+COMPRESSED_TYPES = {"application/zip", "application/gzip", "image/png", "image/jpeg"}
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+mimetypes.add_type(DOCX_MIME, ".docx")
+mimetypes.add_type("text/markdown", ".md")
+
+# {directory: {name: entry}}, rebuilt entry by entry as files change
+_index = {}
+_index_lock = threading.Lock()
+
+
+# Function to guess a file's MIME type from its name, then from its first bytes
+def detect_mime(path):
+    mime, encoding = mimetypes.guess_type(path)
+    if mime and not encoding:
+        return mime
+    with open(path, "rb") as f:
+        head = f.read(512)
+    for signature, signature_mime in SIGNATURES:
+        if head.startswith(signature):
+            return signature_mime
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError:
+        # A multi-byte character may be cut at the end of the sample
+        try:
+            head[:-3].decode("utf-8")
+        except UnicodeDecodeError:
+            return "application/octet-stream"
+    return "text/plain"
+
+
+# Function to get the path of a file's gzip copy; the name changes with the file, so stale copies are never served
+def _artifact_path(path, size, mtime_ns):
+    key = hashlib.sha256(f"{os.path.abspath(path)}\0{size}\0{mtime_ns}".encode("utf-8")).hexdigest()[:32]
+    return os.path.join(config.REPORT_ARTIFACT_DIR, f"{key}.gz")
+
+
+# Function to write a gzip copy of a file unless it already exists; returns its size, or None if gzip
+# does not make the file meaningfully smaller
+def _build_artifact(path, artifact_path, size):
+    if os.path.exists(artifact_path):
+        return os.path.getsize(artifact_path)
+    os.makedirs(config.REPORT_ARTIFACT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=config.REPORT_ARTIFACT_DIR, suffix=".part")
+    try:
+        with open(path, "rb") as source, os.fdopen(fd, "wb") as raw, gzip.GzipFile(
+            filename=os.path.basename(path), mode="wb", fileobj=raw, compresslevel=config.REPORT_GZIP_LEVEL, mtime=0
+        ) as target:
+            shutil.copyfileobj(source, target, config.UPLOAD_CHUNK_BYTES)
+        compressed = os.path.getsize(tmp_path)
+        if compressed > size * config.REPORT_MIN_COMPRESSION:
+            os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, artifact_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"Compressed {path}: {size} -> {compressed} bytes")
+    return compressed
+
+
+# Function to index one file: name, size, modification time, MIME type and gzip copy (if worthwhile)
+def _build_entry(directory, dir_entry):
+    stat = dir_entry.stat()
+    path = os.path.join(directory, dir_entry.name)
+    mime = detect_mime(path)
+    entry = {
+        "name": dir_entry.name,
+        "path": path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "mime": mime,
+        "gzip_path": None,
+        "gzip_size": None,
+    }
+    if stat.st_size >= config.REPORT_COMPRESS_MIN_BYTES and mime not in COMPRESSED_TYPES and mime != DOCX_MIME:
+        artifact_path = _artifact_path(path, stat.st_size, stat.st_mtime_ns)
+        try:
+            gzip_size = _build_artifact(path, artifact_path, stat.st_size)
+        except OSError as e:
+            # The original is still downloadable
+            logger.error(f"Could not compress {path}: {str(e)}")
+            gzip_size = None
+        if gzip_size is not None:
+            entry.update(gzip_path=artifact_path, gzip_size=gzip_size)
+    return entry
+
+
+# Function to list the reports in a directory, sorted by name. Only files whose size or modification
+# time changed since the last call are re-examined.
+def list_reports(directory=None):
+    directory = directory or config.REPORTS_DIR
+    try:
+        dir_entries = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith(".")]
+    except FileNotFoundError:
+        logger.error(f"Directory not found: {directory}")
+        return []
+
+    with _index_lock:
+        cached = _index.get(directory, {})
+        index = {}
+        for dir_entry in dir_entries:
+            stat = dir_entry.stat()
+            entry = cached.get(dir_entry.name)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                entry = _build_entry(directory, dir_entry)
+            index[dir_entry.name] = entry
+        _index[directory] = index
+
+    # Gzip copies of files that changed or were removed are no longer referenced
+    if set(cached) != set(index) or any(cached[name] is not index.get(name) for name in cached):
+        _prune_artifacts()
+    return [dict(index[name]) for name in sorted(index, key=str.lower)]
+
+
+# Function to delete gzip copies no indexed file refers to
+def _prune_artifacts():
+    with _index_lock:
+        live = {entry["gzip_path"] for index in _index.values() for entry in index.values() if entry["gzip_path"]}
+    try:
+        names = os.listdir(config.REPORT_ARTIFACT_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(config.REPORT_ARTIFACT_DIR, name)
+        if name.endswith(".gz") and path not in live:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Function to read a report (or its gzip copy) for a download
+def read_report(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# Function to turn a title into a safe file name, keeping the extension
+def safe_filename(filename):
+    stem, extension = os.path.splitext(filename)
+    if not re.fullmatch(r"\.\w{1,10}", extension):
+        stem, extension = filename, ".txt"
+    stem = " ".join(re.sub(r"[^\w\- ]+", " ", stem).split()) or "report"
+    return f"{stem[:120]}{extension}"
+
+
+# Function to save text as a report in the library; returns its path. The file is written under a
+# temporary name and renamed, so the index never sees half a report.
+def save_report(content, filename, directory=None):
+    directory = directory or config.REPORTS_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, safe_filename(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    logger.info(f"Saved report {path}")
+    return path
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+import config
+import metrics
+from database import SessionLocal
+from models import AnalysisCache
+
+logger = logging.getLogger(__name__)
+
+
+# Function to hash a document's text once, so per-category keys don't rehash the whole document
+def hash_document(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# Function to build the cache key for one category of one document
+def make_key(document_hash, category, prompt_version, model):
+    return hashlib.sha256(f"{document_hash}|{category}|{prompt_version}|{model}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Persistent 5C result cache with TTL expiry and LRU eviction by entry count and total size."""
+
+    def __init__(self, session_factory=SessionLocal, ttl_days=None, max_entries=None, max_bytes=None):
+        self.session_factory = session_factory
+        self.ttl = timedelta(days=config.CACHE_TTL_DAYS if ttl_days is None else ttl_days)
+        self.max_entries = config.CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_bytes = config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.CACHE_REQUESTS.inc(result="hit" if hit else "miss")
+        metrics.record("cache_hits" if hit else "cache_misses")
+
+    def get(self, key):
+        with self.session_factory() as db:
+            entry = db.query(AnalysisCache).filter(AnalysisCache.key == key).first()
+            now = datetime.utcnow()
+            if entry is not None and now - entry.created_at > self.ttl:
+                db.delete(entry)
+                db.commit()
+                entry = None
+            if entry is None:
+                self._count(False)
+                return None
+            entry.hit_count += 1
+            entry.last_accessed_at = now
+            result = entry.result
+            db.commit()
+        self._count(True)
+        return result
+
+    def _write(self, db, key, category, model, result):
+        entry = db.query(AnalysisCache).filter(AnalysisCache.key == key).first()
+        now = datetime.utcnow()
+        if entry is None:
+            entry = AnalysisCache(key=key, category=category, model=model, hit_count=0)
+            db.add(entry)
+        entry.result = result
+        entry.size = len(result.encode("utf-8"))
+        entry.created_at = now
+        entry.last_accessed_at = now
+        db.commit()
+
+    # Function to store a result; a failed write is logged and never fails the analysis that produced it
+    def put(self, key, category, model, result):
+        try:
+            with self.session_factory() as db:
+                try:
+                    self._write(db, key, category, model, result)
+                except IntegrityError:
+                    # Another job cached the same document at the same moment; update its row instead
+                    db.rollback()
+                    self._write(db, key, category, model, result)
+                self._evict(db)
+        except SQLAlchemyError as e:
+            logger.error(f"Could not cache the {category} result: {str(e)}")
+
+    def _evict(self, db):
+        expired = db.query(AnalysisCache).filter(AnalysisCache.created_at < datetime.utcnow() - self.ttl).delete()
+
+        count, total = db.query(func.count(AnalysisCache.id), func.coalesce(func.sum(AnalysisCache.size), 0)).one()
+        evicted = []
+        if count > self.max_entries or total > self.max_bytes:
+            # Walk from least recently used until both caps are satisfied
+            for entry_id, size in db.query(AnalysisCache.id, AnalysisCache.size).order_by(AnalysisCache.last_accessed_at):
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                evicted.append(entry_id)
+                count -= 1
+                total -= size
+            db.query(AnalysisCache).filter(AnalysisCache.id.in_(evicted)).delete(synchronize_session=False)
+        db.commit()
+        if expired or evicted:
+            logger.info(f"Evicted {expired} expired and {len(evicted)} least recently used cache entries")
+
+    def stats(self):
+        with self.session_factory() as db:
+            entries, size = db.query(func.count(AnalysisCache.id), func.coalesce(func.sum(AnalysisCache.size), 0)).one()
+            saved = db.query(func.coalesce(func.sum(AnalysisCache.hit_count), 0)).scalar()
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size, "lifetime_hits": saved}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Function to get the process-wide result cache
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
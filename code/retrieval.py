@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+import config
+from chunking import chunk_text
+
+logger = logging.getLogger(__name__)
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+class Embedder:
+    """Sentence embeddings from a local transformers model, mean-pooled and L2-normalised, on CPU."""
+
+    def __init__(self, model_name=None):
+        # Imported here so pages that never embed don't pay for loading torch
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.model_name = model_name or config.EMBEDDING_MODEL
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = AutoModel.from_pretrained(self.model_name)
+        self.model.eval()
+        # Embedding calls can come from several Streamlit sessions at once
+        self.lock = threading.Lock()
+
+    def embed(self, texts):
+        batches = []
+        with self.lock, self.torch.no_grad():
+            for i in range(0, len(texts), config.EMBEDDING_BATCH_SIZE):
+                batch = self.tokenizer(
+                    texts[i:i + config.EMBEDDING_BATCH_SIZE],
+                    padding=True,
+                    truncation=True,
+                    return_tensors="pt",
+                )
+                output = self.model(**batch).last_hidden_state
+                mask = batch["attention_mask"].unsqueeze(-1).to(output.dtype)
+                pooled = (output * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                batches.append(self.torch.nn.functional.normalize(pooled, dim=1).numpy())
+        if not batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(batches).astype(np.float32)
+
+
+# Function to get the process-wide embedder, loading the model on first use
+def get_embedder():
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = Embedder()
+            logger.info(f"Loaded embedding model {_embedder.model_name}")
+        return _embedder
+
+
+class DocumentIndex:
+    """Passages of one document and their embeddings, memory-mapped from data/indexes/<document_id>/."""
+
+    def __init__(self, document_id):
+        self.path = os.path.join(config.INDEX_DIR, document_id)
+        with open(os.path.join(self.path, "passages.json"), encoding="utf-8") as f:
+            self.passages = json.load(f)
+        self.vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+
+    # Function to return the top-k (score, passage) pairs for a question by cosine similarity
+    def search(self, query, k=None):
+        k = min(k or config.RETRIEVAL_TOP_K, len(self.passages))
+        if k == 0:
+            return []
+        query_vector = get_embedder().embed([query])[0]
+        # Rows are normalised at build time, so the dot product is the cosine similarity
+        scores = self.vectors @ query_vector
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.passages[i]) for i in top]
+
+
+# Function to check whether a document already has an index on disk
+def index_exists(document_id):
+    return os.path.exists(os.path.join(config.INDEX_DIR, document_id, "vectors.npy"))
+
+
+# Function to chunk and embed a document once; later calls for the same document reuse the index
+def build_index(document_id, text):
+    if index_exists(document_id):
+        logger.info(f"Reusing retrieval index for document {document_id}")
+        return DocumentIndex(document_id)
+
+    passages = chunk_text(text, config.RETRIEVAL_CHUNK_TOKENS, config.RETRIEVAL_OVERLAP_TOKENS)
+    vectors = get_embedder().embed(passages)
+
+    path = os.path.join(config.INDEX_DIR, document_id)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "passages.json"), "w", encoding="utf-8") as f:
+        json.dump(passages, f)
+    # Written last and renamed into place, so a half-built index is never picked up
+    tmp_path = os.path.join(path, "vectors.tmp.npy")
+    np.save(tmp_path, vectors)
+    os.replace(tmp_path, os.path.join(path, "vectors.npy"))
+    logger.info(f"Built retrieval index for document {document_id}: {len(passages)} passages")
+    return DocumentIndex(document_id)
+
+
+# Function to load an existing index, or None if the document was never indexed
+def load_index(document_id):
+    if not document_id or not index_exists(document_id):
+        return None
+    return DocumentIndex(document_id)
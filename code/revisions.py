@@ -0,0 +1,141 @@
+"""Section diff between revisions of a proposal, so a re-upload only re-runs what changed.
+
+A document's text is split into sections at heading-like lines (or into paragraphs when it
+has no headings), and each section is hashed and tagged with the 5C categories its wording
+touches. When a new version is analysed in a conversation that already has an analysed
+version, the two section lists are compared and only the categories of added, removed or
+changed sections are re-run; the others keep their earlier analysis and score.
+"""
+import hashlib
+import re
+
+from prompts import CATEGORIES, SUB_ELEMENTS
+
+# Markdown headings, numbered headings ("2.1 Financing plan", "IV. Risks") and short all-caps lines
+HEADING = re.compile(
+    r"^(?:#{1,6}\s+\S.*"
+    r"|(?:\d{1,2}(?:\.\d{1,2})*\.?|[IVX]{1,5}\.|[A-H]\.)\s+[A-Z][^.!?]*"
+    r"|[A-Z][A-Z0-9 &,/()'-]{3,})$"
+)
+HEADING_MAX_CHARS = 100
+# Without headings, lines are grouped into blocks this long so sections stay comparable
+FALLBACK_LINES = 20
+TITLE_CHARS = 80
+
+# Terms that tie a section to a category, on top of the category's own sub-elements
+CATEGORY_TERMS = {
+    "Character": ("management", "sponsor", "reputation", "track record", "experience", "governance", "compliance", "litigation", "ownership"),
+    "Capacity": ("cash flow", "revenue", "margin", "profit", "debt service", "dscr", "ebitda", "income", "forecast", "tariff", "offtake"),
+    "Capital": ("equity", "net worth", "balance sheet", "liquidity", "capital", "reserves", "leverage", "funding"),
+    "Collateral": ("collateral", "security", "guarantee", "pledge", "mortgage", "valuation", "insurance", "liquidation"),
+    "Conditions": ("market", "economic", "industry", "inflation", "interest rate", "political", "regulation", "climate", "disaster", "flood", "demand"),
+}
+CATEGORY_KEYWORDS = {
+    category: tuple(sorted({term.lower() for term in CATEGORY_TERMS[category] + SUB_ELEMENTS[category]}))
+    for category in CATEGORIES
+}
+
+
+def _is_heading(line):
+    return len(line) <= HEADING_MAX_CHARS and HEADING.match(line) is not None
+
+
+# Function to split document text into [(title, text)] at heading-like lines, falling back to paragraphs
+def _split(text):
+    lines = [line.strip() for line in text.splitlines()]
+    if sum(1 for line in lines if line and _is_heading(line)) >= 2:
+        sections = []
+        title, body = "Preamble", []
+        for line in lines:
+            if line and _is_heading(line):
+                if body:
+                    sections.append((title, "\n".join(body)))
+                title, body = line.lstrip("#").strip(), []
+            elif line:
+                body.append(line)
+        if body:
+            sections.append((title, "\n".join(body)))
+        return sections
+
+    paragraphs = [block.strip() for block in re.split(r"\n\s*\n", text) if block.strip()]
+    if len(paragraphs) < 2:
+        # One unbroken block (e.g. extracted PDF text): fixed runs of lines
+        content = [line for line in lines if line]
+        paragraphs = ["\n".join(content[i:i + FALLBACK_LINES]) for i in range(0, len(content), FALLBACK_LINES)]
+    return [(paragraph.splitlines()[0][:TITLE_CHARS], paragraph) for paragraph in paragraphs]
+
+
+# Function to find the categories a section's wording touches; sections matching none count for all
+def section_categories(text):
+    lowered = text.lower()
+    matched = [category for category in CATEGORIES if any(keyword in lowered for keyword in CATEGORY_KEYWORDS[category])]
+    return matched or list(CATEGORIES)
+
+
+# Function to split document text into a manifest of sections: [{"title", "hash", "categories"}].
+# Hashes ignore case and whitespace, so re-flowed text does not count as changed.
+def split_sections(text):
+    sections = []
+    for title, body in _split(text):
+        normalized = " ".join(body.lower().split())
+        sections.append({
+            "title": title[:TITLE_CHARS],
+            "hash": hashlib.sha256(normalized.encode("utf-8")).hexdigest(),
+            "categories": section_categories(body),
+        })
+    return sections
+
+
+# Function to compare two manifests; returns {"added", "removed", "changed", "unchanged"}, where the first
+# three are lists of sections (changed ones as they are in the new version) and "unchanged" is a count
+def diff_sections(old, new):
+    old_hashes = {section["hash"] for section in old}
+    new_hashes = {section["hash"] for section in new}
+    # Sections whose text changed keep their title; those are matched up rather than added and removed
+    old_by_title = {}
+    for section in old:
+        if section["hash"] not in new_hashes:
+            old_by_title.setdefault(section["title"].lower(), section)
+
+    added, changed, matched = [], [], set()
+    unchanged = 0
+    for section in new:
+        if section["hash"] in old_hashes:
+            unchanged += 1
+            continue
+        previous = old_by_title.get(section["title"].lower())
+        if previous is not None and previous["hash"] not in matched:
+            matched.add(previous["hash"])
+            changed.append({**section, "categories": sorted(set(section["categories"]) | set(previous["categories"]))})
+        else:
+            added.append(section)
+    removed = [section for section in old if section["hash"] not in new_hashes and section["hash"] not in matched]
+    return {"added": added, "removed": removed, "changed": changed, "unchanged": unchanged}
+
+
+# Function to get the categories a diff touches, in the usual 5C order
+def affected_categories(diff):
+    touched = set()
+    for kind in ("added", "removed", "changed"):
+        for section in diff[kind]:
+            touched.update(section["categories"])
+    return [category for category in CATEGORIES if category in touched]
+
+
+# Function to plan the re-analysis of a new version: which requested categories must run again and which
+# can keep their earlier result (only those in `available`, i.e. analysed before in this conversation)
+def plan_revision(previous, sections, categories, available):
+    diff = diff_sections(previous["sections"], sections)
+    affected = affected_categories(diff)
+    rerun = [category for category in categories if category in affected or category not in available]
+    reused = [category for category in categories if category not in rerun]
+    return {
+        "previous_job_id": previous["id"],
+        "added": [section["title"] for section in diff["added"]],
+        "removed": [section["title"] for section in diff["removed"]],
+        "changed": [section["title"] for section in diff["changed"]],
+        "unchanged": diff["unchanged"],
+        "rerun": rerun,
+        "reused": reused,
+        "score_changes": {},
+    }
@@ -0,0 +1,289 @@
+"""Process-wide scheduler for LLM API calls.
+
+Every Streamlit session, background job and summary shares one process and one API key, so every
+call to the API first takes a slot here. At most config.LLM_MAX_IN_FLIGHT calls run at once and,
+if config.LLM_TOKENS_PER_MINUTE is set, their tokens must fit the per-minute budget. Waiting calls
+are served by priority (chat, then summaries, then 5C runs); within a priority the caller with the
+fewest calls running goes first, then the one served longest ago, so one underwriter's large run
+can't hold up everyone else. A waiting call gains priority over time, so bulk runs still progress
+under a steady stream of chat. When too many background calls are queued, new ones are turned
+away with Busy, which callers report to the user instead of piling up more work.
+
+Callers say who they are and how urgent their calls are with `caller(owner, priority)`; the
+context is inherited by the analysis worker threads like the metrics run is. A `queue_clock()`
+measures how long work has run with its calls' queueing left out, so a timeout only counts the
+time the work could actually use the API.
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", BULK: "bulk"}
+# Waiters re-check aging and report their position at least this often (seconds)
+POLL_SECONDS = 0.5
+
+
+class Busy(Exception):
+    """Raised when a call is turned away or waits longer than config.LLM_QUEUE_MAX_WAIT for a slot."""
+
+
+# (owner, priority, on_wait) of the calls made in the current context; calls outside any caller()
+# block, e.g. from batch_score.py, share one bulk owner
+_caller = contextvars.ContextVar("realm_llm_caller", default=("shared", BULK, None))
+
+
+# Context manager that attributes the LLM calls made inside it to an owner and priority.
+# `on_wait(position)` is called from the waiting thread while a call is queued, with the number of
+# calls that will be served first.
+@contextmanager
+def caller(owner, priority, on_wait=None):
+    token = _caller.set((owner, priority, on_wait))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+# Queue clocks of the work the current context is part of, outermost first
+_clocks = contextvars.ContextVar("realm_llm_queue_clocks", default=())
+
+
+class QueueClock:
+    """Time since the clock started, less the time any of the calls made under it spent queued."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.queued = 0.0
+        # Calls queued right now; while there are any the clock is paused
+        self.waiters = 0
+        self.paused_at = None
+
+    def pause(self):
+        with self.lock:
+            if not self.waiters:
+                self.paused_at = time.monotonic()
+            self.waiters += 1
+
+    def resume(self):
+        with self.lock:
+            self.waiters -= 1
+            if not self.waiters:
+                self.queued += time.monotonic() - self.paused_at
+                self.paused_at = None
+
+    def elapsed(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            queued = self.queued + (now - self.paused_at if self.paused_at is not None else 0.0)
+        return now - self.started - queued
+
+
+# Context manager that starts a QueueClock for the work done inside it. Clocks nest: a call made
+# under several clocks (a chunk of a category, say) pauses all of them while it is queued.
+@contextmanager
+def queue_clock():
+    clock = QueueClock()
+    token = _clocks.set(_clocks.get() + (clock,))
+    try:
+        yield clock
+    finally:
+        _clocks.reset(token)
+
+
+class Ticket:
+    """One call's place in the queue, and later its slot."""
+
+    def __init__(self, seq, owner, priority, tokens):
+        self.seq = seq
+        self.owner = owner
+        self.priority = priority
+        # Estimated tokens charged when the slot is granted; set used_tokens to settle the real count
+        self.tokens = tokens
+        self.used_tokens = None
+        self.queued_at = time.monotonic()
+        self.granted = False
+
+    def effective_priority(self, now):
+        if config.LLM_PRIORITY_AGING_SECONDS <= 0:
+            return self.priority
+        return max(INTERACTIVE, self.priority - int((now - self.queued_at) // config.LLM_PRIORITY_AGING_SECONDS))
+
+
+class Scheduler:
+    """Bounded, priority- and owner-fair admission of LLM API calls."""
+
+    def __init__(self, max_in_flight=None, tokens_per_minute=None, max_queued=None):
+        self.max_in_flight = max_in_flight or config.LLM_MAX_IN_FLIGHT
+        self.tokens_per_minute = config.LLM_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        self.max_queued = config.LLM_MAX_QUEUED if max_queued is None else max_queued
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.in_flight = 0
+        # Calls running per owner, and the grant number of each owner's latest call
+        self.running = {}
+        self.last_served = {}
+        self.sequence = itertools.count()
+        self.grants = itertools.count()
+        # Token budget, refilled continuously up to one minute's worth; may go negative after a call
+        # used more than its estimate
+        self.budget = float(self.tokens_per_minute)
+        self.refilled = time.monotonic()
+
+    def _refill(self, now):
+        if self.tokens_per_minute > 0:
+            self.budget = min(self.tokens_per_minute, self.budget + (now - self.refilled) * self.tokens_per_minute / 60.0)
+        self.refilled = now
+
+    def _order(self, ticket, now):
+        return (ticket.effective_priority(now), self.running.get(ticket.owner, 0), self.last_served.get(ticket.owner, -1), ticket.seq)
+
+    # Function to grant slots to waiting calls, in order; call with the condition held.
+    # Returns the seconds until the token budget admits the next call, or None.
+    def _dispatch(self):
+        now = time.monotonic()
+        self._refill(now)
+        granted = False
+        retry_in = None
+        while self.waiting and self.in_flight < self.max_in_flight:
+            ticket = min(self.waiting, key=lambda t: self._order(t, now))
+            if self.tokens_per_minute > 0:
+                # A call larger than the whole budget waits for a full minute's worth rather than forever
+                needed = min(ticket.tokens, self.tokens_per_minute)
+                if self.budget < needed:
+                    # Later calls don't jump ahead, or a large call could wait forever behind small ones
+                    retry_in = (needed - self.budget) * 60.0 / self.tokens_per_minute
+                    break
+                self.budget -= ticket.tokens
+            self.waiting.remove(ticket)
+            self.in_flight += 1
+            self.running[ticket.owner] = self.running.get(ticket.owner, 0) + 1
+            self.last_served[ticket.owner] = next(self.grants)
+            ticket.granted = True
+            granted = True
+        if granted:
+            metrics.LLM_IN_FLIGHT.set(self.in_flight)
+            self.condition.notify_all()
+        return retry_in
+
+    def _queued_background(self):
+        return sum(1 for ticket in self.waiting if ticket.priority != INTERACTIVE)
+
+    # Function to wait for a slot for a call of about `tokens` tokens; returns its Ticket, to be released.
+    # Raises Busy if the queue is full or the wait exceeds config.LLM_QUEUE_MAX_WAIT.
+    def acquire(self, tokens):
+        owner, priority, on_wait = _caller.get()
+        name = PRIORITY_NAMES[priority]
+        with self.condition:
+            # Chat is never turned away; a person is waiting for it and sends one message at a time
+            if priority != INTERACTIVE and self._queued_background() >= self.max_queued:
+                metrics.LLM_REJECTED.inc(priority=name, reason="queue_full")
+                raise Busy(f"The LLM API queue is full ({len(self.waiting)} calls waiting); please try again shortly")
+            ticket = Ticket(next(self.sequence), owner, priority, tokens)
+            self.waiting.append(ticket)
+            metrics.LLM_QUEUED.inc(priority=name)
+            deadline = ticket.queued_at + config.LLM_QUEUE_MAX_WAIT
+            clocks = _clocks.get()
+            for clock in clocks:
+                clock.pause()
+            try:
+                while True:
+                    retry_in = self._dispatch()
+                    if ticket.granted:
+                        break
+                    now = time.monotonic()
+                    if now >= deadline:
+                        metrics.LLM_REJECTED.inc(priority=name, reason="timeout")
+                        raise Busy(f"Waited {config.LLM_QUEUE_MAX_WAIT:.0f}s for the LLM API; it is too busy, please try again shortly")
+                    if on_wait is not None:
+                        order = self._order(ticket, now)
+                        position = sum(1 for other in self.waiting if self._order(other, now) < order)
+                        # The callback may render UI, so the queue isn't held up meanwhile
+                        self.condition.release()
+                        try:
+                            on_wait(position)
+                        finally:
+                            self.condition.acquire()
+                        if ticket.granted:
+                            break
+                    self.condition.wait(min(deadline - now, retry_in or POLL_SECONDS, POLL_SECONDS))
+            except BaseException:
+                # e.g. on_wait failed after the slot was granted; nothing was sent, so nothing is charged
+                if ticket.granted:
+                    ticket.used_tokens = 0
+                    self.release(ticket)
+                raise
+            finally:
+                for clock in clocks:
+                    clock.resume()
+                metrics.LLM_QUEUED.dec(priority=name)
+                if not ticket.granted:
+                    self.waiting.remove(ticket)
+
+        waited = time.monotonic() - ticket.queued_at
+        metrics.LLM_QUEUE_SECONDS.observe(waited, priority=name)
+        metrics.observe_span("llm_queue", waited)
+        return ticket
+
+    # Function to give back a call's slot and settle its token count
+    def release(self, ticket):
+        with self.condition:
+            self.in_flight -= 1
+            self.running[ticket.owner] -= 1
+            if not self.running[ticket.owner]:
+                del self.running[ticket.owner]
+            if self.tokens_per_minute > 0 and ticket.used_tokens is not None:
+                self.budget += ticket.tokens - ticket.used_tokens
+            metrics.LLM_IN_FLIGHT.set(self.in_flight)
+            self._dispatch()
+
+    # Function to describe the load, for the UI: calls running and waiting by priority, and the token budget left
+    def status(self):
+        with self.condition:
+            self._refill(time.monotonic())
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for ticket in self.waiting:
+                queued[PRIORITY_NAMES[ticket.priority]] += 1
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queued": queued,
+                "owners": len(self.running),
+                "tokens_per_minute": self.tokens_per_minute,
+                "token_budget": int(self.budget) if self.tokens_per_minute > 0 else None,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# Function to get the process-wide scheduler
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+            logger.info(
+                f"LLM scheduler: {_scheduler.max_in_flight} calls in flight, "
+                f"{_scheduler.tokens_per_minute or 'unlimited'} tokens per minute"
+            )
+        return _scheduler
+
+
+# Function to replace the process-wide scheduler so the next call picks up changed settings (used by benchmarks)
+def reset_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = None
@@ -0,0 +1,142 @@
+"""Structured 5C results: parsing the JSON block that ends each analysis, and storing it.
+
+Run directly to extract scores from analyses stored before structured output existed:
+
+    python scoring.py --backfill
+"""
+import argparse
+import json
+import logging
+import re
+
+from jsonschema import ValidationError, validate
+
+from database import session_scope
+from models import CategoryScore, Messages
+from prompts import SUB_ELEMENTS
+
+logger = logging.getLogger(__name__)
+
+# JSON schema of the structured result requested by prompts.build_structured_output_instructions
+SCORE_SCHEMA = {
+    "type": "object",
+    "required": ["score"],
+    "properties": {
+        "category": {"type": "string"},
+        "score": {"type": "number", "minimum": 0, "maximum": 100},
+        "sub_elements": {
+            "type": "object",
+            "additionalProperties": {"type": ["number", "null"], "minimum": 0, "maximum": 5},
+        },
+        "missing_data": {"type": "array", "items": {"type": "string"}},
+    },
+}
+
+JSON_BLOCK = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+# Free-text fallback for analyses without a JSON block, e.g. "Score: 85/100" or "**80** out of 100"
+PROSE_SCORE = re.compile(r"score\W{0,40}?(?:[a-z ]{0,20}\W{0,5})?(\d{1,3}(?:\.\d+)?)\**\s*(?:/\s*100|out of 100)", re.IGNORECASE)
+
+
+# Function to split an analysis into its prose and its validated structured result (or None)
+def split_structured(text):
+    for match in reversed(list(JSON_BLOCK.finditer(text))):
+        try:
+            data = json.loads(match.group(1))
+            validate(data, SCORE_SCHEMA)
+        except (json.JSONDecodeError, ValidationError) as e:
+            logger.warning(f"Ignoring invalid structured result: {str(e)[:200]}")
+            continue
+        prose = (text[:match.start()] + text[match.end():]).strip()
+        return prose, data
+    return text, None
+
+
+# Function to get a normalised structured result for a category, falling back to the score in the prose
+def parse_result(category, text):
+    _, data = split_structured(text)
+    if data is None:
+        match = PROSE_SCORE.search(text)
+        if not match or float(match.group(1)) > 100:
+            return None
+        data = {"score": float(match.group(1))}
+
+    # Every known element is present; uncovered ones are None so they aggregate as missing
+    sub_elements = {element: None for element in SUB_ELEMENTS.get(category, [])}
+    sub_elements.update(data.get("sub_elements") or {})
+    return {
+        "category": category,
+        "score": float(data["score"]),
+        "sub_elements": sub_elements,
+        "missing_data": list(data.get("missing_data") or []),
+    }
+
+
+# Function to store a structured result; returns the new row id
+def save_score(result, conversation_id=None, message_id=None, document_id=None, source=None, model=None):
+    with session_scope() as db:
+        row = CategoryScore(
+            conversation_id=conversation_id,
+            message_id=message_id,
+            document_id=document_id,
+            source=source,
+            category=result["category"],
+            score=result["score"],
+            sub_ratings=json.dumps(result["sub_elements"]),
+            missing_data=json.dumps(result["missing_data"]),
+            model=model,
+        )
+        db.add(row)
+        db.flush()
+        return row.id
+
+
+# Function to get the latest stored result of each category in a conversation, as
+# {category: result plus "message_id" and "model"}
+def latest_scores(conversation_id):
+    with session_scope() as db:
+        rows = db.query(CategoryScore).filter(CategoryScore.conversation_id == conversation_id).order_by(CategoryScore.id).all()
+        # Later rows overwrite earlier ones, so re-analyses win
+        return {
+            row.category: {
+                "category": row.category,
+                "score": row.score,
+                "sub_elements": json.loads(row.sub_ratings),
+                "missing_data": json.loads(row.missing_data),
+                "message_id": row.message_id,
+                "model": row.model,
+            }
+            for row in rows
+        }
+
+
+# Function to extract scores from stored analysis messages that don't have one yet
+def backfill_scores():
+    with session_scope() as db:
+        scored = {message_id for (message_id,) in db.query(CategoryScore.message_id).filter(CategoryScore.message_id.isnot(None))}
+        rows = (
+            db.query(Messages.id, Messages.conversation_id, Messages.category, Messages.content)
+            .filter(Messages.category.isnot(None), Messages.role == "assistant")
+            .all()
+        )
+    saved = 0
+    for message_id, conversation_id, category, content in rows:
+        if message_id in scored:
+            continue
+        result = parse_result(category, content or "")
+        if result is None:
+            logger.warning(f"No score found in message ID {message_id}")
+            continue
+        save_score(result, conversation_id=conversation_id, message_id=message_id)
+        saved += 1
+    return saved
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Structured 5C score maintenance.")
+    parser.add_argument("--backfill", action="store_true", help="Extract scores from existing analysis messages")
+    args = parser.parse_args()
+    if args.backfill:
+        logger.info(f"Stored {backfill_scores()} scores")
+    else:
+        parser.print_help()
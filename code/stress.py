@@ -0,0 +1,147 @@
+"""Monte Carlo stress testing of a project's structured 5C scores.
+
+A scenario is a list of shocks, each moving one sub-element rating (0-5 scale) by a normally
+distributed amount. Every draw re-rates all sub-elements at once, so a run is a handful of
+array operations over a (draws x categories x elements) block rather than a Python loop.
+"""
+import json
+import logging
+import time
+
+import numpy as np
+
+import config
+from portfolio import DEFAULT_WEIGHTS
+from prompts import CATEGORIES, SUB_ELEMENTS
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+HISTOGRAM_BINS = 50
+# One point of average sub-element rating (0-5) is worth this many points of category score (0-100)
+RATING_TO_SCORE = 100 / 5
+
+# Preset scenarios; "mean" and "sd" are in rating points, negative means worse
+SCENARIOS = {
+    "Rate rise": [
+        {"category": "Capacity", "element": "Debt-to-equity ratio", "mean": -0.5, "sd": 0.3},
+        {"category": "Capacity", "element": "Operating cash flow", "mean": -0.4, "sd": 0.3},
+        {"category": "Capital", "element": "Liquidity ratio", "mean": -0.4, "sd": 0.3},
+        {"category": "Collateral", "element": "Valuation of assets", "mean": -0.3, "sd": 0.3},
+        {"category": "Conditions", "element": "Economic conditions", "mean": -0.5, "sd": 0.4},
+    ],
+    "Commodity shock": [
+        {"category": "Capacity", "element": "Profit margins", "mean": -0.8, "sd": 0.5},
+        {"category": "Capacity", "element": "Revenue growth rate", "mean": -0.5, "sd": 0.4},
+        {"category": "Conditions", "element": "Industry trends", "mean": -0.6, "sd": 0.4},
+        {"category": "Conditions", "element": "Geopolitical risks", "mean": -0.4, "sd": 0.4},
+    ],
+    "Natural disaster": [
+        {"category": "Conditions", "element": "Natural disaster exposure", "mean": -1.5, "sd": 0.8},
+        {"category": "Collateral", "element": "Quality of assets", "mean": -0.8, "sd": 0.6},
+        {"category": "Collateral", "element": "Ease of liquidation", "mean": -0.5, "sd": 0.4},
+    ],
+}
+
+
+# Function to combine preset scenarios into one list of shocks, scaled by a severity multiplier
+def build_scenario(names, severity=1.0):
+    return [
+        {**shock, "mean": shock["mean"] * severity, "sd": shock["sd"] * severity}
+        for name in names
+        for shock in SCENARIOS[name]
+    ]
+
+
+# Function to get a project's scores and sub-element ratings from portfolio.load_scores() rows
+def project_profile(frame, project):
+    rows = frame[frame["project"] == project]
+    scores = dict(zip(rows["category"], rows["score"]))
+    ratings = {category: json.loads(value or "{}") for category, value in zip(rows["category"], rows["sub_ratings"])}
+    return scores, ratings
+
+
+# Function to lay out scores and ratings as arrays; unrated elements start at their category score
+def _baseline_arrays(scores, ratings):
+    elements = max(len(SUB_ELEMENTS[category]) for category in CATEGORIES)
+    base = np.array([scores.get(category, np.nan) for category in CATEGORIES], dtype=float)
+    rated = np.full((len(CATEGORIES), elements), np.nan)
+    for i, category in enumerate(CATEGORIES):
+        for j, element in enumerate(SUB_ELEMENTS[category]):
+            value = (ratings.get(category) or {}).get(element)
+            if value is not None:
+                rated[i, j] = value
+    known = ~np.isnan(rated)
+    start = np.where(known, rated, base[:, None] / RATING_TO_SCORE)
+    return base, start, known
+
+
+# Function to turn shocks into per-element mean and standard deviation arrays
+def _shock_arrays(shocks, shape):
+    mean = np.zeros(shape)
+    variance = np.zeros(shape)
+    for shock in shocks:
+        i = CATEGORIES.index(shock["category"])
+        j = SUB_ELEMENTS[shock["category"]].index(shock["element"])
+        # Shocks to the same element add up
+        mean[i, j] += shock["mean"]
+        variance[i, j] += shock["sd"] ** 2
+    return mean, np.sqrt(variance)
+
+
+# Function to run the Monte Carlo simulation for one project and summarise the stressed composite score
+def simulate(scores, ratings, shocks, draws=None, weights=None, correlation=None, seed=None):
+    draws = draws or config.STRESS_DRAWS
+    correlation = config.STRESS_CORRELATION if correlation is None else correlation
+    weights = DEFAULT_WEIGHTS if weights is None else weights
+    started = time.perf_counter()
+
+    base, start, known = _baseline_arrays(scores, ratings)
+    shock_mean, shock_sd = _shock_arrays(shocks, start.shape)
+    present = ~np.isnan(base)
+    w = np.array([float(weights.get(category, 0.0)) for category in CATEGORIES]) * present
+    if w.sum() <= 0:
+        raise ValueError("The project has no scored category with a non-zero weight")
+    # Only scored categories are simulated; weights are renormalised over them as in portfolio.composite_scores
+    base, start, known, w = base[present], start[present], known[present], w[present] / w[present].sum()
+    shock_mean, shock_sd = shock_mean[present], shock_sd[present]
+    categories = [category for category, keep in zip(CATEGORIES, present) if keep]
+    noise_sd = np.where(known, 1.0, 2.0) * config.STRESS_RATING_VOLATILITY
+    systemic, idiosyncratic = np.sqrt(correlation), np.sqrt(1 - correlation)
+
+    rng = np.random.default_rng(seed)
+    category_draws = np.empty((draws, len(categories)))
+    for offset in range(0, draws, config.STRESS_BATCH_DRAWS):
+        n = min(config.STRESS_BATCH_DRAWS, draws - offset)
+        shape = (n, *start.shape)
+        # One systemic factor per draw correlates the shocks across elements
+        z = systemic * rng.standard_normal((n, 1, 1)) + idiosyncratic * rng.standard_normal(shape)
+        delta = shock_mean + shock_sd * z + noise_sd * rng.standard_normal(shape)
+        stressed = np.clip(start + delta, 0, 5)
+        change = (stressed - start).mean(axis=2) * RATING_TO_SCORE
+        category_draws[offset:offset + n] = np.clip(base + change, 0, 100)
+
+    composite = category_draws @ w
+    baseline = float(base @ w)
+    percentiles = np.percentile(composite, PERCENTILES)
+    tail = composite[composite <= percentiles[PERCENTILES.index(5)]]
+    counts, edges = np.histogram(composite, bins=HISTOGRAM_BINS, range=(0, 100))
+    category_percentiles = np.percentile(category_draws, (5, 50), axis=0)
+    seconds = time.perf_counter() - started
+    logger.info(f"Ran {draws} stress draws over {len(categories)} categories in {seconds * 1000:.0f} ms")
+    return {
+        "draws": draws,
+        "baseline": baseline,
+        "mean": float(composite.mean()),
+        "std": float(composite.std()),
+        "percentiles": dict(zip(PERCENTILES, percentiles.tolist())),
+        # Mean of the worst 5% of draws
+        "expected_shortfall": float(tail.mean()),
+        "probability_fail": float((composite < config.STRESS_FAIL_SCORE).mean()),
+        "histogram": (counts, edges),
+        "categories": {
+            category: {"baseline": float(base[i]), "p5": float(category_percentiles[0, i]), "p50": float(category_percentiles[1, i])}
+            for i, category in enumerate(categories)
+        },
+        "seconds": seconds,
+    }
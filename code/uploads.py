@@ -0,0 +1,148 @@
+"""Content-addressed store for uploaded documents.
+
+Uploads are streamed to disk in chunks while being hashed and kept once per SHA-256, as
+<UPLOAD_DIR>/<hash[:2]>/<hash><extension>, whatever name they were uploaded under. Their
+metadata lives in the uploads table. Once all stored files together exceed
+config.UPLOAD_MAX_TOTAL_BYTES, the least recently used are evicted, except those that
+unfinished jobs still need.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+import config
+import database
+from models import Job, Upload
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(ValueError):
+    """Raised when an upload is rejected, e.g. because it is over the size limit."""
+
+
+def _blob_path(sha256, extension):
+    return os.path.join(config.UPLOAD_DIR, sha256[:2], f"{sha256}{extension}")
+
+
+def _upload_dict(upload):
+    return {
+        "sha256": upload.sha256,
+        "path": upload.path,
+        "original_name": upload.original_name,
+        "size": upload.size,
+        "upload_count": upload.upload_count,
+        "created_at": upload.created_at,
+        "last_used_at": upload.last_used_at,
+    }
+
+
+# Function to copy a file object to a temporary file in chunks; returns (temporary path, sha256, size)
+def _spool(fileobj, name):
+    os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+    if hasattr(fileobj, "seek"):
+        fileobj.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=config.UPLOAD_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for block in iter(lambda: fileobj.read(config.UPLOAD_CHUNK_BYTES), b""):
+                size += len(block)
+                if size > config.UPLOAD_MAX_FILE_BYTES:
+                    raise UploadError(
+                        f"{name} is larger than the {config.UPLOAD_MAX_FILE_BYTES / (1024 * 1024):.0f} MB upload limit"
+                    )
+                digest.update(block)
+                f.write(block)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+# Function to record a spooled file, moving it into place unless the same content is already stored
+def _register(tmp_path, sha256, size, name):
+    with database.session_scope() as db:
+        upload = db.query(Upload).filter(Upload.sha256 == sha256).first()
+        deduplicated = upload is not None and os.path.exists(upload.path)
+        if upload is None:
+            extension = os.path.splitext(name)[1].lower()
+            upload = Upload(sha256=sha256, path=_blob_path(sha256, extension), original_name=name, size=size, upload_count=0)
+            db.add(upload)
+        if not deduplicated:
+            os.makedirs(os.path.dirname(upload.path), exist_ok=True)
+            os.replace(tmp_path, upload.path)
+        upload.upload_count += 1
+        upload.last_used_at = datetime.utcnow()
+        db.flush()
+        return {**_upload_dict(upload), "deduplicated": deduplicated}
+
+
+# Function to store an uploaded file object (anything with read(n)) under its content hash.
+# Returns the upload's metadata, with "deduplicated" set if the content was already stored.
+def store_upload(fileobj, name):
+    tmp_path, sha256, size = _spool(fileobj, name)
+    try:
+        try:
+            upload = _register(tmp_path, sha256, size, name)
+        except IntegrityError:
+            # Another session stored the same content at the same moment; use its row
+            upload = _register(tmp_path, sha256, size, name)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if upload["deduplicated"]:
+        logger.info(f"Upload {name} is already stored as {upload['path']}")
+    else:
+        logger.info(f"Stored upload {name} ({size} bytes) as {upload['path']}")
+    evict(keep=sha256)
+    return upload
+
+
+# Function to get the metadata of a stored upload by its path, or None for files outside the store
+def find_upload(file_path):
+    with database.session_scope() as db:
+        upload = db.query(Upload).filter(Upload.path == file_path).first()
+        return _upload_dict(upload) if upload else None
+
+
+# Function to delete least recently used uploads until the store fits its quota; returns the deleted paths.
+# The upload with hash `keep` and files of unfinished jobs are never deleted.
+def evict(max_total_bytes=None, keep=None):
+    max_total_bytes = config.UPLOAD_MAX_TOTAL_BYTES if max_total_bytes is None else max_total_bytes
+    evicted = []
+    with database.session_scope() as db:
+        total = db.query(func.coalesce(func.sum(Upload.size), 0)).scalar()
+        if total <= max_total_bytes:
+            return evicted
+        in_use = {path for (path,) in db.query(Job.file_path).filter(Job.finished_at.is_(None))}
+        for upload in db.query(Upload).order_by(Upload.last_used_at):
+            if total <= max_total_bytes:
+                break
+            if upload.sha256 == keep or upload.path in in_use:
+                continue
+            evicted.append(upload.path)
+            total -= upload.size
+            db.delete(upload)
+
+    for path in evicted:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    logger.info(f"Evicted {len(evicted)} uploads; the store now holds {total} bytes")
+    return evicted
+
+
+# Function to get the number and total size of stored uploads
+def usage():
+    with database.session_scope() as db:
+        files, size = db.query(func.count(Upload.id), func.coalesce(func.sum(Upload.size), 0)).one()
+    return {"files": files, "bytes": size, "max_bytes": config.UPLOAD_MAX_TOTAL_BYTES}